@@ -9,9 +9,8 @@ from django.contrib import messages
 from events.models import Notice
 from django.contrib.auth.forms import PasswordChangeForm
 from django.contrib.auth import update_session_auth_hash
-from attendance.models import AttendanceEntry, Attendance
-from django.db.models import Count, Q
-from django.db import models
+from attendance.models import AttendanceSummary
+from django.db.models import Q
 from club.models import Club
 from teacher.models import TeacherProfile
 from result.models import StudentSGPA
@@ -229,10 +228,10 @@ def student_dashboard(request):
         memberships__status="active"
     )
 
-    # ttendance summary
-    entries = AttendanceEntry.objects.filter(student=user)
-    total_present = entries.filter(status__iexact="present").count()
-    total_absent = entries.filter(status__iexact="absent").count()
+    # Attendance summary (one row per subject, see AttendanceSummary)
+    subject_stats = AttendanceSummary.subject_stats(user)
+    total_present = sum(s["present"] for s in subject_stats)
+    total_absent = sum(s["absent"] for s in subject_stats)
     total_classes = total_present + total_absent
     overall_percent = round((total_present / total_classes) * 100, 2) if total_classes else 0
     notifications = [
@@ -247,19 +246,6 @@ def student_dashboard(request):
         vals = [float(x.sgpa) for x in sgpa_qs]
         overall_sgpa = round(sum(vals)/len(vals), 2)
 
-    subject_stats = (
-        entries.values("attendance__subject__name")
-        .annotate(
-            present=Count("id", filter=models.Q(status__iexact="present")),
-            absent=Count("id", filter=models.Q(status__iexact="absent")),
-        )
-        .order_by("attendance__subject__name")
-    )
-    for s in subject_stats:
-        total = s["present"] + s["absent"]
-        s["total"] = total
-        s["percent"] = round((s["present"] / total) * 100, 2) if total else 0
-
     notices = Notice.objects.filter(
         department=user.department
     ).order_by('-created_at')
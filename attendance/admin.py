@@ -1,6 +1,8 @@
 from django.contrib import admin
-from .models import Attendance, AttendanceEntry
+from .models import Attendance, AttendanceEntry, AttendanceSubmission, AttendanceSummary
 # Register your models here.
 
 admin.site.register(Attendance)
-admin.site.register(AttendanceEntry)
\ No newline at end of file
+admin.site.register(AttendanceEntry)
+admin.site.register(AttendanceSummary)
+admin.site.register(AttendanceSubmission)
\ No newline at end of file
@@ -0,0 +1,289 @@
+import datetime
+from collections import defaultdict
+from functools import cached_property
+
+import numpy as np
+from django.db.models import F
+
+from college_portal.utils import percent_of, rounded
+from . import columnar
+from .models import AttendanceBitmap, AttendanceRoster
+
+BENCHMARK = 75.0  # minimum attendance percent
+TREND_DAYS = 7  # rolling window of the trend lines
+RECENT_DAYS = 14  # attendance rate that projections carry forward
+WEEKDAYS = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+
+
+class DepartmentAttendance:
+    """Every attendance entry of a department (or the whole college) in a date range, as arrays.
+
+    Sessions are columns of session_*; entries are the marked bits of their
+    bitmaps flattened into entry_session (index into the session arrays),
+    entry_student and entry_present. All the reports below are bincounts
+    over those arrays, so their cost grows with the number of entries and
+    not with Python loops.
+    """
+
+    def __init__(self, date_from, date_to, session_subject, session_semester, session_date,
+                 entry_session, entry_student, entry_present):
+        self.date_from = date_from
+        self.date_to = date_to
+        self.session_subject = session_subject
+        self.session_semester = session_semester
+        self.session_date = session_date
+        self.entry_session = entry_session
+        self.entry_student = entry_student
+        self.entry_present = entry_present
+
+    @classmethod
+    def load(cls, department, date_from, date_to):
+        """Decode the AttendanceBitmaps of department (None for all) from date_from to date_to"""
+        rosters = AttendanceRoster.objects.all()
+        bitmaps = AttendanceBitmap.objects.filter(attendance__date__range=(date_from, date_to))
+        if department is not None:
+            rosters = rosters.filter(department=department)
+            bitmaps = bitmaps.filter(attendance__department=department)
+        roster_ids = {pk: columnar.unpack_ids(blob) for pk, blob in rosters.values_list("id", "student_ids")}
+        rows = list(
+            bitmaps.order_by()
+            .values_list("roster_id", "attendance__subject_id", "attendance__semester_id", "attendance__date",
+                         "marked", "present")
+        )
+
+        by_roster = defaultdict(list)
+        for index, row in enumerate(rows):
+            by_roster[row[0]].append(index)
+
+        sessions, students, present = [], [], []
+        for roster_id, indexes in by_roster.items():
+            ids = roster_ids[roster_id]
+            marked_bits = columnar.decode_bits([rows[i][4] for i in indexes], len(ids))
+            present_bits = columnar.decode_bits([rows[i][5] for i in indexes], len(ids))
+            row, col = np.nonzero(marked_bits)
+            sessions.append(np.asarray(indexes, dtype=np.int64)[row])
+            students.append(ids[col])
+            present.append(present_bits[row, col])
+
+        _, subjects, semesters, dates, _, _ = zip(*rows) if rows else ((),) * 6
+        return cls(
+            date_from, date_to,
+            np.asarray(subjects, dtype=np.int64),
+            np.asarray(semesters, dtype=np.int64),
+            np.asarray(dates, dtype="datetime64[D]"),
+            np.concatenate(sessions) if sessions else np.zeros(0, dtype=np.int64),
+            np.concatenate(students).astype(np.int64) if students else np.zeros(0, dtype=np.int64),
+            np.concatenate(present) if present else np.zeros(0, dtype=bool),
+        )
+
+    def __len__(self):
+        return len(self.entry_student)
+
+    @cached_property
+    def students(self):
+        """(student_ids, index of each entry's student in student_ids)"""
+        ids, inverse = np.unique(self.entry_student, return_inverse=True)
+        return ids, inverse.reshape(-1)
+
+    @cached_property
+    def subjects(self):
+        """(subject_ids, index of each session's subject in subject_ids)"""
+        ids, inverse = np.unique(self.session_subject, return_inverse=True)
+        return ids, inverse.reshape(-1)
+
+    @cached_property
+    def pairs(self):
+        """(student index, subject index, present, total) per (student, subject) taken"""
+        students, student_index = self.students
+        subjects, session_subject = self.subjects
+        # one integer key per pair, so grouping is a 1-D sort and not a row-wise one
+        keys, inverse = np.unique(student_index * len(subjects) + session_subject[self.entry_session],
+                                  return_inverse=True)
+        inverse = inverse.reshape(-1)
+        present = np.bincount(inverse, weights=self.entry_present, minlength=len(keys)).astype(np.int64)
+        return keys // len(subjects), keys % len(subjects), present, np.bincount(inverse, minlength=len(keys))
+
+    def _range_days(self):
+        return (self.date_to - self.date_from).days + 1
+
+    def student_counts(self):
+        """(student_ids, present, total)"""
+        students, index = self.students
+        present = np.bincount(index, weights=self.entry_present, minlength=len(students)).astype(np.int64)
+        return students, present, np.bincount(index, minlength=len(students))
+
+    def subject_stats(self, benchmark=BENCHMARK):
+        """Per subject: sessions held, present/total entries, percent and students below benchmark"""
+        subjects, session_subject = self.subjects
+        entry_subject = session_subject[self.entry_session]
+        n = len(subjects)
+        present = np.bincount(entry_subject, weights=self.entry_present, minlength=n).astype(np.int64)
+        total = np.bincount(entry_subject, minlength=n)
+
+        _, pair_subject, pair_present, pair_total = self.pairs
+        below = np.bincount(pair_subject, weights=percent_of(pair_present, pair_total) < benchmark, minlength=n)
+        semesters = np.zeros(n, dtype=np.int64)
+        semesters[session_subject] = self.session_semester
+        return {
+            "subject_id": subjects,
+            "semester_id": semesters,
+            "sessions": np.bincount(session_subject, minlength=n),
+            "present": present,
+            "total": total,
+            "percent": percent_of(present, total),
+            "below_benchmark": below.astype(np.int64),
+        }
+
+    def weekday_absence(self):
+        """(entries, absent, absent percent) per weekday, Monday first"""
+        # 1970-01-01 was a Thursday
+        weekday = (self.session_date.astype(np.int64) + 3) % 7
+        entry_day = weekday[self.entry_session]
+        total = np.bincount(entry_day, minlength=7)
+        absent = np.bincount(entry_day, weights=~self.entry_present, minlength=7).astype(np.int64)
+        return total, absent, percent_of(absent, total)
+
+    def trend(self, window=TREND_DAYS):
+        """Rolling attendance percent per day: (dates, overall, subject_ids, per_subject)
+
+        Each point covers the window days ending on that date; NaN where no
+        class was held in the window.
+        """
+        ndays = self._range_days()
+        day = (self.session_date - np.datetime64(self.date_from, "D")).astype(np.int64)
+        subjects, session_subject = self.subjects
+        n = len(subjects)
+        cell = (session_subject * ndays + day)[self.entry_session]
+        present = np.bincount(cell, weights=self.entry_present, minlength=n * ndays).reshape(n, ndays)
+        total = np.bincount(cell, minlength=n * ndays).reshape(n, ndays).astype(float)
+
+        start = np.maximum(np.arange(1, ndays + 1) - window, 0)
+
+        def rolling(counts):
+            # window sums from a cumulative sum with a leading zero
+            cum = np.concatenate([np.zeros(counts.shape[:-1] + (1,)), np.cumsum(counts, axis=-1)], axis=-1)
+            return cum[..., 1:] - cum[..., start]
+
+        dates = np.datetime64(self.date_from, "D") + np.arange(ndays)
+        overall = percent_of(rolling(present.sum(axis=0)), rolling(total.sum(axis=0)))
+        return dates, overall, subjects, percent_of(rolling(present), rolling(total))
+
+    def projection(self, until, recent_days=RECENT_DAYS, benchmark=BENCHMARK):
+        """Per student, where attendance heads by `until` (the semester end).
+
+        Each subject is expected to keep its session rate over the range;
+        each student their attendance rate of the last recent_days. Returns
+        (student_ids, present, total, percent, projected, attainable, needed):
+        attainable is the percent if every remaining class is attended and
+        needed the classes in a row it takes to reach benchmark now.
+        """
+        students, present, total = self.student_counts()
+        _, student_index = self.students
+        subjects, session_subject = self.subjects
+        remaining_days = max((until - self.date_to).days, 0)
+
+        # sessions still to come per subject, summed over each student's subjects
+        per_day = np.bincount(session_subject, minlength=len(subjects)) / self._range_days()
+        pair_student, pair_subject, _, _ = self.pairs
+        remaining = np.bincount(pair_student, weights=per_day[pair_subject] * remaining_days, minlength=len(students))
+
+        cutoff = np.datetime64(self.date_to - datetime.timedelta(days=recent_days))
+        recent = self.session_date[self.entry_session] > cutoff
+        recent_present = np.bincount(student_index[recent], weights=self.entry_present[recent], minlength=len(students))
+        recent_total = np.bincount(student_index[recent], minlength=len(students))
+        rate = np.where(recent_total > 0, recent_present / np.maximum(recent_total, 1),
+                        present / np.maximum(total, 1))
+
+        percent = percent_of(present, total)
+        projected = percent_of(present + rate * remaining, total + remaining)
+        attainable = percent_of(present + remaining, total + remaining)
+        needed = np.maximum(np.ceil((benchmark * total - 100.0 * present) / (100.0 - benchmark)), 0).astype(np.int64)
+        return students, present, total, percent, projected, attainable, needed
+
+def department_report(department, date_from, date_to, until, benchmark=BENCHMARK):
+    """Everything the analytics page and API show, as a JSON-ready dict"""
+    from account.models import Semester, User
+    from subject.models import Subject
+
+    data = DepartmentAttendance.load(department, date_from, date_to)
+    students, present, total, percent, projected, attainable, needed = data.projection(until, benchmark=benchmark)
+    subjects = data.subject_stats(benchmark)
+    weekday_total, weekday_absent, weekday_percent = data.weekday_absence()
+    dates, overall, trend_subjects, trend = data.trend()
+
+    short = np.flatnonzero(percent < benchmark)
+    short = short[np.argsort(percent[short], kind="stable")]
+    people = {
+        row["id"]: row for row in User.objects.filter(id__in=students[short].tolist()).values(
+            "id", "username", "first_name", "last_name",
+            semester_number=F("semester__semester"), registration_number=F("student_profile__registration_number"),
+        )
+    }
+    subject_names = Subject.objects.in_bulk(subjects["subject_id"].tolist())
+    semester_numbers = dict(Semester.objects.filter(id__in=subjects["semester_id"].tolist()).values_list("id", "semester"))
+
+    # change over the last trend window, in percentage points
+    last, previous = len(dates) - 1, len(dates) - 1 - TREND_DAYS
+    change = trend[:, last] - trend[:, previous] if previous >= 0 else np.full(len(trend_subjects), np.nan)
+
+    shortfall = []
+    for i in short.tolist():
+        person = people.get(int(students[i]), {})
+        shortfall.append({
+            "student_id": int(students[i]),
+            "name": f"{person.get('first_name', '')} {person.get('last_name', '')}".strip(),
+            "username": person.get("username"),
+            "registration_number": person.get("registration_number"),
+            "semester": person.get("semester_number"),
+            "present": int(present[i]),
+            "total": int(total[i]),
+            "percent": rounded([percent[i]])[0],
+            "projected": rounded([projected[i]])[0],
+            "attainable": rounded([attainable[i]])[0],
+            "needed": int(needed[i]),
+        })
+
+    subject_rows = []
+    for i, subject_id in enumerate(subjects["subject_id"].tolist()):
+        subject = subject_names.get(subject_id)
+        subject_rows.append({
+            "subject_id": subject_id,
+            "name": subject.name if subject else None,
+            "code": subject.code if subject else None,
+            "semester": semester_numbers.get(int(subjects["semester_id"][i])),
+            "sessions": int(subjects["sessions"][i]),
+            "present": int(subjects["present"][i]),
+            "total": int(subjects["total"][i]),
+            "percent": rounded([subjects["percent"][i]])[0],
+            "below_benchmark": int(subjects["below_benchmark"][i]),
+            "change": rounded([change[i]])[0],
+        })
+
+    return {
+        "department": {"id": department.id, "name": department.name} if department else None,
+        "from": date_from.isoformat(),
+        "to": date_to.isoformat(),
+        "until": until.isoformat(),
+        "benchmark": benchmark,
+        "summary": {
+            "students": len(students),
+            "sessions": len(data.session_date),
+            "entries": len(data),
+            "present": int(present.sum()),
+            "percent": rounded([percent_of(present.sum(), total.sum())])[0],
+            "below_benchmark": len(short),
+        },
+        "shortfall": shortfall,
+        "subjects": subject_rows,
+        "weekdays": [
+            {"day": day, "entries": int(weekday_total[i]), "absent": int(weekday_absent[i]),
+             "absent_percent": rounded([weekday_percent[i]])[0]}
+            for i, day in enumerate(WEEKDAYS)
+        ],
+        "trend": {
+            "window": TREND_DAYS,
+            "dates": [str(d) for d in dates],
+            "overall": rounded(overall),
+            "subjects": {str(s): rounded(trend[i]) for i, s in enumerate(trend_subjects.tolist())},
+        },
+    }
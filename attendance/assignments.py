@@ -0,0 +1,60 @@
+from django.core.cache import cache
+from django.db.models import Exists, OuterRef, Q
+
+from college_portal.utils import CacheVersion
+from routine.models import ClassRoutine
+from subject.models import Subject
+
+# Every change to ClassRoutine or Subject.teachers bumps the version (see the
+# receivers in attendance.models), orphaning all cached pair sets at once.
+# With the per-process locmem cache other workers only notice when their
+# copy expires, so cached pairs are for listing classes only; permission
+# checks go through is_assigned() or assigned_pairs(), which always read the
+# database.
+PAIRS_TTL = 60 * 5
+_version = CacheVersion("attendance:assignments:version")
+
+
+def invalidate_assignments():
+    _version.bump()
+
+
+def assigned_pairs(teacher):
+    """Frozenset of (subject_id, semester_id) the teacher may take attendance for.
+
+    Union of routine assignments and subjects assigned directly (M2M).
+    """
+    routine_pairs = ClassRoutine.objects.filter(teacher=teacher).values_list("subject_id", "semester_id")
+    m2m_pairs = Subject.objects.filter(teachers=teacher).values_list("id", "semester_id")
+    return frozenset(routine_pairs) | frozenset(m2m_pairs)
+
+
+def teacher_pairs(teacher):
+    """assigned_pairs(), cached per teacher, for pages that list the teacher's classes"""
+    key = f"attendance:pairs:{_version.get()}:{teacher.pk}"
+    pairs = cache.get(key)
+    if pairs is None:
+        pairs = assigned_pairs(teacher)
+        cache.set(key, pairs, PAIRS_TTL)
+    return pairs
+
+
+def is_assigned(teacher, subject_id, semester_id):
+    """Whether (subject_id, semester_id) is one of the teacher's pairs, read from the database"""
+    return (
+        ClassRoutine.objects.filter(teacher=teacher, subject_id=subject_id, semester_id=semester_id).exists()
+        or Subject.objects.filter(teachers=teacher, id=subject_id, semester_id=semester_id).exists()
+    )
+
+
+def assigned_to(teacher, subject="subject_id", semester="semester_id"):
+    """Q matching rows whose (subject, semester) is one of the teacher's pairs.
+
+    Two correlated EXISTS against the routine and subject tables, so the SQL
+    stays the same size however many classes the teacher has.
+    """
+    routine = ClassRoutine.objects.filter(
+        teacher=teacher, subject_id=OuterRef(subject), semester_id=OuterRef(semester))
+    direct = Subject.objects.filter(
+        teachers=teacher, id=OuterRef(subject), semester_id=OuterRef(semester))
+    return Q(Exists(routine)) | Q(Exists(direct))
@@ -0,0 +1,88 @@
+import numpy as np
+
+from college_portal.utils import percent_of
+
+# Student ids are stored as little-endian int32 and bits LSB first, so the
+# blobs read the same whichever platform wrote them.
+ID_DTYPE = np.dtype("<i4")
+
+
+def pack_ids(ids):
+    return np.asarray(ids, dtype=ID_DTYPE).tobytes()
+
+
+def unpack_ids(blob):
+    return np.frombuffer(blob, dtype=ID_DTYPE)
+
+
+def pack_bits(mask):
+    return np.packbits(np.asarray(mask, dtype=bool), bitorder="little").tobytes()
+
+
+def decode_bits(blobs, n):
+    """(len(blobs), n) bool matrix; blobs shorter than n bits are zero-padded"""
+    width = (n + 7) // 8
+    buf = b"".join(bytes(blob)[:width].ljust(width, b"\0") for blob in blobs)
+    packed = np.frombuffer(buf, dtype=np.uint8).reshape(len(blobs), width)
+    return np.unpackbits(packed, axis=1, count=n, bitorder="little").astype(bool)
+
+
+def encode_session(roster_ids, statuses):
+    """(marked, present) bitmaps of {student_id: status} over roster positions.
+
+    Every student in statuses must be on the roster.
+    """
+    position = {sid: i for i, sid in enumerate(roster_ids.tolist())}
+    marked = np.zeros(len(roster_ids), dtype=bool)
+    present = np.zeros(len(roster_ids), dtype=bool)
+    for sid, status in statuses.items():
+        marked[position[sid]] = True
+        present[position[sid]] = status.lower() == "present"
+    return pack_bits(marked), pack_bits(present)
+
+
+def decode_session(roster_ids, marked, present):
+    """{student_id: is_present} for the students marked in one session"""
+    n = len(roster_ids)
+    marked, present = decode_bits([marked, present], n)
+    return dict(zip(roster_ids[marked].tolist(), present[marked].tolist()))
+
+
+class AttendanceMatrix:
+    """A class's sessions x roster students, decoded from AttendanceBitmap rows.
+
+    marked[i, j] is set when student_ids[j] has an entry in session i and
+    present[i, j] when that entry says present. Sessions are ordered by date.
+    """
+
+    def __init__(self, student_ids, session_ids, subject_ids, dates, marked, present):
+        self.student_ids = student_ids
+        self.session_ids = session_ids
+        self.subject_ids = subject_ids
+        self.dates = dates
+        self.marked = marked
+        self.present = present
+
+    def __len__(self):
+        return len(self.session_ids)
+
+    def student_counts(self):
+        """(present, total) arrays aligned with student_ids"""
+        return self.present.sum(axis=0), self.marked.sum(axis=0)
+
+    def student_percent(self):
+        # 0, not NaN, for students never marked
+        return np.round(np.nan_to_num(percent_of(*self.student_counts())), 2)
+
+    def subject_counts(self):
+        """(subject_ids, present, total); present/total are subjects x students"""
+        subjects, rows = np.unique(self.subject_ids, return_inverse=True)
+        # one-hot session -> subject, so the grouping is a single matmul
+        onehot = np.zeros((len(subjects), len(self)), dtype=np.int32)
+        onehot[rows, np.arange(len(self))] = 1
+        return subjects, onehot @ self.present.astype(np.int32), onehot @ self.marked.astype(np.int32)
+
+    def subject_percent(self):
+        """(subject_ids, percent) over all students of the class"""
+        subjects, present, total = self.subject_counts()
+        return subjects, np.round(np.nan_to_num(percent_of(present.sum(axis=1), total.sum(axis=1))), 2)
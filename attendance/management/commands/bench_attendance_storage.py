@@ -0,0 +1,173 @@
+import datetime
+import json
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count, Q, Sum
+from django.db.models.expressions import RawSQL
+from account.models import Department, Semester, User
+from subject.models import Subject
+from attendance.models import Attendance, AttendanceBitmap, AttendanceEntry, AttendanceRoster
+
+BENCH_NAME = "__bench_attendance__"
+
+# Fixed-width columns per row (bigint ids, timestamp, int size), for the
+# size estimate on databases without pg_column_size()
+ID_BYTES = 8
+TIMESTAMP_BYTES = 8
+INT_BYTES = 4
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ("Compare AttendanceEntry rows with packed AttendanceBitmap storage for one synthetic "
+            "semester: stored size and per-student/per-subject report time")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--students", type=int, default=60)
+        parser.add_argument("--subjects", type=int, default=6)
+        parser.add_argument("--sessions", type=int, default=90, help="Sessions per subject")
+        parser.add_argument("--present-rate", type=float, default=0.85)
+        parser.add_argument("--repeat", type=int, default=5, help="Report timings are the median of this many runs")
+        parser.add_argument("--output", default=None, help="Write the JSON report here instead of stdout")
+
+    def handle(self, *args, **opts):
+        report = {"config": {k: opts[k] for k in ("students", "subjects", "sessions", "present_rate", "repeat")}}
+        report["config"]["database"] = connection.vendor
+        try:
+            # everything is generated inside a transaction that is rolled back
+            with transaction.atomic():
+                department, semester = self.seed(opts)
+                sessions = Attendance.objects.filter(department=department, semester=semester)
+                t0 = time.perf_counter()
+                AttendanceBitmap.objects.bulk_create(AttendanceBitmap.build(sessions), batch_size=1000)
+                report["bitmap_build_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+
+                report["storage"] = self.storage(department, semester)
+                report["report_ms"] = self.reports(department, semester, opts["repeat"])
+                raise _Rollback
+        except _Rollback:
+            pass
+
+        rows, bitmaps = report["storage"]["rows"], report["storage"]["bitmap"]
+        report["storage"]["ratio"] = round(rows["payload_bytes"] / bitmaps["payload_bytes"], 1)
+        ms = report["report_ms"]
+        ms["speedup"] = round(ms["rows"] / ms["bitmap"], 1) if ms["bitmap"] else None
+
+        out = json.dumps(report, indent=2)
+        if opts["output"]:
+            with open(opts["output"], "w", encoding="utf-8") as f:
+                f.write(out + "\n")
+            self.stdout.write(self.style.SUCCESS(f"Wrote {opts['output']}"))
+        else:
+            self.stdout.write(out)
+
+    def seed(self, opts):
+        rng = np.random.default_rng(0)
+        department = Department.objects.create(name=BENCH_NAME)
+        semester = Semester.objects.create(department=department, semester=1)
+        students = User.objects.bulk_create(
+            User(username=f"{BENCH_NAME}{i}", password="!", role="student", department=department, semester=semester)
+            for i in range(opts["students"])
+        )
+        subjects = Subject.objects.bulk_create(
+            Subject(name=f"Subject {j}", code=f"{BENCH_NAME}{j}", subject_type="theory",
+                    department=department, semester=semester)
+            for j in range(opts["subjects"])
+        )
+
+        start = datetime.date.today() - datetime.timedelta(days=opts["sessions"])
+        for day in range(opts["sessions"]):
+            made = Attendance.objects.bulk_create(
+                Attendance(department=department, semester=semester, subject=subject) for subject in subjects)
+            # date is auto_now_add, so spread the sessions afterwards
+            Attendance.objects.filter(pk__in=[a.pk for a in made]).update(
+                date=start + datetime.timedelta(days=day))
+
+        session_ids = list(
+            Attendance.objects.filter(department=department, semester=semester).values_list("id", flat=True))
+        present = rng.random((len(session_ids), len(students))) < opts["present_rate"]
+        AttendanceEntry.objects.bulk_create(
+            (AttendanceEntry(attendance_id=attendance_id, student=student,
+                             status="present" if present[i, j] else "absent")
+             for i, attendance_id in enumerate(session_ids) for j, student in enumerate(students)),
+            batch_size=5000,
+        )
+        return department, semester
+
+    def storage(self, department, semester):
+        entries = AttendanceEntry.objects.filter(attendance__department=department, attendance__semester=semester)
+        bitmaps = AttendanceBitmap.objects.filter(roster__department=department, roster__semester=semester)
+        rosters = AttendanceRoster.objects.filter(department=department, semester=semester)
+
+        entry_rows = entries.count()
+        status_bytes = sum(len(status) for status in entries.values_list("status", flat=True).iterator())
+        bitmap_bytes = sum(len(marked) + len(present) for marked, present in bitmaps.values_list("marked", "present"))
+        roster_bytes = sum(len(ids) for ids in rosters.values_list("student_ids", flat=True))
+
+        storage = {
+            "rows": {
+                "rows": entry_rows,
+                # id, attendance, student, marked_at + status text
+                "payload_bytes": entry_rows * (3 * ID_BYTES + TIMESTAMP_BYTES) + status_bytes,
+            },
+            "bitmap": {
+                "rows": bitmaps.count() + rosters.count(),
+                # attendance, roster, size, updated_at + bits; roster ids + department, semester, updated_at
+                "payload_bytes": (bitmaps.count() * (2 * ID_BYTES + INT_BYTES + TIMESTAMP_BYTES) + bitmap_bytes
+                                  + rosters.count() * (3 * ID_BYTES + TIMESTAMP_BYTES) + roster_bytes),
+            },
+        }
+        if connection.vendor == "postgresql":
+            # actual on-disk tuple sizes, headers included (indexes excluded)
+            for key, querysets in [("rows", [entries]), ("bitmap", [bitmaps, rosters])]:
+                storage[key]["tuple_bytes"] = sum(
+                    qs.aggregate(b=Sum(RawSQL(f'pg_column_size("{qs.model._meta.db_table}".*)', ())))["b"] or 0
+                    for qs in querysets
+                )
+        return storage
+
+    def reports(self, department, semester, repeat):
+        """Per-student and per-subject-per-student percentages from each store"""
+        results, timings = {}, {"rows": [], "bitmap": []}
+        for _ in range(repeat):
+            for name, build in [("rows", self.report_rows), ("bitmap", self.report_bitmap)]:
+                t0 = time.perf_counter()
+                results[name] = build(department, semester)
+                timings[name].append((time.perf_counter() - t0) * 1000)
+        if results["rows"] != results["bitmap"]:
+            raise CommandError("Row and bitmap reports disagree")
+        return {name: round(float(np.median(ms)), 3) for name, ms in timings.items()}
+
+    def report_rows(self, department, semester):
+        counts = (
+            AttendanceEntry.objects
+            .filter(attendance__department=department, attendance__semester=semester)
+            .values("student_id", "attendance__subject_id")
+            .annotate(present=Count("id", filter=Q(status__iexact="present")), total=Count("id"))
+        )
+        per_subject, per_student = {}, {}
+        for row in counts:
+            present, total = row["present"], row["total"]
+            per_subject[row["student_id"], row["attendance__subject_id"]] = (present, total)
+            p, t = per_student.get(row["student_id"], (0, 0))
+            per_student[row["student_id"]] = (p + present, t + total)
+        return per_student, per_subject
+
+    def report_bitmap(self, department, semester):
+        matrix = AttendanceBitmap.matrix(department, semester)
+        present, total = matrix.student_counts()
+        student_ids = matrix.student_ids.tolist()
+        per_student = {sid: (p, t) for sid, p, t in zip(student_ids, present.tolist(), total.tolist()) if t}
+        subjects, present, total = matrix.subject_counts()
+        per_subject = {}
+        for i, subject_id in enumerate(subjects.tolist()):
+            for sid, p, t in zip(student_ids, present[i].tolist(), total[i].tolist()):
+                if t:
+                    per_subject[sid, subject_id] = (p, t)
+        return per_student, per_subject
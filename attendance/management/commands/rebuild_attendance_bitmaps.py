@@ -0,0 +1,54 @@
+from itertools import groupby
+from operator import itemgetter
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from attendance.models import AttendanceBitmap, AttendanceEntry
+
+
+class Command(BaseCommand):
+    help = "Re-encode AttendanceBitmap from AttendanceEntry (or --verify it without writing)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--verify", action="store_true",
+                            help="Only report sessions whose bitmap differs from their entries; exit non-zero on drift")
+
+    def handle(self, *args, **opts):
+        if opts["verify"]:
+            self.verify()
+            return
+
+        with transaction.atomic():
+            # rosters are kept (and only extended) so positions stay stable
+            deleted = AttendanceBitmap.objects.all().delete()[0]
+            created = len(AttendanceBitmap.objects.bulk_create(AttendanceBitmap.build(), batch_size=1000))
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt attendance bitmaps: {created} sessions ({deleted} replaced)"))
+
+    def verify(self):
+        entries = (
+            AttendanceEntry.objects.order_by("attendance_id")
+            .values_list("attendance_id", "student_id", "status")
+            .iterator(chunk_size=5000)
+        )
+        expected = {
+            attendance_id: {sid: status.lower() == "present" for _, sid, status in group}
+            for attendance_id, group in groupby(entries, key=itemgetter(0))
+        }
+        stored = {bitmap.attendance_id: bitmap.statuses()
+                  for bitmap in AttendanceBitmap.objects.select_related("roster").iterator(chunk_size=1000)}
+
+        missing = expected.keys() - stored.keys()
+        extra = stored.keys() - expected.keys()
+        wrong = [k for k in expected.keys() & stored.keys() if expected[k] != stored[k]]
+
+        for label, keys in [("missing", missing), ("stale", extra), ("wrong", wrong)]:
+            for attendance_id in sorted(keys)[:20]:
+                self.stdout.write(f"{label}: attendance={attendance_id}")
+
+        if missing or extra or wrong:
+            raise CommandError(
+                f"Attendance bitmaps drifted: {len(missing)} missing, {len(extra)} stale, {len(wrong)} wrong "
+                "(run rebuild_attendance_bitmaps to fix)")
+        self.stdout.write(self.style.SUCCESS(f"Attendance bitmaps OK ({len(stored)} sessions)"))
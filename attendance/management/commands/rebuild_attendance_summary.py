@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from attendance.models import AttendanceEntry, AttendanceSummary
+
+FIELDS = ["present", "absent", "last_date"]
+
+
+class Command(BaseCommand):
+    help = "Recompute AttendanceSummary from AttendanceEntry (or --verify it without writing)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--verify", action="store_true",
+                            help="Only report rows that differ from a recount; exit non-zero on drift")
+
+    def handle(self, *args, **opts):
+        with transaction.atomic():
+            expected = {
+                (r["student_id"], r["subject_id"], r["semester_id"]): r
+                for r in AttendanceSummary.aggregate(AttendanceEntry.objects.all()).iterator()
+            }
+            if opts["verify"]:
+                self.verify(expected)
+                return
+
+            deleted = AttendanceSummary.objects.all().delete()[0]
+            AttendanceSummary.objects.bulk_create(
+                (AttendanceSummary(**row) for row in expected.values()), batch_size=1000)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt attendance summaries: {len(expected)} rows ({deleted} replaced)"))
+
+    def verify(self, expected):
+        stored = {
+            (r["student_id"], r["subject_id"], r["semester_id"]): r
+            for r in AttendanceSummary.objects.values("student_id", "subject_id", "semester_id", *FIELDS).iterator()
+        }
+        missing = expected.keys() - stored.keys()
+        extra = stored.keys() - expected.keys()
+        wrong = [k for k in expected.keys() & stored.keys()
+                 if any(expected[k][f] != stored[k][f] for f in FIELDS)]
+
+        for label, keys in [("missing", missing), ("stale", extra), ("wrong", wrong)]:
+            for student_id, subject_id, semester_id in sorted(keys)[:20]:
+                self.stdout.write(f"{label}: student={student_id} subject={subject_id} semester={semester_id}")
+
+        if missing or extra or wrong:
+            raise CommandError(
+                f"Attendance summaries drifted: {len(missing)} missing, {len(extra)} stale, {len(wrong)} wrong "
+                "(run rebuild_attendance_summary to fix)")
+        self.stdout.write(self.style.SUCCESS(f"Attendance summaries OK ({len(stored)} rows)"))
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.5 on 2026-10-18 18:01
+
+from django.conf import settings
+from django.db import migrations
+from django.db.models import Count, Max
+
+
+def drop_duplicate_entries(apps, schema_editor):
+    # Keep the most recent entry per (attendance, student) before the
+    # constraint goes on; older duplicates came from concurrent submissions.
+    AttendanceEntry = apps.get_model('attendance', 'AttendanceEntry')
+    dupes = (
+        AttendanceEntry.objects
+        .values('attendance_id', 'student_id')
+        .annotate(n=Count('id'), keep=Max('id'))
+        .filter(n__gt=1)
+    )
+    for row in dupes.iterator():
+        (AttendanceEntry.objects
+         .filter(attendance_id=row['attendance_id'], student_id=row['student_id'])
+         .exclude(id=row['keep'])
+         .delete())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0002_attendance_taken_at'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_duplicate_entries, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='attendanceentry',
+            unique_together={('attendance', 'student')},
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.5 on 2026-10-18 18:04
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, F, Max, Q
+
+
+def populate_summaries(apps, schema_editor):
+    AttendanceEntry = apps.get_model('attendance', 'AttendanceEntry')
+    AttendanceSummary = apps.get_model('attendance', 'AttendanceSummary')
+    rows = (
+        AttendanceEntry.objects
+        .values('student_id', subject_id=F('attendance__subject_id'), semester_id=F('attendance__semester_id'))
+        .annotate(
+            present=Count('id', filter=Q(status__iexact='present')),
+            absent=Count('id', filter=Q(status__iexact='absent')),
+            last_date=Max('attendance__date'),
+        )
+    )
+    AttendanceSummary.objects.bulk_create((AttendanceSummary(**row) for row in rows.iterator()), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0004_passwordresetotp'),
+        ('attendance', '0003_attendanceentry_unique_student'),
+        ('subject', '0002_subject_teachers'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AttendanceSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('present', models.PositiveIntegerField(default=0)),
+                ('absent', models.PositiveIntegerField(default=0)),
+                ('last_date', models.DateField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('semester', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='account.semester')),
+                ('student', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='attendance_summaries', to=settings.AUTH_USER_MODEL)),
+                ('subject', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='subject.subject')),
+            ],
+            options={
+                'unique_together': {('student', 'subject', 'semester')},
+            },
+        ),
+        migrations.RunPython(populate_summaries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,82 @@
+# Generated by Django 5.2.5 on 2026-10-18 18:14
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Max, Min, Q
+
+
+def merge_duplicate_sessions(apps, schema_editor):
+    # Sessions created twice for the same class and day (get_or_create race)
+    # are folded into the oldest one; an entry already present there wins.
+    Attendance = apps.get_model('attendance', 'Attendance')
+    AttendanceEntry = apps.get_model('attendance', 'AttendanceEntry')
+    AttendanceSummary = apps.get_model('attendance', 'AttendanceSummary')
+
+    dupes = (
+        Attendance.objects
+        .values('department_id', 'subject_id', 'semester_id', 'date')
+        .annotate(n=Count('id'), keep=Min('id'))
+        .filter(n__gt=1)
+    )
+    touched = set()
+    for row in list(dupes):
+        keep = row.pop('keep')
+        row.pop('n')
+        others = Attendance.objects.filter(**row).exclude(id=keep)
+        kept_students = set(AttendanceEntry.objects.filter(attendance_id=keep).values_list('student_id', flat=True))
+        moved = AttendanceEntry.objects.filter(attendance__in=others).exclude(student_id__in=kept_students)
+        # one entry per student from the remaining twins
+        for student_id, entry_id in moved.values('student_id').annotate(last=Max('id')).values_list('student_id', 'last'):
+            AttendanceEntry.objects.filter(id=entry_id).update(attendance_id=keep)
+        others.delete()
+        touched.add((row['subject_id'], row['semester_id']))
+
+    # recount the summaries of the classes that had twins
+    for subject_id, semester_id in touched:
+        AttendanceSummary.objects.filter(subject_id=subject_id, semester_id=semester_id).delete()
+        rows = (
+            AttendanceEntry.objects
+            .filter(attendance__subject_id=subject_id, attendance__semester_id=semester_id)
+            .values('student_id')
+            .annotate(
+                present=Count('id', filter=Q(status__iexact='present')),
+                absent=Count('id', filter=Q(status__iexact='absent')),
+                last_date=Max('attendance__date'),
+            )
+        )
+        AttendanceSummary.objects.bulk_create(
+            AttendanceSummary(subject_id=subject_id, semester_id=semester_id, **r) for r in rows)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0004_passwordresetotp'),
+        ('attendance', '0004_attendancesummary'),
+        ('subject', '0002_subject_teachers'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_sessions, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='attendance',
+            unique_together={('department', 'subject', 'semester', 'date')},
+        ),
+        migrations.AddIndex(
+            model_name='attendance',
+            index=models.Index(fields=['department', 'date'], name='attendance_dept_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='attendance',
+            index=models.Index(fields=['date'], name='attendance_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='attendanceentry',
+            index=models.Index(fields=['student', 'attendance'], name='attendance_entry_student_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='attendanceentry',
+            index=models.Index(fields=['attendance', 'status'], name='attendance_entry_status_idx'),
+        ),
+    ]
@@ -0,0 +1,79 @@
+# Generated by Django 5.2.5 on 2026-10-18 18:18
+
+from collections import defaultdict
+from itertools import groupby
+from operator import itemgetter
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+from attendance import columnar
+
+
+def populate_bitmaps(apps, schema_editor):
+    AttendanceEntry = apps.get_model('attendance', 'AttendanceEntry')
+    AttendanceRoster = apps.get_model('attendance', 'AttendanceRoster')
+    AttendanceBitmap = apps.get_model('attendance', 'AttendanceBitmap')
+
+    students = defaultdict(set)
+    for key in (
+        AttendanceEntry.objects
+        .values_list('attendance__department_id', 'attendance__semester_id', 'student_id')
+        .order_by().distinct().iterator()
+    ):
+        students[key[:2]].add(key[2])
+    rosters = {
+        key: AttendanceRoster.objects.create(
+            department_id=key[0], semester_id=key[1], student_ids=columnar.pack_ids(sorted(sids)))
+        for key, sids in students.items()
+    }
+
+    def bitmaps():
+        entries = (
+            AttendanceEntry.objects.order_by('attendance_id')
+            .values_list('attendance_id', 'attendance__department_id', 'attendance__semester_id', 'student_id', 'status')
+            .iterator(chunk_size=5000)
+        )
+        for (attendance_id, *key), group in groupby(entries, key=itemgetter(0, 1, 2)):
+            roster = rosters[tuple(key)]
+            ids = columnar.unpack_ids(roster.student_ids)
+            marked, present = columnar.encode_session(ids, {sid: status for *_, sid, status in group})
+            yield AttendanceBitmap(attendance_id=attendance_id, roster=roster, size=len(ids), marked=marked, present=present)
+
+    AttendanceBitmap.objects.bulk_create(bitmaps(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0004_passwordresetotp'),
+        ('attendance', '0005_attendance_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AttendanceRoster',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('student_ids', models.BinaryField(default=bytes)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('department', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='account.department')),
+                ('semester', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='account.semester')),
+            ],
+            options={
+                'unique_together': {('department', 'semester')},
+            },
+        ),
+        migrations.CreateModel(
+            name='AttendanceBitmap',
+            fields=[
+                ('attendance', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='bitmap', serialize=False, to='attendance.attendance')),
+                ('size', models.PositiveIntegerField()),
+                ('marked', models.BinaryField()),
+                ('present', models.BinaryField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('roster', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='bitmaps', to='attendance.attendanceroster')),
+            ],
+        ),
+        migrations.RunPython(populate_bitmaps, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.5 on 2026-10-18 19:26
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def copy_marked_at(apps, schema_editor):
+    # The best there is for existing entries: when the server saved them,
+    # which is what attendance.sync compared against so far
+    AttendanceEntry = apps.get_model('attendance', 'AttendanceEntry')
+    AttendanceEntry.objects.update(taken_at=F('marked_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0007_attendance_submissions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='attendanceentry',
+            name='taken_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(copy_marked_at, migrations.RunPython.noop),
+    ]
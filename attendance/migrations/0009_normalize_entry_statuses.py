@@ -0,0 +1,49 @@
+# Generated by Django 5.2.5 on 2026-10-18 19:48
+
+from collections import defaultdict
+
+from django.db import migrations
+from django.db.models import Count, Q
+
+
+def normalize_statuses(apps, schema_editor):
+    # mark_attendance used to store whatever the form posted ("Present",
+    # "late", ""). Everything but present counts as absent, as in the bitmaps;
+    # store it that way and recount the summaries 0004 built from the old values.
+    AttendanceEntry = apps.get_model('attendance', 'AttendanceEntry')
+    AttendanceSummary = apps.get_model('attendance', 'AttendanceSummary')
+    legacy = AttendanceEntry.objects.exclude(status__in=['present', 'absent'])
+    students = defaultdict(set)
+    for student_id, subject_id, semester_id in legacy.values_list(
+            'student_id', 'attendance__subject_id', 'attendance__semester_id').distinct().iterator():
+        students[subject_id, semester_id].add(student_id)
+    if not students:
+        return
+    legacy.filter(status__iexact='present').update(status='present')
+    legacy.update(status='absent')  # what is left
+
+    summaries = []
+    for (subject_id, semester_id), student_ids in students.items():
+        counts = {
+            row['student_id']: row
+            for row in AttendanceEntry.objects
+            .filter(student_id__in=student_ids, attendance__subject_id=subject_id, attendance__semester_id=semester_id)
+            .values('student_id')
+            .annotate(present=Count('id', filter=Q(status='present')), absent=Count('id', filter=Q(status='absent')))
+        }
+        for summary in AttendanceSummary.objects.filter(
+                student_id__in=student_ids, subject_id=subject_id, semester_id=semester_id):
+            summary.present, summary.absent = counts[summary.student_id]['present'], counts[summary.student_id]['absent']
+            summaries.append(summary)
+    AttendanceSummary.objects.bulk_update(summaries, ['present', 'absent'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0008_attendanceentry_taken_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(normalize_statuses, migrations.RunPython.noop),
+    ]
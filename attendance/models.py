@@ -1,7 +1,21 @@
-from django.db import models
+from collections import defaultdict
+from itertools import groupby
+from operator import itemgetter
+
+import numpy as np
+
+from django.db import models, transaction, connection
+from django.db.models import Count, F, Max, Q, Sum, Value
+from django.db.models.functions import Greatest, Lower
+from django.db.models.signals import post_save, post_delete, pre_delete, m2m_changed
+from django.dispatch import receiver
 from django.conf import settings
+from django.utils.timezone import localdate, now
 from account.models import Department, Semester
 from subject.models import Subject
+from routine.models import ClassRoutine
+from . import columnar
+from .assignments import invalidate_assignments
 
 
 class Attendance(models.Model):
@@ -13,18 +27,490 @@ class Attendance(models.Model):
     department = models.ForeignKey(Department, on_delete=models.CASCADE)
     semester = models.ForeignKey(Semester, on_delete=models.CASCADE)
     subject = models.ForeignKey(Subject, on_delete=models.CASCADE)
-    date = models.DateField(auto_now_add=True)
+    # a default, not auto_now_add, so sessions synced later keep the day they were taken
+    date = models.DateField(default=localdate)
     taken_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        # one session per class per day, so get_or_create() in
+        # mark_attendance can't create twins when two devices race
+        unique_together = ("department", "subject", "semester", "date")
+        indexes = [
+            models.Index(fields=["department", "date"], name="attendance_dept_date_idx"),
+            models.Index(fields=["date"], name="attendance_date_idx"),
+        ]
+
     def __str__(self):
         return f"{self.subject.name} - {self.department.name} - {self.semester.semester} - {self.date}"
 
+    def save_statuses(self, statuses, taken_at=None):
+        """Upsert {student_id: status} for this session, as taken at taken_at (default now).
+
+        Only students without an entry and entries whose status changed are
+        written, so a one-student correction touches one row and leaves
+        everyone else's marked_at alone; unchanged entries only have their
+        taken_at moved forward. Returns the number of rows written.
+        """
+        taken_at = taken_at or now()
+        with transaction.atomic():
+            # Serialize saves of this session so the summary deltas below are
+            # computed from what is really stored
+            Attendance.objects.select_for_update().filter(pk=self.pk).exists()
+            existing = dict(self.entries.values_list("student_id", "status"))
+            changed = {sid: status for sid, status in statuses.items() if existing.get(sid) != status}
+            unchanged = [sid for sid in statuses if sid not in changed]
+            if unchanged:
+                self.entries.filter(student_id__in=unchanged, taken_at__lt=taken_at).update(taken_at=taken_at)
+            if not changed:
+                return 0
+
+            if connection.features.supports_update_conflicts_with_target:
+                # INSERT ... ON CONFLICT (attendance, student) DO UPDATE: a
+                # second device submitting at the same time updates, not duplicates
+                AttendanceEntry.objects.bulk_create(
+                    [AttendanceEntry(attendance=self, student_id=sid, status=status, taken_at=taken_at)
+                     for sid, status in changed.items()],
+                    update_conflicts=True,
+                    unique_fields=["attendance", "student"],
+                    update_fields=["status", "marked_at", "taken_at"],
+                )
+            else:
+                AttendanceEntry.objects.bulk_create(
+                    [AttendanceEntry(attendance=self, student_id=sid, status=status, taken_at=taken_at)
+                     for sid, status in changed.items() if sid not in existing],
+                    ignore_conflicts=True,
+                )
+                for status, _ in self.STATUS_CHOICES:
+                    sids = [sid for sid, st in changed.items() if st == status and sid in existing]
+                    if sids:
+                        self.entries.filter(student_id__in=sids).update(
+                            status=status, marked_at=now(), taken_at=taken_at)
+
+            AttendanceSummary.record_changes(self, {sid: (existing.get(sid), status) for sid, status in changed.items()})
+            AttendanceBitmap.refresh(self.pk)
+            return len(changed)
+
 
 class AttendanceEntry(models.Model):
     attendance = models.ForeignKey(Attendance, on_delete=models.CASCADE, related_name='entries')
     student = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     status = models.CharField(max_length=10, choices=Attendance.STATUS_CHOICES)
     marked_at = models.DateTimeField(auto_now=True)
+    # when the status was taken: the client's clock for sessions synced from
+    # offline (attendance.sync), which may arrive out of order, else the save
+    taken_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ("attendance", "student")
+        indexes = [
+            models.Index(fields=["student", "attendance"], name="attendance_entry_student_idx"),
+            models.Index(fields=["attendance", "status"], name="attendance_entry_status_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.student} - {self.attendance.subject.name} ({self.status})"
+
+
+class AttendanceSummary(models.Model):
+    """Present/absent counts per (student, subject, semester).
+
+    Kept in step with AttendanceEntry inside the same transaction, so
+    dashboards read one row per subject instead of counting every entry.
+    `rebuild_attendance_summary` recomputes (or --verify checks) the table.
+    """
+    student = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='attendance_summaries')
+    subject = models.ForeignKey(Subject, on_delete=models.CASCADE)
+    semester = models.ForeignKey(Semester, on_delete=models.CASCADE)
+    # field names match Attendance.STATUS_CHOICES values
+    present = models.PositiveIntegerField(default=0)
+    absent = models.PositiveIntegerField(default=0)
+    last_date = models.DateField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ("student", "subject", "semester")
+
+    def __str__(self):
+        return f"{self.student} - {self.subject.name}: {self.present}/{self.total}"
+
+    @property
+    def total(self):
+        return self.present + self.absent
+
+    @property
+    def percent(self):
+        return round((self.present / self.total) * 100, 2) if self.total else 0.0
+
+    @staticmethod
+    def counted_as(status):
+        """The summary field an entry's status counts towards (None stays None)"""
+        if status is None:
+            return None
+        return "present" if status.lower() == "present" else "absent"
+
+    @staticmethod
+    def counts():
+        """present/absent Count()s over AttendanceEntry rows, matching counted_as()"""
+        present = Q(status__iexact="present")
+        return {"present": Count("id", filter=present), "absent": Count("id", filter=~present)}
+
+    @classmethod
+    def aggregate(cls, entries):
+        """Group an AttendanceEntry queryset into summary rows (as dicts)"""
+        return (
+            entries
+            .values("student_id", subject_id=F("attendance__subject_id"), semester_id=F("attendance__semester_id"))
+            .annotate(**cls.counts(), last_date=Max("attendance__date"))
+            .values("student_id", "subject_id", "semester_id", "present", "absent", "last_date")
+        )
+
+    @classmethod
+    def subject_stats(cls, student):
+        """Per-subject present/absent/total/percent dicts for dashboards, by subject name"""
+        stats = list(
+            cls.objects
+            .filter(student=student)
+            .values("subject_id", subject_name=F("subject__name"))
+            .annotate(present=Sum("present"), absent=Sum("absent"), last_date=Max("last_date"))
+            .order_by(Lower("subject__name"))
+        )
+        for rec in stats:
+            rec["subject"] = rec.pop("subject_name")
+            rec["total"] = rec["present"] + rec["absent"]
+            rec["percent"] = round((rec["present"] / rec["total"]) * 100, 2) if rec["total"] else 0.0
+        return stats
+
+    @classmethod
+    def record_changes(cls, attendance, changes):
+        """Apply {student_id: (old_status or None, new_status)} from one session"""
+        key = {"subject_id": attendance.subject_id, "semester_id": attendance.semester_id}
+        cls.objects.bulk_create(
+            [cls(student_id=sid, last_date=attendance.date, **key) for sid, (old, _) in changes.items() if old is None],
+            ignore_conflicts=True,
+        )
+        # one UPDATE per kind of change (new present, absent -> present, ...);
+        # "Present" -> "present" moves nothing
+        groups = defaultdict(list)
+        for sid, (old, new) in changes.items():
+            change = (cls.counted_as(old), cls.counted_as(new))
+            if change[0] != change[1]:
+                groups[change].append(sid)
+        for (old, new), sids in groups.items():
+            delta = {new: F(new) + 1}
+            if old is not None:
+                delta[old] = F(old) - 1
+            cls.objects.filter(student_id__in=sids, **key).update(
+                **delta, last_date=Greatest("last_date", Value(attendance.date)), updated_at=now())
+
+    @classmethod
+    def recount(cls, student_id, subject_id, semester_id, create=True):
+        """Recompute one row from its entries"""
+        entries = AttendanceEntry.objects.filter(
+            student_id=student_id, attendance__subject_id=subject_id, attendance__semester_id=semester_id)
+        row = next(iter(cls.aggregate(entries)), None)
+        key = {"student_id": student_id, "subject_id": subject_id, "semester_id": semester_id}
+        if row is None:
+            cls.objects.filter(**key).delete()
+        elif create:
+            cls.objects.update_or_create(**key, defaults={f: row[f] for f in ("present", "absent", "last_date")})
+        else:
+            cls.objects.filter(**key).update(**{f: row[f] for f in ("present", "absent", "last_date")})
+
+    @classmethod
+    def recount_many(cls, keys):
+        """recount(..., create=False) for many (student_id, subject_id, semester_id) keys.
+
+        One aggregate and one row query per subject-semester, then a single
+        delete and bulk_update however many students are involved.
+        """
+        students = defaultdict(set)
+        for student_id, subject_id, semester_id in keys:
+            students[subject_id, semester_id].add(student_id)
+        stale, counted = [], []
+        for (subject_id, semester_id), student_ids in students.items():
+            key = {"student_id__in": student_ids, "subject_id": subject_id, "semester_id": semester_id}
+            entries = AttendanceEntry.objects.filter(
+                student_id__in=student_ids, attendance__subject_id=subject_id, attendance__semester_id=semester_id)
+            counts = {row["student_id"]: row for row in cls.aggregate(entries)}
+            for summary in cls.objects.filter(**key):
+                row = counts.get(summary.student_id)
+                if row is None:
+                    stale.append(summary.pk)
+                    continue
+                for f in ("present", "absent", "last_date"):
+                    setattr(summary, f, row[f])
+                summary.updated_at = now()
+                counted.append(summary)
+        if stale:
+            cls.objects.filter(pk__in=stale).delete()
+        cls.objects.bulk_update(counted, ["present", "absent", "last_date", "updated_at"], batch_size=1000)
+
+
+class AttendanceRoster(models.Model):
+    """Frozen, ordered student list of one class (department + semester).
+
+    AttendanceBitmap stores one bit per roster position, so the list only
+    ever grows: a student who joins late takes the next position and the
+    bitmaps written before stay valid.
+    """
+    department = models.ForeignKey(Department, on_delete=models.CASCADE)
+    semester = models.ForeignKey(Semester, on_delete=models.CASCADE)
+    student_ids = models.BinaryField(default=bytes)  # little-endian int32s
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ("department", "semester")
+
+    def __str__(self):
+        return f"Roster of {self.semester} ({self.size} students)"
+
+    @property
+    def size(self):
+        return len(self.student_ids) // columnar.ID_DTYPE.itemsize
+
+    def ids(self):
+        return columnar.unpack_ids(self.student_ids)
+
+    @classmethod
+    def extend(cls, department_id, semester_id, student_ids):
+        """The class's roster, with any student_ids not on it appended"""
+        key = {"department_id": department_id, "semester_id": semester_id}
+        roster, _ = cls.objects.get_or_create(**key)
+        if set(student_ids).issubset(roster.ids().tolist()):
+            return roster
+        with transaction.atomic():
+            # re-read under lock so two saves can't hand out the same position
+            roster = cls.objects.select_for_update().get(**key)
+            new = sorted(set(student_ids).difference(roster.ids().tolist()))
+            if new:
+                roster.student_ids = bytes(roster.student_ids) + columnar.pack_ids(new)
+                roster.save(update_fields=["student_ids", "updated_at"])
+        return roster
+
+
+class AttendanceBitmap(models.Model):
+    """One session's entries packed as bits over its class roster.
+
+    AttendanceEntry stays the editable record; save_statuses() and the entry
+    receivers below keep this copy in step. Analytics read a whole semester
+    of these with matrix() instead of scanning one row per student per class.
+    `rebuild_attendance_bitmaps` recomputes (or --verify checks) the table.
+    """
+    attendance = models.OneToOneField(Attendance, on_delete=models.CASCADE, primary_key=True, related_name='bitmap')
+    roster = models.ForeignKey(AttendanceRoster, on_delete=models.CASCADE, related_name='bitmaps')
+    size = models.PositiveIntegerField()  # roster positions covered by the bits
+    marked = models.BinaryField()  # student has an entry
+    present = models.BinaryField()  # ... and it says present
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Bitmap of attendance {self.attendance_id} ({self.size} students)"
+
+    def statuses(self):
+        """{student_id: is_present} for the students marked in this session"""
+        return columnar.decode_session(self.roster.ids(), self.marked, self.present)
+
+    @classmethod
+    def encode(cls, attendance_id, roster, statuses):
+        marked, present = columnar.encode_session(roster.ids(), statuses)
+        return cls(attendance_id=attendance_id, roster=roster, size=roster.size, marked=marked, present=present)
+
+    @classmethod
+    def build(cls, sessions=None):
+        """Unsaved bitmaps for every session (of an Attendance queryset) with entries.
+
+        Rosters are extended with the sessions' students first.
+        """
+        entries = AttendanceEntry.objects.all()
+        if sessions is not None:
+            entries = entries.filter(attendance__in=sessions)
+        students = defaultdict(set)
+        for department_id, semester_id, student_id in (
+            entries
+            .values_list("attendance__department_id", "attendance__semester_id", "student_id")
+            .order_by().distinct().iterator()
+        ):
+            students[department_id, semester_id].add(student_id)
+        rosters = {key: AttendanceRoster.extend(*key, sids) for key, sids in students.items()}
+
+        entries = (
+            entries.order_by("attendance_id")
+            .values_list("attendance_id", "attendance__department_id", "attendance__semester_id", "student_id", "status")
+            .iterator(chunk_size=5000)
+        )
+        for (attendance_id, *key), group in groupby(entries, key=itemgetter(0, 1, 2)):
+            yield cls.encode(attendance_id, rosters[tuple(key)], {sid: status for *_, sid, status in group})
+
+    @classmethod
+    def refresh(cls, attendance_id, create=True):
+        """Re-encode one session from its entries"""
+        session = Attendance.objects.filter(pk=attendance_id).values("department_id", "semester_id").first()
+        statuses = dict(AttendanceEntry.objects.filter(attendance_id=attendance_id).values_list("student_id", "status"))
+        if session is None or not statuses:
+            cls.objects.filter(attendance_id=attendance_id).delete()
+            return
+        roster = AttendanceRoster.extend(session["department_id"], session["semester_id"], statuses)
+        bitmap = cls.encode(attendance_id, roster, statuses)
+        fields = {f: getattr(bitmap, f) for f in ("roster", "size", "marked", "present")}
+        if create:
+            cls.objects.update_or_create(attendance_id=attendance_id, defaults=fields)
+        else:
+            cls.objects.filter(attendance_id=attendance_id).update(**fields, updated_at=now())
+
+    @classmethod
+    def refresh_many(cls, attendance_ids):
+        """refresh(..., create=False) for many sessions: one build() and one bulk_update"""
+        bitmaps = list(cls.build(Attendance.objects.filter(pk__in=attendance_ids)))
+        for bitmap in bitmaps:
+            bitmap.updated_at = now()
+        cls.objects.bulk_update(bitmaps, ["roster", "size", "marked", "present", "updated_at"], batch_size=1000)
+        # sessions left without entries
+        cls.objects.filter(attendance_id__in=attendance_ids).exclude(
+            attendance_id__in=[bitmap.attendance_id for bitmap in bitmaps]).delete()
+
+    @classmethod
+    def matrix(cls, department, semester, subject=None, date_from=None, date_to=None):
+        """columnar.AttendanceMatrix of the class's sessions, oldest first"""
+        roster = AttendanceRoster.objects.filter(department=department, semester=semester).first()
+        student_ids = roster.ids() if roster else columnar.unpack_ids(b"")
+        bitmaps = cls.objects.filter(attendance__department=department, attendance__semester=semester)
+        if subject is not None:
+            bitmaps = bitmaps.filter(attendance__subject=subject)
+        if date_from:
+            bitmaps = bitmaps.filter(attendance__date__gte=date_from)
+        if date_to:
+            bitmaps = bitmaps.filter(attendance__date__lte=date_to)
+        rows = list(
+            bitmaps.order_by("attendance__date", "attendance_id")
+            .values_list("attendance_id", "attendance__subject_id", "attendance__date", "marked", "present")
+        )
+        session_ids, subject_ids, dates, marked, present = zip(*rows) if rows else ((),) * 5
+        n = len(student_ids)
+        return columnar.AttendanceMatrix(
+            student_ids,
+            np.asarray(session_ids, dtype=np.int64),
+            np.asarray(subject_ids, dtype=np.int64),
+            np.asarray(dates, dtype="datetime64[D]"),
+            columnar.decode_bits(marked, n),
+            columnar.decode_bits(present, n),
+        )
+
+
+class AttendanceSubmission(models.Model):
+    """A session applied through the sync API, under its client-generated key.
+
+    A retried submission finds its key here and gets the stored result back
+    instead of being applied a second time.
+    """
+    key = models.CharField(max_length=64, unique=True)
+    teacher = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='attendance_submissions')
+    attendance = models.ForeignKey(Attendance, on_delete=models.CASCADE, related_name='submissions')
+    digest = models.CharField(max_length=64)  # sha256 of the submitted session
+    taken_at = models.DateTimeField()  # client timestamp
+    written = models.PositiveIntegerField(default=0)
+    # students left alone because a newer status had been saved
+    skipped = models.JSONField(default=list, blank=True)
+    received_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
-        return f"{self.student} - {self.attendance.subject.name} ({self.status})"
\ No newline at end of file
+        return f"{self.key} - {self.attendance}"
+
+    def result(self, status):
+        return {"key": self.key, "status": status, "attendance_id": self.attendance_id,
+                "written": self.written, "skipped": self.skipped}
+
+
+def _deleted_directly(origin, model):
+    """Whether delete() was called on model's own rows, not on something they cascade from"""
+    if isinstance(origin, models.QuerySet):
+        return origin.model is model
+    return isinstance(origin, model)
+
+
+# save_statuses() keeps summaries current for bulk writes; these cover
+# single-row saves and deletes (admin).
+@receiver(post_save, sender=AttendanceEntry)
+def recount_summary_on_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    attendance = Attendance.objects.filter(pk=instance.attendance_id).values("subject_id", "semester_id").first()
+    if attendance:
+        AttendanceSummary.recount(instance.student_id, attendance["subject_id"], attendance["semester_id"])
+
+
+@receiver(post_delete, sender=AttendanceEntry)
+def recount_summary_on_delete(sender, instance, origin=None, **kwargs):
+    # Cascades are handled in bulk: deleting sessions by the receivers
+    # below, while deleting a student, subject or semester takes its
+    # summary rows along with the entries
+    if not _deleted_directly(origin, AttendanceEntry):
+        return
+    attendance = Attendance.objects.filter(pk=instance.attendance_id).values("subject_id", "semester_id").first()
+    if attendance:
+        AttendanceSummary.recount(instance.student_id, attendance["subject_id"], attendance["semester_id"], create=False)
+
+
+@receiver(pre_delete, sender=Attendance)
+def collect_summaries_on_session_delete(sender, origin=None, **kwargs):
+    # once per delete() call, for every session it takes
+    if not _deleted_directly(origin, Attendance) or hasattr(origin, "_summary_keys"):
+        return
+    sessions = origin if isinstance(origin, models.QuerySet) else Attendance.objects.filter(pk=origin.pk)
+    origin._summary_keys = set(
+        AttendanceEntry.objects.filter(attendance__in=sessions)
+        .values_list("student_id", "attendance__subject_id", "attendance__semester_id").distinct()
+    )
+
+
+@receiver(post_delete, sender=Attendance)
+def recount_summaries_on_session_delete(sender, origin=None, **kwargs):
+    # post_delete is only sent once every row is gone, so the first call recounts for all
+    keys = vars(origin).pop("_summary_keys", None) if origin is not None else None
+    if keys:
+        AttendanceSummary.recount_many(keys)
+
+
+# save_statuses() re-encodes the session's bitmap itself; these cover
+# single-row saves and deletes.
+@receiver(post_save, sender=AttendanceEntry)
+def refresh_bitmap_on_save(sender, instance, raw=False, **kwargs):
+    if not raw:
+        AttendanceBitmap.refresh(instance.attendance_id)
+
+
+@receiver(post_delete, sender=AttendanceEntry)
+def refresh_bitmap_on_delete(sender, instance, origin=None, **kwargs):
+    # Cascades are handled in bulk: a deleted session takes its bitmap with
+    # it, and deleted students are cleared by the receivers below
+    if _deleted_directly(origin, AttendanceEntry):
+        AttendanceBitmap.refresh(instance.attendance_id, create=False)
+
+
+@receiver(pre_delete, sender=settings.AUTH_USER_MODEL)
+def collect_bitmaps_on_student_delete(sender, origin=None, **kwargs):
+    # once per delete() call, for every user it takes
+    if not _deleted_directly(origin, sender) or hasattr(origin, "_bitmap_sessions"):
+        return
+    users = origin if isinstance(origin, models.QuerySet) else sender.objects.filter(pk=origin.pk)
+    origin._bitmap_sessions = set(
+        AttendanceEntry.objects.filter(student__in=users).values_list("attendance_id", flat=True).distinct())
+
+
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def refresh_bitmaps_on_student_delete(sender, origin=None, **kwargs):
+    sessions = vars(origin).pop("_bitmap_sessions", None) if origin is not None else None
+    if sessions:
+        AttendanceBitmap.refresh_many(sessions)
+
+
+# Teacher assignment cache (attendance.assignments)
+@receiver([post_save, post_delete], sender=ClassRoutine)
+@receiver([post_save, post_delete], sender=Subject)
+def invalidate_assignments_on_change(sender, **kwargs):
+    invalidate_assignments()
+
+
+@receiver(m2m_changed, sender=Subject.teachers.through)
+def invalidate_assignments_on_teachers_change(sender, action, **kwargs):
+    if action.startswith("post_"):
+        invalidate_assignments()
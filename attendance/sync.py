@@ -0,0 +1,264 @@
+import hashlib
+import json
+import re
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from account.models import User
+from routine.models import ClassRoutine
+from subject.models import Subject
+from .assignments import assigned_pairs
+from .models import Attendance, AttendanceSubmission
+
+MAX_SESSIONS = 50  # per request
+# How far back a queued session may be dated, and how far ahead a client's
+# clock may run
+MAX_AGE = timedelta(days=7)
+CLOCK_SKEW = timedelta(minutes=5)
+
+DAY_CODES = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]  # ClassRoutine.day_of_week, by weekday()
+
+_KEY_RE = re.compile(r"[A-Za-z0-9_-]{8,64}")
+_STATUSES = {value for value, _ in Attendance.STATUS_CHOICES}
+
+
+class BatchError(Exception):
+    """The batch was rejected as a whole; nothing was written"""
+
+    def __init__(self, errors, status=400):
+        super().__init__(errors)
+        self.errors = errors
+        self.status = status
+
+
+def _day_code(date):
+    return DAY_CODES[date.weekday()]
+
+
+def rosters(teacher):
+    """The teacher's classes with their students, for clients to cache offline"""
+    pairs = assigned_pairs(teacher)
+    subjects = Subject.objects.select_related("semester").in_bulk({subject_id for subject_id, _ in pairs})
+    days = defaultdict(set)
+    for subject_id, semester_id, day in ClassRoutine.objects.filter(teacher=teacher).values_list(
+            "subject_id", "semester_id", "day_of_week"):
+        days[subject_id, semester_id].add(day)
+    students = defaultdict(list)
+    for row in (
+        User.objects
+        .filter(role="student", department=teacher.department, semester_id__in={sem for _, sem in pairs})
+        .order_by("first_name", "last_name")
+        .values("id", "first_name", "last_name", "semester_id", "student_profile__registration_number")
+    ):
+        students[row["semester_id"]].append({
+            "id": row["id"],
+            "name": f"{row['first_name']} {row['last_name']}".strip(),
+            "registration_number": row["student_profile__registration_number"],
+        })
+
+    classes = []
+    for subject_id, semester_id in sorted(pairs):
+        subject = subjects.get(subject_id)
+        if subject is None:
+            continue
+        classes.append({
+            "subject_id": subject_id,
+            "subject": subject.name,
+            "code": subject.code,
+            "semester_id": semester_id,
+            "semester": subject.semester.semester if subject.semester_id == semester_id else None,
+            "days": sorted(days[subject_id, semester_id], key=DAY_CODES.index),
+            "students": students[semester_id],
+        })
+    return {"date": timezone.localdate().isoformat(), "classes": classes}
+
+
+def _digest(session):
+    canonical = {k: session[k] for k in ("subject_id", "semester_id", "extra")}
+    canonical["timestamp"] = session["taken_at"].isoformat()
+    canonical["statuses"] = sorted(session["statuses"].items())
+    return hashlib.sha256(json.dumps(canonical, sort_keys=True).encode()).hexdigest()
+
+
+def _parse_session(raw):
+    """Shape checks for one session; returns (session, error)"""
+    if not isinstance(raw, dict):
+        return None, "session must be an object"
+    key = raw.get("key")
+    if not isinstance(key, str) or not _KEY_RE.fullmatch(key):
+        return None, "key must be 8-64 letters, digits, '-' or '_'"
+    try:
+        taken_at = parse_datetime(raw.get("timestamp") or "")
+    except (TypeError, ValueError):
+        taken_at = None
+    if taken_at is None:
+        return None, "timestamp must be an ISO 8601 date and time"
+    if timezone.is_naive(taken_at):
+        taken_at = timezone.make_aware(taken_at)
+    subject_id, semester_id = raw.get("subject_id"), raw.get("semester_id")
+    if not all(isinstance(v, int) and not isinstance(v, bool) for v in (subject_id, semester_id)):
+        return None, "subject_id and semester_id must be integers"
+    statuses = raw.get("statuses")
+    if not isinstance(statuses, dict) or not statuses:
+        return None, "statuses must map student ids to 'present' or 'absent'"
+    try:
+        statuses = {int(sid): status for sid, status in statuses.items()}
+    except ValueError:
+        return None, "statuses must map student ids to 'present' or 'absent'"
+    if not all(isinstance(status, str) and status in _STATUSES for status in statuses.values()):
+        return None, "statuses must map student ids to 'present' or 'absent'"
+
+    session = {
+        "key": key,
+        "taken_at": taken_at,
+        "date": timezone.localdate(taken_at),
+        "subject_id": subject_id,
+        "semester_id": semester_id,
+        "extra": bool(raw.get("extra", False)),
+        "statuses": statuses,
+    }
+    session["digest"] = _digest(session)
+    return session, None
+
+
+def parse_batch(teacher, payload):
+    """Validate a whole batch against the routine and rosters.
+
+    Returns (sessions to apply, results of already-applied retries); raises
+    BatchError listing every problem, 409 when the only problems are keys
+    already used for a different submission.
+    """
+    raw_sessions = payload.get("sessions") if isinstance(payload, dict) else None
+    if not isinstance(raw_sessions, list) or not raw_sessions:
+        raise BatchError([{"error": "sessions must be a non-empty list"}])
+    if len(raw_sessions) > MAX_SESSIONS:
+        raise BatchError([{"error": f"at most {MAX_SESSIONS} sessions per request"}])
+    if teacher.department_id is None:
+        raise BatchError([{"error": "teacher has no department"}], status=403)
+
+    errors, conflicts, sessions = [], [], []
+    for index, raw in enumerate(raw_sessions):
+        session, error = _parse_session(raw)
+        if error:
+            errors.append({"index": index, "key": raw.get("key") if isinstance(raw, dict) else None, "error": error})
+        else:
+            session["index"] = index
+            sessions.append(session)
+
+    seen = set()
+    for session in sessions:
+        if session["key"] in seen:
+            errors.append({"index": session["index"], "key": session["key"], "error": "key repeated in this batch"})
+        seen.add(session["key"])
+
+    # everything the checks below need, in one query each
+    applied = AttendanceSubmission.objects.in_bulk([s["key"] for s in sessions], field_name="key")
+    routine = set(ClassRoutine.objects.filter(teacher=teacher).values_list("subject_id", "semester_id", "day_of_week"))
+    pairs = assigned_pairs(teacher)
+    subject_semesters = dict(Subject.objects.filter(
+        id__in={s["subject_id"] for s in sessions}, department=teacher.department_id).values_list("id", "semester_id"))
+    enrolled = set(User.objects.filter(
+        role="student", department=teacher.department_id, semester_id__in={s["semester_id"] for s in sessions},
+    ).values_list("id", "semester_id"))
+
+    now = timezone.now()
+    fresh, retried = [], []
+    for session in sessions:
+        done = applied.get(session["key"])
+        if done is not None:
+            if done.teacher_id != teacher.pk or done.digest != session["digest"]:
+                conflicts.append({"index": session["index"], "key": session["key"],
+                                  "error": "key already used for a different submission"})
+            else:
+                retried.append(done.result("duplicate"))
+            continue
+
+        pair = (session["subject_id"], session["semester_id"])
+        strangers = sorted(sid for sid in session["statuses"] if (sid, session["semester_id"]) not in enrolled)
+        error = None
+        if session["taken_at"] > now + CLOCK_SKEW:
+            error = "timestamp is in the future"
+        elif session["taken_at"] < now - MAX_AGE:
+            error = f"timestamp is more than {MAX_AGE.days} days old"
+        elif subject_semesters.get(session["subject_id"]) != session["semester_id"]:
+            error = "subject does not belong to this semester in your department"
+        elif session["extra"] and pair not in pairs:
+            error = "you are not assigned to this subject and semester"
+        elif not session["extra"] and (*pair, _day_code(session["date"])) not in routine:
+            error = "no class in your routine for this subject and semester on that day; send extra=true for extra classes"
+        elif strangers:
+            error = f"not students of this semester: {strangers[:10]}"
+
+        if error:
+            errors.append({"index": session["index"], "key": session["key"], "error": error})
+        else:
+            fresh.append(session)
+
+    if errors:
+        raise BatchError(sorted(errors + conflicts, key=lambda e: e["index"]))
+    if conflicts:
+        raise BatchError(conflicts, status=409)
+    return fresh, retried
+
+
+def apply_batch(teacher, sessions):
+    """Write validated sessions in one transaction; returns a result per session.
+
+    Sessions are applied in the order they were taken on the client, and a
+    student whose entry was taken later (a later edit that reached the server
+    first) keeps that newer status.
+    """
+    results = []
+    with transaction.atomic():
+        # lock in a fixed order, so two batches touching the same sessions can't deadlock
+        attendances = {}
+        for session in sorted(sessions, key=lambda s: (s["date"], s["subject_id"], s["semester_id"], s["key"])):
+            slot = (session["date"], session["subject_id"], session["semester_id"])
+            if slot not in attendances:
+                attendances[slot], _ = Attendance.objects.get_or_create(
+                    department_id=teacher.department_id,
+                    subject_id=session["subject_id"],
+                    semester_id=session["semester_id"],
+                    date=session["date"],
+                )
+                # the same lock save_statuses() takes; a concurrent retry of
+                # this batch waits here and then finds its submissions below
+                Attendance.objects.select_for_update().filter(pk=attendances[slot].pk).exists()
+
+        for session in sorted(sessions, key=lambda s: (s["taken_at"], s["key"])):
+            attendance = attendances[session["date"], session["subject_id"], session["semester_id"]]
+            done = AttendanceSubmission.objects.filter(key=session["key"]).first()
+            if done is not None:
+                results.append(done.result("duplicate"))
+                continue
+
+            newer = set(
+                attendance.entries
+                .filter(student_id__in=session["statuses"], taken_at__gt=session["taken_at"])
+                .values_list("student_id", flat=True)
+            )
+            written = attendance.save_statuses(
+                {sid: status for sid, status in session["statuses"].items() if sid not in newer},
+                taken_at=session["taken_at"])
+            submission = AttendanceSubmission.objects.create(
+                key=session["key"], teacher=teacher, attendance=attendance, digest=session["digest"],
+                taken_at=session["taken_at"], written=written, skipped=sorted(newer),
+            )
+            results.append(submission.result("applied"))
+    return results
+
+
+def submit(teacher, payload):
+    """Validate and apply a batch; results come back in request order"""
+    sessions, retried = parse_batch(teacher, payload)
+    try:
+        applied = apply_batch(teacher, sessions)
+    except IntegrityError:
+        # a key of this batch was stored by another request in the meantime
+        raise BatchError([{"error": "a session of this batch was submitted concurrently; retry the batch"}], status=409)
+    by_key = {result["key"]: result for result in retried + applied}
+    return [by_key[raw["key"]] for raw in payload["sessions"]]
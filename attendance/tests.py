@@ -1,3 +1,437 @@
-from django.test import TestCase
+import datetime
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from account.models import Department, Semester, User
+from subject.models import Subject
+from .assignments import teacher_pairs
+from .models import Attendance, AttendanceBitmap, AttendanceEntry, AttendanceSubmission, AttendanceSummary
+
+
+def verify(command):
+    """Run a rebuild_* command with --verify; raises CommandError on drift"""
+    call_command(command, "--verify", stdout=StringIO())
+
+
+class AttendanceTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.department = Department.objects.create(name="CSE")
+        cls.semester = Semester.objects.create(department=cls.department, semester=3)
+        cls.teacher = User.objects.create_user("teacher", password="pw", role="teacher", department=cls.department)
+        cls.students = [
+            User.objects.create_user(f"student{i}", password="pw", role="student", first_name=f"Student {i}",
+                                     department=cls.department, semester=cls.semester)
+            for i in range(6)
+        ]
+        cls.subjects = [cls.make_subject(i) for i in range(2)]
+
+    @classmethod
+    def make_subject(cls, i):
+        subject = Subject.objects.create(name=f"Subject {i}", code=f"CS30{i}", subject_type="theory",
+                                         department=cls.department, semester=cls.semester)
+        subject.teachers.add(cls.teacher)
+        return subject
+
+    def take(self, subject, day, statuses=None):
+        """A saved session of subject on day 1 + `day` of January"""
+        session = Attendance.objects.create(department=self.department, semester=self.semester, subject=subject,
+                                            date=datetime.date(2026, 1, 1 + day))
+        if statuses is None:
+            statuses = {s.id: "present" if (s.id + day) % 3 else "absent" for s in self.students}
+        session.save_statuses(statuses)
+        return session
+
+    def take_many(self, days, subjects=None):
+        return [self.take(subject, day) for day in range(days) for subject in subjects or self.subjects]
+
+
+class CascadeDeleteTests(AttendanceTestCase):
+    def test_deleting_a_session_recounts_its_summaries(self):
+        sessions = self.take_many(3)
+        sessions[0].delete()
+        verify("rebuild_attendance_summary")
+        verify("rebuild_attendance_bitmaps")
+        student = self.students[0]
+        summary = AttendanceSummary.objects.get(student=student, subject=self.subjects[0])
+        self.assertEqual(summary.total, 2)
+
+    def test_deleting_sessions_in_bulk(self):
+        self.take_many(4)
+        Attendance.objects.filter(subject=self.subjects[0], date__lte=datetime.date(2026, 1, 3)).delete()
+        verify("rebuild_attendance_summary")
+        verify("rebuild_attendance_bitmaps")
+        self.assertEqual(AttendanceSummary.objects.get(student=self.students[0], subject=self.subjects[0]).total, 1)
+
+    def test_deleting_the_last_session_drops_the_summaries(self):
+        session = self.take(self.subjects[0], 0)
+        session.delete()
+        self.assertFalse(AttendanceSummary.objects.filter(subject=self.subjects[0]).exists())
+
+    def test_deleting_one_entry_recounts_its_summary(self):
+        self.take_many(2)
+        AttendanceEntry.objects.filter(student=self.students[0]).first().delete()
+        verify("rebuild_attendance_summary")
+        verify("rebuild_attendance_bitmaps")
+
+    def test_deleting_a_student_or_semester(self):
+        self.take_many(3)
+        self.students[0].delete()
+        verify("rebuild_attendance_summary")
+        verify("rebuild_attendance_bitmaps")
+        self.semester.delete()
+        self.assertFalse(AttendanceEntry.objects.exists())
+        self.assertFalse(AttendanceSummary.objects.exists())
+        self.assertFalse(AttendanceBitmap.objects.exists())
+
+    def test_cascade_query_count_does_not_grow_with_entries(self):
+        def count(delete):
+            with CaptureQueriesContext(connection) as queries:
+                delete()
+            return len(queries)
+
+        self.take_many(2, subjects=self.subjects[:1])
+        small = [count(self.students[0].delete), count(Attendance.objects.first().delete)]
+
+        self.students = self.students[1:] + [
+            User.objects.create_user(f"late{i}", password="pw", role="student",
+                                     department=self.department, semester=self.semester)
+            for i in range(20)
+        ]
+        self.take_many(10, subjects=[self.make_subject(i) for i in range(2, 6)])
+        self.assertGreater(AttendanceEntry.objects.filter(student=self.students[0]).count(), 30)
+        large = [count(self.students[0].delete), count(Attendance.objects.last().delete)]
+
+        self.assertEqual(small, large)
+        verify("rebuild_attendance_summary")
+        verify("rebuild_attendance_bitmaps")
+
+
+class StudentAttendanceQueryTests(AttendanceTestCase):
+    def setUp(self):
+        self.client.force_login(self.students[0])
+        self.get()  # the first request after login also saves the session
+
+    def get(self, **params):
+        response = self.client.get(reverse("attendance"), params)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def count_queries(self, **params):
+        with CaptureQueriesContext(connection) as queries:
+            self.get(**params)
+        return len(queries)
+
+    def test_query_count_does_not_grow_with_subjects(self):
+        self.take_many(2)
+        ranges = [{}, {"start": "2026-01-01", "end": "2026-01-31"}]
+        expected = [self.count_queries(**params) for params in ranges]
+
+        self.take_many(3, subjects=[self.make_subject(i) for i in range(2, 8)])
+        for params, n in zip(ranges, expected):
+            with self.subTest(**params), self.assertNumQueries(n):
+                response = self.get(**params)
+            self.assertEqual(len(response.context["subject_stats"]), 8)
+
+    def test_date_range_counts_as_the_summaries_do(self):
+        self.take_many(3)
+        AttendanceEntry.objects.filter(student=self.students[0], status="absent").update(status="late")
+        call_command("rebuild_attendance_summary", stdout=StringIO())
+        stats = [self.get(**params).context["subject_stats"]
+                 for params in [{}, {"start": "2026-01-01", "end": "2026-01-31"}]]
+        self.assertEqual(*[[(r["subject"], r["present"], r["absent"], r["percent"]) for r in rows] for rows in stats])
+        self.assertTrue(any(r["absent"] for r in stats[0]))
+
+
+class StaleAssignmentTests(AttendanceTestCase):
+    """Permission checks must not trust another worker's cached assignments"""
+
+    def setUp(self):
+        self.client.force_login(self.teacher)
+        self.session = self.take(self.subjects[0], 0)
+        self.assertIn((self.subjects[0].id, self.semester.id), teacher_pairs(self.teacher))
+        # the removal is seen by this worker only; the cached pairs stay as they were
+        with mock.patch("attendance.models.invalidate_assignments"):
+            self.subjects[0].teachers.remove(self.teacher)
+        self.assertIn((self.subjects[0].id, self.semester.id), teacher_pairs(self.teacher))
+
+    def test_views_refuse_an_unassigned_class(self):
+        for url in [
+            reverse("teacher_attendance_detail", args=[self.session.id]),
+            reverse("export_class_attendance", args=[self.session.id]),
+            reverse("teacher_subject_attendance_history", args=[self.subjects[0].id, self.semester.id]),
+        ]:
+            with self.subTest(url=url):
+                self.assertRedirects(self.client.get(url), reverse("teacher_attendance_history"),
+                                     fetch_redirect_response=False)
+
+    def test_sync_refuses_an_unassigned_class(self):
+        response = self.client.post(reverse("attendance_sync_api"), {"sessions": [{
+            "key": "stale-assignment-1",
+            "timestamp": timezone.now().isoformat(),
+            "subject_id": self.subjects[0].id,
+            "semester_id": self.semester.id,
+            "statuses": {str(self.students[0].id): "present"},
+            "extra": True,
+        }]}, content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["errors"][0]["error"], "you are not assigned to this subject and semester")
+        classes = self.client.get(reverse("attendance_sync_api")).json()["classes"]
+        self.assertNotIn(self.subjects[0].id, [c["subject_id"] for c in classes])
+
+
+class SessionUniquenessMigrationTests(TransactionTestCase):
+    """0005 folds twin sessions into one before adding the unique constraint"""
+
+    before = [("attendance", "0004_attendancesummary")]
+    after = [("attendance", "0005_attendance_indexes")]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        self.migrate(MigrationExecutor(connection).loader.graph.leaf_nodes())
+
+    def test_twin_sessions_are_merged_without_losing_entries(self):
+        apps = self.migrate(self.before)
+        Department = apps.get_model("account", "Department")
+        Semester = apps.get_model("account", "Semester")
+        User = apps.get_model("account", "User")
+        Subject = apps.get_model("subject", "Subject")
+        Attendance = apps.get_model("attendance", "Attendance")
+        AttendanceEntry = apps.get_model("attendance", "AttendanceEntry")
+
+        department = Department.objects.create(name="CSE")
+        semester = Semester.objects.create(department=department, semester=3)
+        subject = Subject.objects.create(name="Subject", code="CS301", subject_type="theory",
+                                         department=department, semester=semester)
+        students = [User.objects.create(username=f"student{i}", role="student") for i in range(4)]
+        day = datetime.date(2026, 1, 5)
+        key = {"department": department, "semester": semester, "subject": subject}
+        first, second, third = (Attendance.objects.create(**key) for _ in range(3))
+        Attendance.objects.update(date=day)
+        other_day = Attendance.objects.create(**key, date=datetime.date(2026, 1, 6))
+        # students 0-1 in the oldest twin, 1-3 in the later ones; the oldest twin wins for student 1
+        for session, student, status in [
+            (first, 0, "present"), (first, 1, "present"),
+            (second, 1, "absent"), (second, 2, "absent"),
+            (third, 3, "present"), (other_day, 0, "absent"),
+        ]:
+            AttendanceEntry.objects.create(attendance=session, student=students[student], status=status)
+
+        apps = self.migrate(self.after)
+        Attendance = apps.get_model("attendance", "Attendance")
+        AttendanceEntry = apps.get_model("attendance", "AttendanceEntry")
+        AttendanceSummary = apps.get_model("attendance", "AttendanceSummary")
+
+        self.assertEqual(list(Attendance.objects.filter(date=day).values_list("id", flat=True)), [first.id])
+        self.assertEqual(
+            dict(AttendanceEntry.objects.filter(attendance_id=first.id).values_list("student__username", "status")),
+            {"student0": "present", "student1": "present", "student2": "absent", "student3": "present"})
+        self.assertEqual(AttendanceEntry.objects.filter(attendance_id=other_day.id).count(), 1)
+        self.assertEqual(
+            {row[0]: row[1:] for row in AttendanceSummary.objects.values_list("student__username", "present", "absent")},
+            {"student0": (1, 1), "student1": (1, 0), "student2": (0, 1), "student3": (1, 0)})
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Attendance.objects.create(department_id=department.id, semester_id=semester.id, subject_id=subject.id,
+                                      date=day)
+
+
+class LegacyStatusTests(AttendanceTestCase):
+    """Entries saved before statuses were validated hold whatever the form posted"""
+
+    def legacy_session(self):
+        session = self.take(self.subjects[0], 0, {s.id: "present" for s in self.students})
+        for student, status in zip(self.students, ["Present", "late", "", "ABSENT"]):
+            AttendanceEntry.objects.filter(attendance=session, student=student).update(status=status)
+        call_command("rebuild_attendance_summary", stdout=StringIO())
+        return session
+
+    def test_resaving_a_session_with_legacy_statuses(self):
+        session = self.legacy_session()
+        statuses = {s.id: "present" for s in self.students}
+        statuses[self.students[0].id] = "absent"
+        session.save_statuses(statuses)
+        verify("rebuild_attendance_summary")
+        summary = AttendanceSummary.objects.get(student=self.students[0], subject=self.subjects[0])
+        self.assertEqual((summary.present, summary.absent), (0, 1))
+
+    def test_legacy_statuses_count_as_absent_unless_present(self):
+        self.legacy_session()
+        counts = dict(AttendanceSummary.objects.values_list("student_id", "absent"))
+        self.assertEqual([counts[s.id] for s in self.students], [0, 1, 1, 1, 0, 0])
+
+
+class StatusNormalizationMigrationTests(TransactionTestCase):
+    """0009 rewrites legacy statuses as present/absent and recounts their summaries"""
+
+    before = [("attendance", "0008_attendanceentry_taken_at")]
+    after = [("attendance", "0009_normalize_entry_statuses")]
+
+    migrate = SessionUniquenessMigrationTests.migrate
+
+    def tearDown(self):
+        self.migrate(MigrationExecutor(connection).loader.graph.leaf_nodes())
+
+    def test_legacy_statuses_are_normalized(self):
+        apps = self.migrate(self.before)
+        Department = apps.get_model("account", "Department")
+        Semester = apps.get_model("account", "Semester")
+        User = apps.get_model("account", "User")
+        Subject = apps.get_model("subject", "Subject")
+        Attendance = apps.get_model("attendance", "Attendance")
+        AttendanceEntry = apps.get_model("attendance", "AttendanceEntry")
+        AttendanceSummary = apps.get_model("attendance", "AttendanceSummary")
+
+        department = Department.objects.create(name="CSE")
+        semester = Semester.objects.create(department=department, semester=3)
+        subject = Subject.objects.create(name="Subject", code="CS301", subject_type="theory",
+                                         department=department, semester=semester)
+        session = Attendance.objects.create(department=department, semester=semester, subject=subject)
+        statuses = ["Present", "late", "", "absent"]
+        for i, status in enumerate(statuses):
+            student = User.objects.create(username=f"student{i}", role="student")
+            AttendanceEntry.objects.create(attendance=session, student=student, status=status)
+            # as 0004 counted them
+            AttendanceSummary.objects.create(student=student, subject=subject, semester=semester,
+                                             present=int(status == "Present"), absent=int(status == "absent"),
+                                             last_date=session.date)
+
+        apps = self.migrate(self.after)
+        AttendanceEntry = apps.get_model("attendance", "AttendanceEntry")
+        AttendanceSummary = apps.get_model("attendance", "AttendanceSummary")
+        self.assertEqual(list(AttendanceEntry.objects.order_by("student__username").values_list("status", flat=True)),
+                         ["present", "absent", "absent", "absent"])
+        self.assertEqual(list(AttendanceSummary.objects.order_by("student__username").values_list("present", "absent")),
+                         [(1, 0), (0, 1), (0, 1), (0, 1)])
+
+
+class AttendanceIndexTests(AttendanceTestCase):
+    """The hot attendance lookups are planned on the indexes added for them"""
+
+    def setUp(self):
+        self.take_many(5)
+        if connection.vendor == "postgresql":
+            # a table this small would otherwise be scanned whatever its indexes
+            with connection.cursor() as cursor:
+                cursor.execute("SET LOCAL enable_seqscan = off")
+
+    def indexes(self, model, *columns):
+        """Names of model's indexes whose leading columns are `columns`"""
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, model._meta.db_table)
+        return [name for name, info in constraints.items()
+                if (info["index"] or info["unique"]) and info["columns"][:len(columns)] == list(columns)]
+
+    def assertUsesIndex(self, queryset, indexes):
+        plan = queryset.explain()
+        self.assertTrue(any(index in plan for index in indexes), f"none of {indexes} used:\n{plan}")
+
+    def test_queries_use_indexes(self):
+        day = datetime.date(2026, 1, 3)
+        session = Attendance.objects.first()
+        cases = [
+            (Attendance.objects.filter(department=self.department, date=day), ["attendance_dept_date_idx"]),
+            (Attendance.objects.filter(date__range=(day, day + datetime.timedelta(days=7))), ["attendance_date_idx"]),
+            # the foreign key's own index serves this as well as the composite one
+            (AttendanceEntry.objects.filter(student=self.students[0]), self.indexes(AttendanceEntry, "student_id")),
+            (AttendanceEntry.objects.filter(attendance=session, status="present"), ["attendance_entry_status_idx"]),
+        ]
+        for queryset, indexes in cases:
+            with self.subTest(indexes=indexes):
+                self.assertUsesIndex(queryset, indexes)
+
+    def test_get_or_create_uses_the_unique_constraint(self):
+        key = {"department": self.department, "subject": self.subjects[0], "semester": self.semester,
+               "date": datetime.date(2026, 1, 1)}
+        unique = self.indexes(Attendance, "department_id", "subject_id", "semester_id", "date")
+        self.assertTrue(unique)
+        self.assertUsesIndex(Attendance.objects.filter(**key), unique)
+        session, created = Attendance.objects.get_or_create(**key)
+        self.assertFalse(created)
+
+
+class AnalyticsParamsTests(AttendanceTestCase):
+    def test_department_parameter_is_validated(self):
+        self.take_many(2)
+        manager = User.objects.create_user("manager", password="pw", role="management")
+        self.client.force_login(manager)
+        url = reverse("attendance_analytics_api")
+        for department, status in [("abc", 404), ("1.5", 404), ("-1", 404), ("99999", 404),
+                                   (str(self.department.id), 200), ("", 200)]:
+            with self.subTest(department=department):
+                self.assertEqual(self.client.get(url, {"department": department}).status_code, status)
+
+
+class SyncParseTests(AttendanceTestCase):
+    def test_malformed_statuses_are_rejected(self):
+        self.client.force_login(self.teacher)
+        student = str(self.students[0].id)
+        for statuses in [{student: ["present"]}, {student: {"status": "present"}}, {student: 1}, {student: None},
+                         {student: "late"}]:
+            with self.subTest(statuses=statuses):
+                response = self.client.post(reverse("attendance_sync_api"), {"sessions": [{
+                    "key": "malformed-statuses",
+                    "timestamp": timezone.now().isoformat(),
+                    "subject_id": self.subjects[0].id,
+                    "semester_id": self.semester.id,
+                    "statuses": statuses,
+                }]}, content_type="application/json")
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json()["errors"][0]["error"],
+                                 "statuses must map student ids to 'present' or 'absent'")
+
+
+class SyncOrderTests(AttendanceTestCase):
+    """An offline roster and a later correction of it, replayed however they reach the server"""
+
+    def setUp(self):
+        self.client.force_login(self.teacher)
+        taken = timezone.now() - datetime.timedelta(minutes=30)
+        self.roster = self.session("offline-1-roster", taken, {s.id: "present" for s in self.students})
+        self.correction = self.session("offline-2-correction", taken + datetime.timedelta(minutes=5),
+                                       {self.students[0].id: "absent"})
+
+    def session(self, key, taken_at, statuses):
+        return {"key": key, "timestamp": taken_at.isoformat(), "subject_id": self.subjects[0].id,
+                "semester_id": self.semester.id, "extra": True, "statuses": statuses}
+
+    def sync(self, *sessions):
+        response = self.client.post(reverse("attendance_sync_api"), {"sessions": list(sessions)},
+                                    content_type="application/json")
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def assert_corrected(self):
+        statuses = dict(AttendanceEntry.objects.values_list("student_id", "status"))
+        self.assertEqual(statuses, {s.id: "absent" if s == self.students[0] else "present" for s in self.students})
+        verify("rebuild_attendance_summary")
+        verify("rebuild_attendance_bitmaps")
+
+    def test_roster_then_correction_in_one_batch(self):
+        self.sync(self.correction, self.roster)  # applied by client time, not request order
+        self.assert_corrected()
+        self.assertEqual(AttendanceSubmission.objects.get(key="offline-2-correction").skipped, [])
+
+    def test_roster_then_correction_in_two_batches(self):
+        self.sync(self.roster)
+        self.sync(self.correction)
+        self.assert_corrected()
+        self.assertEqual(AttendanceSubmission.objects.get(key="offline-2-correction").skipped, [])
+
+    def test_correction_arriving_before_the_roster_is_kept(self):
+        self.sync(self.correction)
+        self.sync(self.roster)
+        self.assert_corrected()
+        self.assertEqual(AttendanceSubmission.objects.get(key="offline-1-roster").skipped, [self.students[0].id])
@@ -1,14 +1,25 @@
+import datetime
+import json
+
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.http import HttpResponse
+from django.core.exceptions import PermissionDenied
+from django.http import JsonResponse
+from django.views.decorators.http import require_http_methods
 from django.utils.dateparse import parse_date
-from django.utils.timezone import now
-from django.db.models import Count, Q
-
-from .models import Attendance, AttendanceEntry
+from django.utils.timezone import localtime, now
+from django.db.models import Count, F, Max, Q
+from django.db.models.functions import Lower
+
+from .models import Attendance, AttendanceEntry, AttendanceSummary
+from .exports import CHUNK_SIZE, EXPORT_FORMATS, export_response
+from .assignments import assigned_to, is_assigned, teacher_pairs
+from .analytics import department_report
+from . import sync
 from account.models import Semester
 from subject.models import Subject
+from college_portal.utils import analytics_department
 from routine.models import ClassRoutine
 
 # Helpers
@@ -17,36 +28,25 @@ DAY_CODES = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
 def _today_code():
     return DAY_CODES[now().date().weekday()]
 
-def _teacher_pairs(teacher):
-    # Unique (subject_id, semester_id) pairs from:
-    #  - routine assignments for this teacher
-    #  - subjects directly assigned to this teacher (M2M)
-    routine_pairs = (
-        ClassRoutine.objects
-        .filter(teacher=teacher)
-        .values_list("subject_id", "semester_id")
-        .distinct()
-    )
-    m2m_pairs = (
-        Subject.objects
-        .filter(teachers=teacher)
-        .values_list("id", "semester_id")
-        .distinct()
-    )
-    return set(routine_pairs) | set(m2m_pairs)
+def _attendance_taken_keys(teacher, date):
+    # Return set of keys "{subject_id}-{semester_id}" for which attendance exists on date
+    qs = Attendance.objects.filter(assigned_to(teacher), department=teacher.department, date=date)
+    return {f"{sid}-{semid}" for sid, semid in qs.values_list("subject_id", "semester_id")}
 
 
-def _attendance_taken_keys(department, date, pairs):
-    # Return set of keys "{subject_id}-{semester_id}" for which attendance exists on date
-    qs = Attendance.objects.filter(department=department, date=date)
-    if pairs:
-        # limit to teacher's pairs
-        disj = Q()
-        for sid, semid in pairs:
-            disj |= Q(subject_id=sid, semester_id=semid)
-        if disj:
-            qs = qs.filter(disj)
-    return {f"{a.subject_id}-{a.semester_id}" for a in qs.only("subject_id", "semester_id")}
+def _export_format(request):
+    fmt = request.GET.get("format", "xlsx")
+    return fmt if fmt in EXPORT_FORMATS else "xlsx"
+
+
+def _posted_statuses(request, students):
+    # {student_id: status} from the mark_attendance form; unknown values count as absent
+    valid = {value for value, _ in Attendance.STATUS_CHOICES}
+    statuses = {}
+    for sid in students.values_list("id", flat=True):
+        status = request.POST.get(f"status_{sid}", "absent")
+        statuses[sid] = status if status in valid else "absent"
+    return statuses
 
 
 # Create your views here.
@@ -68,8 +68,7 @@ def take_attendance(request):
     routines = ClassRoutine.objects.filter(teacher=request.user).order_by("day_of_week", "start_time")
 
     today_code = _today_code()
-    pairs = _teacher_pairs(request.user)
-    taken_keys = _attendance_taken_keys(request.user.department, now().date(), pairs)
+    taken_keys = _attendance_taken_keys(request.user, now().date())
 
     return render(request, "teacher/take_attendance.html", {
         "subjects": subjects,
@@ -112,18 +111,8 @@ def mark_attendance(request, subject_id, semester_id):
     )
 
     if request.method == "POST":
-        # overwrite entries if submitted again -> treated as edit
-        attendance.entries.all().delete()
-
-        bulk_entries = []
-        for student in students:
-            status = request.POST.get(f"status_{student.id}", "absent")
-            bulk_entries.append(AttendanceEntry(
-                attendance=attendance,
-                student=student,
-                status=status
-            ))
-        AttendanceEntry.objects.bulk_create(bulk_entries)
+        # resubmitting is an edit: only new or changed statuses are written
+        attendance.save_statuses(_posted_statuses(request, students))
         messages.success(request, "Attendance saved successfully.")
         return redirect("take_attendance")
 
@@ -171,18 +160,8 @@ def mark_attendance_custom(request):
     )
 
     if request.method == "POST":
-        # overwrite previous entries to allow edits on resubmission
-        attendance.entries.all().delete()
-
-        bulk_entries = []
-        for student in students:
-            status = request.POST.get(f"status_{student.id}", "absent")
-            bulk_entries.append(AttendanceEntry(
-                attendance=attendance,
-                student=student,
-                status=status
-            ))
-        AttendanceEntry.objects.bulk_create(bulk_entries)
+        # resubmitting is an edit: only new or changed statuses are written
+        attendance.save_statuses(_posted_statuses(request, students))
         messages.success(request, "Attendance saved successfully.")
         return redirect("take_attendance")
 
@@ -194,27 +173,67 @@ def mark_attendance_custom(request):
     })
 
 
+@login_required
+@require_http_methods(["GET", "POST"])
+def attendance_sync_api(request):
+    """JSON API for clients that queue attendance offline.
+
+    GET returns the teacher's classes and rosters to cache. POST takes
+    {"sessions": [{"key", "timestamp", "subject_id", "semester_id",
+    "statuses": {student_id: "present"|"absent"}, "extra": false}, ...]};
+    the batch is validated as a whole and applied in one transaction, and
+    resending a key returns its first result. Session-authenticated, so
+    clients send the CSRF token in X-CSRFToken.
+    """
+    if getattr(request.user, "role", None) != "teacher":
+        return JsonResponse({"error": "Not authorized"}, status=403)
+    if request.method == "GET":
+        return JsonResponse(sync.rosters(request.user))
+
+    try:
+        payload = json.loads(request.body)
+    except ValueError:
+        return JsonResponse({"error": "Invalid JSON"}, status=400)
+    try:
+        results = sync.submit(request.user, payload)
+    except sync.BatchError as e:
+        return JsonResponse({"errors": e.errors}, status=e.status)
+    return JsonResponse({"results": results})
+
+
 #--------------- Teacher: Attendance History & Export ----------------
 @login_required
 def teacher_attendance_history(request):
     if getattr(request.user, "role", None) != "teacher":
         return redirect("index")
 
-    pairs = _teacher_pairs(request.user)
+    pairs = teacher_pairs(request.user)
+    subject_ids = {sid for sid, _ in pairs}
+    semester_ids = {semid for _, semid in pairs}
+
+    # One grouped query for every pair; groups outside the teacher's pairs
+    # (same subject, other semester) are dropped below
+    stats = {
+        (row["subject_id"], row["semester_id"]): row
+        for row in Attendance.objects
+        .filter(department=request.user.department, subject_id__in=subject_ids, semester_id__in=semester_ids)
+        .values("subject_id", "semester_id")
+        .annotate(count=Count("id"), last_date=Max("date"))
+        .order_by()
+    }
+    subjects = Subject.objects.in_bulk(subject_ids)
+    semesters = Semester.objects.in_bulk(semester_ids)
+
     rows = []
     for sid, semid in sorted(pairs, key=lambda x: (x[1], x[0])):
-        subject = Subject.objects.get(id=sid)
-        semester = Semester.objects.get(id=semid)
-        sessions = Attendance.objects.filter(
-            department=request.user.department,
-            subject_id=sid,
-            semester_id=semid,
-        ).order_by("-date")
+        if sid not in subjects or semid not in semesters:
+            continue
+        stat = stats.get((sid, semid), {})
         rows.append({
-            "subject": subject,
-            "semester": semester,
-            "count": sessions.count(),
-            "last_date": sessions.first().date if sessions.exists() else None,
+            "subject": subjects[sid],
+            "semester": semesters[semid],
+            "count": stat.get("count", 0),
+            "last_date": stat.get("last_date"),
         })
 
     return render(request, "teacher/attendance_history.html", {
@@ -228,7 +247,7 @@ def teacher_subject_attendance_history(request, subject_id, semester_id):
         return redirect("index")
 
     # ensure teacher owns this pair
-    if (subject_id, semester_id) not in _teacher_pairs(request.user):
+    if not is_assigned(request.user, subject_id, semester_id):
         messages.error(request, "You are not assigned to this subject/semester.")
         return redirect("teacher_attendance_history")
 
@@ -264,7 +283,7 @@ def teacher_attendance_detail(request, attendance_id):
 
     attendance = get_object_or_404(Attendance, id=attendance_id, department=request.user.department)
     # Permission: teacher must be assigned to this subject/semester
-    if (attendance.subject_id, attendance.semester_id) not in _teacher_pairs(request.user):
+    if not is_assigned(request.user, attendance.subject_id, attendance.semester_id):
         messages.error(request, "You are not assigned to this class.")
         return redirect("teacher_attendance_history")
 
@@ -287,31 +306,30 @@ def export_class_attendance(request, attendance_id):
         return redirect("index")
 
     attendance = get_object_or_404(Attendance, id=attendance_id, department=request.user.department)
-    if (attendance.subject_id, attendance.semester_id) not in _teacher_pairs(request.user):
+    if not is_assigned(request.user, attendance.subject_id, attendance.semester_id):
         messages.error(request, "You are not assigned to this class.")
         return redirect("teacher_attendance_history")
 
-    entries = attendance.entries.select_related("student").all().order_by("student__first_name", "student__last_name")
-
-    # Export as Excel-compatible HTML table (no extra deps)
-    response = HttpResponse(content_type='application/vnd.ms-excel')
-    filename = f"attendance_{attendance.subject.name}_sem{attendance.semester.semester}_{attendance.date}.xls".replace(" ", "_")
-    response['Content-Disposition'] = f'attachment; filename="{filename}"'
-
-    html = [
-        "<html><head><meta charset='utf-8'></head><body>",
-        f"<h3>Attendance - {attendance.subject.name} (Semester {attendance.semester.semester}) - {attendance.date}</h3>",
-        "<table border='1' cellpadding='5' cellspacing='0'>",
-        "<tr><th>#</th><th>Student Name</th><th>Registration</th><th>Status</th><th>Marked At</th></tr>",
-    ]
-    for i, e in enumerate(entries, start=1):
-        html.append(
-            f"<tr><td>{i}</td><td>{e.student.get_full_name()}</td><td>{getattr(e.student, 'registration_number', '')}</td><td>{e.status.title()}</td><td>{e.marked_at}</td></tr>"
+    rows = (
+        attendance.entries
+        .order_by("student__first_name", "student__last_name")
+        .values_list(
+            "student__first_name", "student__last_name",
+            "student__student_profile__registration_number", "status", "marked_at",
         )
-    html.append("</table></body></html>")
+        .iterator(chunk_size=CHUNK_SIZE)
+    )
+
+    def numbered():
+        for i, (first, last, registration, status, marked_at) in enumerate(rows, start=1):
+            yield [i, f"{first} {last}".strip(), registration or "", status.title(),
+                   localtime(marked_at).strftime("%Y-%m-%d %H:%M")]
 
-    response.write("".join(html))
-    return response
+    filename = f"attendance_{attendance.subject.name}_sem{attendance.semester.semester}_{attendance.date}".replace(" ", "_")
+    return export_response(
+        request, _export_format(request), filename, f"{attendance.subject.name} {attendance.date}",
+        ["#", "Student Name", "Registration", "Status", "Marked At"], numbered(),
+    )
 
 
 @login_required
@@ -337,18 +355,11 @@ def export_attendance_report(request):
             # fall back to last 30 days
             start_date, end_date = (today - __import__("datetime").timedelta(days=30)), today
 
-    pairs = _teacher_pairs(request.user)
-    disj = Q()
-    for sid, semid in pairs:
-        disj |= Q(subject_id=sid, semester_id=semid)
-
     sessions = Attendance.objects.filter(
+        assigned_to(request.user),
         department=request.user.department,
         date__range=(start_date, end_date),
-    )
-    if disj:
-        sessions = sessions.filter(disj)
-    sessions = sessions.order_by("date", "subject__name")
+    ).order_by("date", "subject__name")
 
     if not download:
         # Render filter UI
@@ -359,37 +370,30 @@ def export_attendance_report(request):
             "session_count": sessions.count(),
         })
 
-    # Build entries and totals
-    total_present = 0
-    total_absent = 0
-
-    # Excel-compatible HTML
-    response = HttpResponse(content_type='application/vnd.ms-excel')
-    filename = f"attendance_report_{start_date}_to_{end_date}.xls"
-    response['Content-Disposition'] = f'attachment; filename="{filename}"'
-
-    parts = [
-        "<html><head><meta charset='utf-8'></head><body>",
-        f"<h3>Attendance Report ({start_date} to {end_date})</h3>",
-        "<table border='1' cellpadding='5' cellspacing='0'>",
-        "<tr><th>Date</th><th>Subject</th><th>Semester</th><th>Present</th><th>Absent</th><th>Total</th></tr>",
-    ]
-
-    for s in sessions:
-        present = s.entries.filter(status__iexact="present").count()
-        absent = s.entries.filter(status__iexact="absent").count()
-        total_present += present
-        total_absent += absent
-        parts.append(
-            f"<tr><td>{s.date}</td><td>{s.subject.name}</td><td>{s.semester.semester}</td><td>{present}</td><td>{absent}</td><td>{present+absent}</td></tr>"
+    # One annotated query, streamed; totals are summed on the way out
+    rows = (
+        sessions
+        .annotate(
+            present=Count("entries", filter=Q(entries__status__iexact="present")),
+            absent=Count("entries", filter=Q(entries__status__iexact="absent")),
         )
+        .values_list("date", "subject__name", "semester__semester", "present", "absent")
+        .iterator(chunk_size=CHUNK_SIZE)
+    )
 
-    parts.append("</table>")
-    parts.append(f"<p><strong>Total Present:</strong> {total_present} &nbsp;&nbsp; <strong>Total Absent:</strong> {total_absent}</p>")
-    parts.append("</body></html>")
-
-    response.write("".join(parts))
-    return response
+    def with_totals():
+        total_present = total_absent = 0
+        for date, subject_name, semester_num, present, absent in rows:
+            total_present += present
+            total_absent += absent
+            yield [date.isoformat(), subject_name, semester_num, present, absent, present + absent]
+        yield ["Total", "", "", total_present, total_absent, total_present + total_absent]
+
+    return export_response(
+        request, _export_format(request), f"attendance_report_{start_date}_to_{end_date}",
+        f"Attendance {start_date} to {end_date}",
+        ["Date", "Subject", "Semester", "Present", "Absent", "Total"], with_totals(),
+    )
 
 
 #---------------student views----------------
@@ -404,48 +408,35 @@ def student_attendance(request):
     entries = AttendanceEntry.objects.filter(student=request.user)
 
     # Date filter
-    if start:
-        start_date = parse_date(start)
-        if start_date:
-            entries = entries.filter(attendance__date__gte=start_date)
-    if end:
-        end_date = parse_date(end)
-        if end_date:
-            entries = entries.filter(attendance__date__lte=end_date)
+    start_date = parse_date(start) if start else None
+    end_date = parse_date(end) if end else None
+    if start_date:
+        entries = entries.filter(attendance__date__gte=start_date)
+    if end_date:
+        entries = entries.filter(attendance__date__lte=end_date)
+
+    if start_date or end_date:
+        # Subject stats for the chosen range: one grouped query
+        subject_stats_list = list(
+            entries
+            .values(subject_id=F("attendance__subject_id"), subject=F("attendance__subject__name"))
+            .annotate(**AttendanceSummary.counts())  # as the summaries count them
+            .order_by(Lower("attendance__subject__name"))
+        )
+        for rec in subject_stats_list:
+            rec["total"] = rec["present"] + rec["absent"]
+            rec["percent"] = round((rec["present"] / rec["total"]) * 100, 2) if rec["total"] else 0.0
+    else:
+        # All-time stats: one summary row per subject
+        subject_stats_list = AttendanceSummary.subject_stats(request.user)
 
     # Counts
-    total_present = entries.filter(status__iexact="present").count()
-    total_absent = entries.filter(status__iexact="absent").count()
+    total_present = sum(rec["present"] for rec in subject_stats_list)
+    total_absent = sum(rec["absent"] for rec in subject_stats_list)
     total_classes = total_present + total_absent
 
     overall_percent = round((total_present / total_classes) * 100, 2) if total_classes else 0
 
-    # Subject stats
-    subject_stats = {}
-    for e in entries:
-        sid = e.attendance.subject_id
-        sname = e.attendance.subject.name
-        if sid not in subject_stats:
-            subject_stats[sid] = {
-                "subject_id": sid,
-                "subject": sname,
-                "present": 0,
-                "absent": 0,
-            }
-
-        if e.status.lower() == "present":
-            subject_stats[sid]["present"] += 1
-        else:
-            subject_stats[sid]["absent"] += 1
-
-    # Percent per subject
-    for rec in subject_stats.values():
-        total = rec["present"] + rec["absent"]
-        rec["total"] = total
-        rec["percent"] = round((rec["present"] / total) * 100, 2) if total else 0.0
-
-    subject_stats_list = sorted(subject_stats.values(), key=lambda x: x["subject"].lower())
-
     # Chart data
     chart_labels = [s["subject"] for s in subject_stats_list]
     chart_percents = [s["percent"] for s in subject_stats_list]
@@ -453,26 +444,32 @@ def student_attendance(request):
     chart_absent = [s["absent"] for s in subject_stats_list]
     chart_total = [s["total"] for s in subject_stats_list]
 
-    # Daily timeline %
-    timeline = {}
-    for e in entries:
-        d = e.attendance.date.isoformat()
-        timeline.setdefault(d, {"present": 0, "total": 0})
-        timeline[d]["total"] += 1
-        if e.status.lower() == "present":
-            timeline[d]["present"] += 1
-
-    timeline_labels = sorted(timeline.keys())
-    timeline_percent = [
-        round((day["present"] / day["total"]) * 100, 2) if day["total"] else 0
-        for day in (timeline[d] for d in timeline_labels)
-    ]
+    # Daily timeline %: one grouped query
+    timeline = (
+        entries
+        .values("attendance__date")
+        .annotate(
+            present=Count("id", filter=Q(status__iexact="present")),
+            total=Count("id"),
+        )
+        .order_by("attendance__date")
+    )
+    timeline_labels, timeline_percent = [], []
+    for day in timeline:
+        timeline_labels.append(day["attendance__date"].isoformat())
+        timeline_percent.append(round((day["present"] / day["total"]) * 100, 2))
+
+    recent_entries = (
+        entries
+        .select_related("attendance__subject")
+        .order_by("-attendance__date", "-id")[:200]
+    )
 
     context = {
         "student": request.user,
         "start": start or "",
         "end": end or "",
-        "entries": entries[:200],
+        "entries": recent_entries,
         "total_present": total_present,
         "total_absent": total_absent,
         "total_classes": total_classes,
@@ -489,3 +486,55 @@ def student_attendance(request):
         "today": now().date(),
     }
     return render(request, "student_profiles/attendance.html", context)
+
+
+#---------------HOD / management analytics----------------
+ANALYTICS_DAYS = 120  # default range ends today and covers about a semester
+PROJECTION_DAYS = 30  # default semester end for projections, after the range
+
+
+def _date_param(request, name):
+    try:
+        return parse_date(request.GET.get(name) or "")
+    except ValueError:  # well formed but not a real date
+        return None
+
+
+def _analytics_params(request):
+    """(department, start, end, until) for department_report, or None if not allowed"""
+    try:
+        department = analytics_department(request)
+    except PermissionDenied:
+        return None
+
+    end = _date_param(request, "end") or now().date()
+    start = _date_param(request, "start") or end - datetime.timedelta(days=ANALYTICS_DAYS)
+    start, end = min(start, end), max(start, end)
+    until = _date_param(request, "until") or end + datetime.timedelta(days=PROJECTION_DAYS)
+    return department, start, end, max(until, end)
+
+
+@login_required
+def hod_attendance_analytics(request):
+    if getattr(request.user, "role", None) != "hod":
+        return redirect("index")
+    params = _analytics_params(request)
+    if params is None:
+        return redirect("index")
+
+    report = department_report(*params)
+    return render(request, "hod/attendance_analytics.html", {
+        "report": report,
+        "start": params[1],
+        "end": params[2],
+        "until": params[3],
+        "query": request.GET.urlencode(),
+    })
+
+
+@login_required
+def attendance_analytics_api(request):
+    params = _analytics_params(request)
+    if params is None:
+        return JsonResponse({"error": "Not authorized"}, status=403)
+    return JsonResponse(department_report(*params))
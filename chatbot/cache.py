@@ -0,0 +1,102 @@
+import hashlib
+import re
+
+import numpy as np
+from django.core.cache import caches
+
+from .index import vector_index
+
+# Uses the "chatbot" alias from settings.CACHES (LRU-culled locmem by default)
+EMBEDDING_TTL = 60 * 60 * 24 * 7
+ANSWER_TTL = 60 * 60 * 24
+
+COUNTERS = ["embedding_hit", "embedding_miss", "answer_hit", "answer_miss"]
+
+_SPACE_RE = re.compile(r"\s+")
+_TRAILING_RE = re.compile(r"[\s?!.]+$")
+
+
+def _cache():
+    return caches["chatbot"]
+
+
+def normalize_message(message):
+    """'  What are the FEES?? ' and 'what are the fees' share cache entries"""
+    return _TRAILING_RE.sub("", _SPACE_RE.sub(" ", message.strip().lower()))
+
+
+def _digest(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _count(name):
+    key = f"chatbot:stats:{name}"
+    cache = _cache()
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key)
+    except ValueError:  # culled between add() and incr()
+        cache.set(key, 1, timeout=None)
+
+
+def cached_query_embedding(message, embed):
+    """Return the query vector for message, calling embed(message) only on a miss"""
+    key = f"chatbot:emb:{_digest(normalize_message(message))}"
+    blob = _cache().get(key)
+    if blob is not None:
+        _count("embedding_hit")
+        return np.frombuffer(blob, dtype=np.float32)
+
+    _count("embedding_miss")
+    vector = np.asarray(embed(message), dtype=np.float32)
+    _cache().set(key, vector.tobytes(), EMBEDDING_TTL)
+    return vector
+
+
+async def _acount(name):
+    key = f"chatbot:stats:{name}"
+    cache = _cache()
+    await cache.aadd(key, 0, timeout=None)
+    try:
+        await cache.aincr(key)
+    except ValueError:  # culled between aadd() and aincr()
+        await cache.aset(key, 1, timeout=None)
+
+
+async def acached_query_embedding(message, embed):
+    """cached_query_embedding() with an async embed(message)"""
+    key = f"chatbot:emb:{_digest(normalize_message(message))}"
+    blob = await _cache().aget(key)
+    if blob is not None:
+        await _acount("embedding_hit")
+        return np.frombuffer(blob, dtype=np.float32)
+
+    await _acount("embedding_miss")
+    vector = np.asarray(await embed(message), dtype=np.float32)
+    await _cache().aset(key, vector.tobytes(), EMBEDDING_TTL)
+    return vector
+
+
+def _answer_key(message):
+    # The knowledge-base version is part of the key, so an index_kb run that
+    # adds or removes chunks orphans every older answer in all workers.
+    vector_index.ensure_fresh()
+    return f"chatbot:answer:{vector_index.version}:{_digest(normalize_message(message))}"
+
+
+def get_cached_answer(message):
+    answer = _cache().get(_answer_key(message))
+    _count("answer_hit" if answer is not None else "answer_miss")
+    return answer
+
+
+def set_cached_answer(message, answer):
+    _cache().set(_answer_key(message), answer, ANSWER_TTL)
+
+
+def cache_stats():
+    stats = {name: _cache().get(f"chatbot:stats:{name}", 0) for name in COUNTERS}
+    for kind in ["embedding", "answer"]:
+        total = stats[f"{kind}_hit"] + stats[f"{kind}_miss"]
+        stats[f"{kind}_hit_rate"] = round(stats[f"{kind}_hit"] / total, 3) if total else 0.0
+    return stats
@@ -0,0 +1,174 @@
+import bisect
+import re
+from collections import namedtuple
+
+try:
+    import tiktoken
+except ImportError:  # token counts fall back to an estimate
+    tiktoken = None
+
+TOKEN_ENCODING = "o200k_base"  # gpt-4o / gpt-4o-mini
+
+CHUNK_TOKENS = 256
+CHUNK_OVERLAP_TOKENS = 32
+# A heading only closes the chunk being built once it holds this many tokens,
+# so a run of short sections is packed together instead of left as scraps.
+MIN_CHUNK_TOKENS = 64
+
+PAGE_SEPARATOR = "\n\n"
+
+# char_start/char_end index the extracted text with pages joined by
+# PAGE_SEPARATOR; page_start/page_end are 1-based, None for unpaged files.
+Chunk = namedtuple("Chunk", "text heading char_start char_end page_start page_end token_count")
+
+_BLOCK_RE = re.compile(r"\S(?:.*?\S)?(?=[ \t]*\n[ \t]*\n|\s*\Z)", re.S)
+_LINE_RE = re.compile(r"[^\n]*\S[^\n]*")
+_SENTENCE_RE = re.compile(r"\S.*?(?:[.!?](?=\s)|\Z)", re.S)
+_WORD_RE = re.compile(r"\S+")
+_ESTIMATE_RE = re.compile(r"\w+|[^\w\s]")
+_MD_HEADING_RE = re.compile(r"#{1,6}\s+\S")
+_LIST_ITEM_RE = re.compile(r"(?:[-*•]|\d+[.)])")
+
+_encoding = None
+
+
+def count_tokens(text):
+    """Tokens in text for the chat model; an estimate when tiktoken is unavailable"""
+    global _encoding
+    if _encoding is None:
+        try:
+            _encoding = tiktoken.get_encoding(TOKEN_ENCODING)
+        except Exception:  # not installed, or the BPE file can't be fetched
+            _encoding = False
+    if _encoding:
+        return len(_encoding.encode(text, disallowed_special=()))
+    # ~4 characters per token for words, one per punctuation mark
+    return sum(-(-len(t) // 4) for t in _ESTIMATE_RE.findall(text))
+
+
+def is_heading(line):
+    """Markdown headings, or short title-like lines ("Admission Process")"""
+    line = line.strip()
+    if _MD_HEADING_RE.match(line):
+        return True
+    return (
+        len(line) <= 80 and len(line.split()) <= 8 and line[:1].isupper()
+        and ": " not in line and line[-1] not in ".!?;,"
+        and not _LIST_ITEM_RE.match(line)
+    )
+
+
+def _spans(regex, text, start, end):
+    return [m.span() for m in regex.finditer(text, start, end)]
+
+
+def _split(text, start, end, max_tokens):
+    """Cut an oversized span at lines, then sentences, then words"""
+    for regex in (_LINE_RE, _SENTENCE_RE, _WORD_RE):
+        parts = _spans(regex, text, start, end)
+        if len(parts) > 1:
+            break
+    else:
+        return [(start, end)]  # a single enormous word
+
+    pieces = []
+    for s, e in parts:
+        if count_tokens(text[s:e]) > max_tokens:
+            pieces.extend(_split(text, s, e, max_tokens))
+        else:
+            pieces.append((s, e))
+    return pieces
+
+
+def _units(text, max_tokens):
+    """Yield (start, end, tokens, heading) spans that each fit in max_tokens"""
+    for start, end in _spans(_BLOCK_RE, text, 0, len(text)):
+        block = text[start:end]
+        first = block.split("\n", 1)[0]
+        if is_heading(first):
+            head_end = start + len(first)
+            yield start, head_end, count_tokens(first), True
+            start = head_end + 1
+            if start >= end:
+                continue
+            start += len(text[start:end]) - len(text[start:end].lstrip())
+
+        tokens = count_tokens(text[start:end])
+        if tokens <= max_tokens:
+            yield start, end, tokens, False
+        else:
+            for s, e in _split(text, start, end, max_tokens):
+                yield s, e, count_tokens(text[s:e]), False
+
+
+def _clean(text):
+    lines = [line.rstrip() for line in text.split("\n")]
+    return re.sub(r"\n{3,}", "\n\n", "\n".join(lines)).strip()
+
+
+def chunk_document(pages, max_tokens=CHUNK_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS):
+    """Split extracted text into Chunks along heading and paragraph boundaries.
+
+    pages is the text of a .txt/.md file, or a list of page texts for a PDF.
+    Paragraphs are packed whole up to max_tokens; only a paragraph that is
+    too big on its own is cut, at line, then sentence, then word boundaries.
+    When a section spills into another chunk, that chunk repeats the section
+    heading and the last paragraphs (up to overlap_tokens) of the previous one.
+    """
+    paged = not isinstance(pages, str)
+    if not paged:
+        pages = [pages]
+    page_starts, offset = [], 0
+    for page in pages:
+        page_starts.append(offset)
+        offset += len(page) + len(PAGE_SEPARATOR)
+    text = PAGE_SEPARATOR.join(pages)
+
+    def page_of(pos):
+        return bisect.bisect_right(page_starts, pos) if paged else None
+
+    chunks = []
+    current, tokens, prefix = [], 0, ""
+    section, section_tokens = "", 0
+
+    def flush():
+        start, end = current[0][0], current[-1][1]
+        body = _clean(text[start:end])
+        if prefix:
+            body = f"{prefix}\n{body}"
+        chunks.append(Chunk(body, current[0][4], start, end, page_of(start), page_of(end - 1), count_tokens(body)))
+
+    for start, end, unit_tokens, unit_heading in _units(text, max_tokens):
+        if unit_heading:
+            if current and (tokens >= MIN_CHUNK_TOKENS or tokens + unit_tokens > max_tokens):
+                flush()
+                current, tokens, prefix = [], 0, ""
+            section, section_tokens = _clean(text[start:end]).lstrip("#").strip(), unit_tokens
+        elif current and tokens + unit_tokens > max_tokens:
+            # headings at the tail move on with the paragraph they introduce
+            moved = []
+            while current and current[-1][3]:
+                moved.insert(0, current.pop())
+            if current:
+                flush()
+            if moved:
+                current, prefix = moved, ""
+                tokens = sum(unit[2] for unit in moved)
+            else:
+                # continue the section: repeat its heading and carry trailing
+                # paragraphs as overlap
+                prefix = section
+                tokens = section_tokens if section else 0
+                carry, carried = [], 0
+                for prev in reversed(current):
+                    if carried + prev[2] > overlap_tokens or tokens + carried + prev[2] + unit_tokens > max_tokens:
+                        break
+                    carry.insert(0, prev)
+                    carried += prev[2]
+                current, tokens = carry, tokens + carried
+        current.append((start, end, unit_tokens, unit_heading, section))
+        tokens += unit_tokens
+
+    if current:
+        flush()
+    return chunks
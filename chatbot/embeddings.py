@@ -0,0 +1,89 @@
+import hashlib
+import re
+
+import numpy as np
+
+EMBEDDING_MODEL = "text-embedding-3-small"
+EMBEDDING_DIM = 1536
+
+# Storage formats for dataChunks.embedding. Everything decodes to float32;
+# int8 rows carry a per-row scale (max |x| / 127).
+EMBEDDING_DTYPES = {
+    "fp32": np.float32,
+    "fp16": np.float16,
+    "int8": np.int8,
+}
+DEFAULT_DTYPE = "fp32"
+
+_TOKEN_RE = re.compile(r"\w+")
+
+
+def encode_embedding(vector, dtype=DEFAULT_DTYPE):
+    """Pack a vector into raw bytes; returns (blob, scale)"""
+    v = np.asarray(vector, dtype=np.float32)
+    if dtype == "int8":
+        scale = float(np.abs(v).max()) / 127 or 1.0
+        return np.round(v / scale).astype(np.int8).tobytes(), scale
+    return v.astype(EMBEDDING_DTYPES[dtype]).tobytes(), 1.0
+
+
+def decode_embedding(blob, dtype=DEFAULT_DTYPE, scale=1.0):
+    """Unpack raw bytes from dataChunks.embedding into a float32 vector"""
+    v = np.frombuffer(blob, dtype=EMBEDDING_DTYPES[dtype]).astype(np.float32)
+    return v * np.float32(scale) if dtype == "int8" else v
+
+
+class OpenAIEmbedder:
+    """Embeds a batch of texts with a single OpenAI embeddings request"""
+
+    def __init__(self, model=EMBEDDING_MODEL):
+        from openai import OpenAI
+        self.client = OpenAI()
+        self.model = model
+
+    def embed(self, texts):
+        resp = self.client.embeddings.create(model=self.model, input=list(texts))
+        # the API echoes an index per input; don't rely on response ordering
+        return [d.embedding for d in sorted(resp.data, key=lambda d: d.index)]
+
+
+class StubEmbedder:
+    """Deterministic offline embedder (feature hashing over word tokens).
+
+    Same text always gives the same vector and texts sharing words score
+    higher, so the indexing and retrieval pipeline can run without network.
+    """
+
+    def __init__(self, dim=EMBEDDING_DIM):
+        self.dim = dim
+        self._slots = {}  # token -> (index, sign), memoized
+
+    def _slot(self, token):
+        slot = self._slots.get(token)
+        if slot is None:
+            h = int.from_bytes(hashlib.blake2b(token.encode(), digest_size=8).digest(), "little")
+            slot = self._slots[token] = (h % self.dim, 1.0 if (h >> 63) else -1.0)
+        return slot
+
+    def embed_one(self, text):
+        vec = np.zeros(self.dim, dtype=np.float32)
+        for token in _TOKEN_RE.findall(text.lower()):
+            i, sign = self._slot(token)
+            vec[i] += sign
+        return (vec / (np.linalg.norm(vec) + 1e-10)).tolist()
+
+    def embed(self, texts):
+        return [self.embed_one(t) for t in texts]
+
+
+EMBEDDERS = {
+    "openai": OpenAIEmbedder,
+    "stub": StubEmbedder,
+}
+
+
+def get_embedder(name="openai"):
+    try:
+        return EMBEDDERS[name]()
+    except KeyError:
+        raise ValueError(f"Unknown embedder '{name}', choose from: {', '.join(EMBEDDERS)}")
@@ -0,0 +1,128 @@
+import threading
+import time
+
+import numpy as np
+from django.db.models import Count, Max
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .embeddings import decode_embedding
+from .lexical import BM25Index, term_frequencies
+from .models import dataChunks as KBChunk
+
+# Seconds between cheap "has the table changed?" checks against the DB.
+# index_kb runs in another process (and uses bulk writes that skip signals),
+# so the version stamp is what lets every web worker notice a re-index.
+REFRESH_INTERVAL = 5.0
+
+
+def kb_version():
+    """Cheap version stamp for the knowledge base: row count, max id, newest row"""
+    agg = KBChunk.objects.aggregate(n=Count("id"), last_id=Max("id"), last_at=Max("created_at"))
+    last_at = agg["last_at"].isoformat() if agg["last_at"] else ""
+    return f"{agg['n']}-{agg['last_id'] or 0}-{last_at}"
+
+
+class VectorIndex:
+    """Process-level, pre-normalized float32 matrix of every chunk embedding.
+
+    Rows of ``matrix`` line up with ``ids`` and ``sources``, so a query is one
+    matrix-vector product plus ``argpartition`` instead of a table scan. A
+    BM25 index over the same rows is built alongside for keyword lookups.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = (
+            np.zeros((0, 0), dtype=np.float32),
+            np.zeros(0, dtype=np.int64),
+            np.zeros(0, dtype=object),
+            BM25Index([]),
+        )
+        self.version = None
+        self._checked_at = 0.0
+        self._dirty = True
+
+    def __len__(self):
+        return len(self._data[1])
+
+    def mark_dirty(self):
+        self._dirty = True
+
+    def build(self):
+        """(Re)load every embedding from the DB into a normalized matrix"""
+        version = kb_version()
+        ids, sources, vectors, term_freqs = [], [], [], []
+        rows = KBChunk.objects.values_list(
+            "id", "source", "embedding", "embedding_dtype", "embedding_scale", "term_freqs")
+        for pk, source, blob, dtype, scale, tf in rows.iterator(chunk_size=2000):
+            ids.append(pk)
+            sources.append(source)
+            vectors.append(decode_embedding(blob, dtype, scale))
+            term_freqs.append(tf)
+
+        # rows index_kb hasn't backfilled yet are tokenized here instead
+        missing = {pk: i for i, (pk, tf) in enumerate(zip(ids, term_freqs)) if not tf}
+        if missing:
+            for pk, text in KBChunk.objects.filter(id__in=list(missing)).values_list("id", "text"):
+                term_freqs[missing[pk]] = term_frequencies(text)
+
+        if vectors:
+            matrix = np.vstack(vectors)
+            matrix /= np.linalg.norm(matrix, axis=1, keepdims=True) + 1e-10
+        else:
+            matrix = np.zeros((0, 0), dtype=np.float32)
+
+        self._data = (
+            matrix,
+            np.asarray(ids, dtype=np.int64),
+            np.asarray(sources, dtype=object),
+            BM25Index(term_freqs),
+        )
+        self.version = version
+
+    def ensure_fresh(self):
+        """Rebuild if a signal marked us dirty or the DB version stamp moved"""
+        now = time.monotonic()
+        if not self._dirty and now - self._checked_at < REFRESH_INTERVAL:
+            return
+        with self._lock:
+            if not self._dirty and now - self._checked_at < REFRESH_INTERVAL:
+                return
+            if self._dirty or kb_version() != self.version:
+                self.build()
+            self._dirty = False
+            self._checked_at = time.monotonic()
+
+    def search(self, qv, k=4):
+        """Return [(score, chunk_id, source), ...] best first for a query vector"""
+        self.ensure_fresh()
+        matrix, ids, sources, _ = self._data
+        if not len(ids) or k <= 0:
+            return []
+
+        qv = np.asarray(qv, dtype=np.float32)
+        qv = qv / (np.linalg.norm(qv) + 1e-10)
+        scores = matrix @ qv
+
+        k = min(k, len(scores))
+        top = np.argpartition(scores, len(scores) - k)[-k:]
+        top = top[np.argsort(-scores[top])]
+        return [(float(scores[i]), int(ids[i]), sources[i]) for i in top]
+
+    def lexical_search(self, query, k=4):
+        """BM25 lookup; returns ([(score, chunk_id, source), ...], confident)"""
+        self.ensure_fresh()
+        _, ids, sources, lexical = self._data
+        hits, confident = lexical.search(query, k=k)
+        return [(score, int(ids[row]), sources[row]) for score, row in hits], confident
+
+
+vector_index = VectorIndex()
+
+
+# Edits made inside this process (e.g. through the admin) refresh immediately
+@receiver(post_save, sender=KBChunk)
+@receiver(post_delete, sender=KBChunk)
+def invalidate_vector_index(sender, **kwargs):
+    vector_index.mark_dirty()
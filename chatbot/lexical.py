@@ -0,0 +1,89 @@
+import math
+import re
+from collections import Counter, defaultdict
+
+import numpy as np
+
+# Words (incl. digits) plus compound codes such as "pcc-cs301" or "b.tech",
+# so subject codes and room numbers survive as a single searchable term.
+_WORD_RE = re.compile(r"[a-z0-9]+")
+_COMPOUND_RE = re.compile(r"[a-z0-9]+(?:[-/.][a-z0-9]+)+")
+
+STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from how i in is it me my of on or "
+    "please tell the their there this to what when where which who whom why with you your".split()
+)
+
+K1 = 1.5
+B = 0.75
+
+# Keyword-only mode: the best chunk must contain every query term and beat the
+# runner-up by this factor before the embedding call is skipped.
+CONFIDENT_MARGIN = 1.5
+
+
+def tokenize(text):
+    text = text.lower()
+    tokens = [t for t in _WORD_RE.findall(text) if t not in STOPWORDS]
+    tokens.extend(_COMPOUND_RE.findall(text))
+    return tokens
+
+
+def term_frequencies(text):
+    """{term: count} for one chunk; index_kb stores this as dataChunks.term_freqs"""
+    return dict(Counter(tokenize(text)))
+
+
+class BM25Index:
+    """Inverted index with precomputed per-posting BM25 weights.
+
+    Scoring a query is a sum of a few posting arrays into a dense score
+    vector, aligned with the rows of the vector index.
+    """
+
+    def __init__(self, term_freqs):
+        n = len(term_freqs)
+        lengths = np.array([sum(tf.values()) for tf in term_freqs], dtype=np.float32)
+        avgdl = float(lengths.mean()) if n else 0.0
+
+        postings = defaultdict(lambda: ([], []))
+        for row, tf in enumerate(term_freqs):
+            for term, count in tf.items():
+                rows, counts = postings[term]
+                rows.append(row)
+                counts.append(count)
+
+        self.n = n
+        self.postings = {}
+        for term, (rows, counts) in postings.items():
+            rows = np.asarray(rows, dtype=np.int64)
+            tf = np.asarray(counts, dtype=np.float32)
+            idf = math.log(1 + (n - len(rows) + 0.5) / (len(rows) + 0.5))
+            norm = K1 * (1 - B + B * lengths[rows] / (avgdl or 1.0))
+            self.postings[term] = (rows, (idf * tf * (K1 + 1) / (tf + norm)).astype(np.float32))
+
+    def search(self, query, k=4):
+        """Return (hits, confident); hits are [(score, row), ...] best first"""
+        terms = set(tokenize(query))
+        if not self.n or not terms:
+            return [], False
+
+        scores = np.zeros(self.n, dtype=np.float32)
+        matched = np.zeros(self.n, dtype=np.int32)
+        for term in terms:
+            if term in self.postings:
+                rows, weights = self.postings[term]
+                scores[rows] += weights
+                matched[rows] += 1
+
+        k = min(k, self.n)
+        top = np.argpartition(scores, self.n - k)[-k:]
+        top = top[np.argsort(-scores[top])]
+        hits = [(float(scores[i]), int(i)) for i in top if scores[i] > 0]
+        if not hits:
+            return [], False
+
+        best = top[0]
+        runner_up = hits[1][0] if len(hits) > 1 else 0.0
+        confident = matched[best] == len(terms) and hits[0][0] >= CONFIDENT_MARGIN * runner_up
+        return hits, bool(confident)
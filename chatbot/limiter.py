@@ -0,0 +1,123 @@
+import asyncio
+import threading
+from collections import deque
+
+from django.conf import settings
+
+
+class _Waiter:
+    def __init__(self, loop):
+        self.loop = loop
+        self.future = loop.create_future()
+        self.granted = False  # set under the limiter's lock when a slot is handed over
+
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class ChatLimiter:
+    """Admission control for the chatbot's OpenAI round trips.
+
+    At most ``max_active`` requests run at once and up to ``max_queue`` more
+    wait (for at most ``timeout`` seconds); anything beyond that is refused
+    straight away so the caller can answer 503 instead of piling up.
+
+    Waiters are served first in, first out: release() hands its slot straight
+    to the oldest waiter instead of freeing it, so a new arrival can never
+    overtake the queue. State sits behind a threading lock and waiters are
+    woken with call_soon_threadsafe, so the limiter works the same whether
+    requests share one event loop (ASGI) or each get their own (async views
+    under WSGI/runserver), which an asyncio.Semaphore can't do.
+    """
+
+    def __init__(self, max_active, max_queue, timeout):
+        self.max_active = max_active
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.active = 0
+        self._waiters = deque()
+        self._lock = threading.Lock()
+
+    @property
+    def waiting(self):
+        return len(self._waiters)
+
+    async def acquire(self):
+        """Return True once a slot is held, False if the request should be shed"""
+        with self._lock:
+            if self.active < self.max_active and not self._waiters:
+                self.active += 1
+                return True
+            if len(self._waiters) >= self.max_queue:
+                return False
+            waiter = _Waiter(asyncio.get_running_loop())
+            self._waiters.append(waiter)
+
+        try:
+            await asyncio.wait_for(waiter.future, self.timeout)
+            return True
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            with self._lock:
+                granted = waiter.granted
+                if not granted:
+                    self._waiters.remove(waiter)
+            if isinstance(e, asyncio.CancelledError):
+                if granted:
+                    self.release()
+                raise
+            # the slot may have been handed over just as the wait ran out
+            return granted
+
+    def release(self):
+        with self._lock:
+            while self._waiters:
+                waiter = self._waiters.popleft()
+                try:
+                    waiter.loop.call_soon_threadsafe(_wake, waiter.future)
+                except RuntimeError:  # its event loop is gone; try the next one
+                    continue
+                waiter.granted = True
+                return
+            self.active -= 1
+
+    def hold(self, events):
+        """Wrap an async iterator so its slot is released when it is closed"""
+        return HeldStream(events, self.release)
+
+
+class HeldStream:
+    """Async iterator that gives a limiter slot back exactly once.
+
+    StreamingHttpResponse registers ``close()`` as a resource closer, so the
+    slot is returned whether the stream finishes, fails, or is never consumed
+    because the client went away first.
+    """
+
+    def __init__(self, events, release):
+        self.events = events
+        self._release = release
+        self.closed = False
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        try:
+            async for event in self.events:
+                yield event
+        finally:
+            self.close()
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self._release()
+
+
+chat_limiter = ChatLimiter(
+    max_active=settings.CHATBOT_MAX_CONCURRENCY,
+    max_queue=settings.CHATBOT_MAX_QUEUE,
+    timeout=settings.CHATBOT_QUEUE_TIMEOUT,
+)
@@ -0,0 +1,70 @@
+import json, time, tracemalloc
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from chatbot.models import dataChunks as KBChunk
+from chatbot.embeddings import EMBEDDING_DIM, EMBEDDING_DTYPES, decode_embedding
+
+BENCH_SOURCE = "__bench_embeddings__"
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Compare load time and memory of JSON vs fp32/fp16/int8 embedding storage"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=10000)
+        parser.add_argument("--dim", type=int, default=EMBEDDING_DIM)
+
+    def handle(self, *args, **opts):
+        rng = np.random.default_rng(0)
+        vectors = rng.standard_normal((opts["rows"], opts["dim"])).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+
+        self.stdout.write(f"{opts['rows']} chunks x {opts['dim']} dims")
+        self.stdout.write(f"{'format':<6} {'payload MB':>11} {'load s':>8} {'peak MB':>8} {'max err':>9}")
+
+        # Everything is written inside a transaction that is always rolled back,
+        # so the benchmark never leaves rows behind.
+        try:
+            with transaction.atomic():
+                for fmt in ["json", *EMBEDDING_DTYPES]:
+                    self.stdout.write(self.run_format(fmt, vectors))
+                raise _Rollback
+        except _Rollback:
+            pass
+
+    def run_format(self, fmt, vectors):
+        KBChunk.objects.filter(source=BENCH_SOURCE).delete()
+        rows = []
+        for v in vectors:
+            row = KBChunk(source=BENCH_SOURCE, embedding=b"")
+            if fmt == "json":
+                # the pre-0003 layout: a JSON list as text (parked in `text` here)
+                row.text = json.dumps(v.tolist())
+            else:
+                row.text = ""
+                row.set_vector(v, fmt)
+            rows.append(row)
+        KBChunk.objects.bulk_create(rows, batch_size=1000)
+
+        qs = KBChunk.objects.filter(source=BENCH_SOURCE).order_by("id")
+        tracemalloc.start()
+        t0 = time.perf_counter()
+        if fmt == "json":
+            data = list(qs.values_list("text", flat=True))
+            payload = sum(len(t) for t in data)
+            matrix = np.asarray([json.loads(t) for t in data], dtype=np.float32)
+        else:
+            data = list(qs.values_list("embedding", "embedding_dtype", "embedding_scale"))
+            payload = sum(len(b) for b, _, _ in data)
+            matrix = np.vstack([decode_embedding(b, d, s) for b, d, s in data])
+        elapsed = time.perf_counter() - t0
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        err = float(np.abs(matrix - vectors).max())
+        return f"{fmt:<6} {payload / 1e6:>11.1f} {elapsed:>8.3f} {peak / 1e6:>8.1f} {err:>9.2e}"
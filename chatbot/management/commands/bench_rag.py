@@ -0,0 +1,156 @@
+import os, json, time
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.test.utils import override_settings
+from chatbot import rag
+from chatbot.index import vector_index
+from chatbot.models import dataChunks as KBChunk
+from chatbot.embeddings import StubEmbedder, encode_embedding
+from chatbot.lexical import term_frequencies
+from chatbot.chunking import CHUNK_OVERLAP_TOKENS, CHUNK_TOKENS, chunk_document, count_tokens
+
+BENCH_DIR = os.path.join(settings.BASE_DIR, "chatbot", "benchmarks")
+BENCH_SOURCE = "__bench_rag__"
+MODES = ["vector", "lexical", "hybrid"]
+
+# Filler vocabulary for distractor chunks: generic campus words, so they
+# compete with the real corpus on both lexical and vector scores.
+DISTRACTOR_WORDS = (
+    "college student students semester course department faculty exam result "
+    "notice campus library lab hostel fee fees admission event club sports "
+    "placement company training seminar workshop project assignment attendance "
+    "class routine teacher subject marks grade syllabus university office "
+    "canteen bus transport scholarship certificate form deadline schedule "
+    "meeting committee festival cultural annual report record building room"
+).split()
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Benchmark chatbot retrieval quality (recall@k, MRR) and latency as the corpus grows"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", default="1000,10000,100000",
+                            help="Comma-separated corpus sizes (chunks) to measure")
+        parser.add_argument("--k", type=int, default=5)
+        parser.add_argument("--max-tokens", type=int, default=rag.CONTEXT_TOKENS,
+                            help="build_context budget")
+        parser.add_argument("--dim", type=int, default=256,
+                            help="Stub embedding dimension (smaller keeps 100k chunks in RAM)")
+        parser.add_argument("--chunk-tokens", type=int, default=CHUNK_TOKENS)
+        parser.add_argument("--overlap-tokens", type=int, default=CHUNK_OVERLAP_TOKENS)
+        parser.add_argument("--corpus", default=os.path.join(BENCH_DIR, "corpus.txt"))
+        parser.add_argument("--questions", default=os.path.join(BENCH_DIR, "questions.json"))
+        parser.add_argument("--output", default=None, help="Write the JSON report here instead of stdout")
+
+    def handle(self, *args, **opts):
+        with open(opts["corpus"], "r", encoding="utf-8") as f:
+            pieces = [chunk.text for chunk in chunk_document(
+                f.read(), max_tokens=opts["chunk_tokens"], overlap_tokens=opts["overlap_tokens"])]
+        with open(opts["questions"], "r", encoding="utf-8") as f:
+            questions = json.load(f)
+
+        self.embedder = StubEmbedder(dim=opts["dim"])
+        self.embed_calls = 0
+        report = {
+            "config": {
+                "k": opts["k"], "max_tokens": opts["max_tokens"], "dim": opts["dim"],
+                "chunk_tokens": opts["chunk_tokens"], "overlap_tokens": opts["overlap_tokens"],
+                "corpus_chunks": len(pieces), "questions": len(questions),
+            },
+            "runs": [],
+        }
+
+        sizes = sorted(int(s) for s in opts["sizes"].split(","))
+        saved_embedder = rag.query_embedder
+        rag.query_embedder = self
+        # private cache so stub vectors never land in the real chatbot cache
+        bench_caches = {**settings.CACHES, "chatbot": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "bench-rag"}}
+        try:
+            with override_settings(CACHES=bench_caches), transaction.atomic():
+                KBChunk.objects.all().delete()
+                self.insert([(BENCH_SOURCE, p) for p in pieces])
+                stored = len(pieces)
+                rng = np.random.default_rng(0)
+                for size in sizes:
+                    self.insert([(f"{BENCH_SOURCE}noise", self.distractor(rng, opts["chunk_tokens"]))
+                                 for _ in range(max(size - stored, 0))])
+                    stored = max(size, stored)
+                    report["runs"].append(self.measure(stored, questions, opts))
+                raise _Rollback
+        except _Rollback:
+            pass
+        finally:
+            rag.query_embedder = saved_embedder
+            vector_index.mark_dirty()
+
+        out = json.dumps(report, indent=2)
+        if opts["output"]:
+            with open(opts["output"], "w", encoding="utf-8") as f:
+                f.write(out + "\n")
+            self.stdout.write(self.style.SUCCESS(f"Wrote {opts['output']}"))
+        else:
+            self.stdout.write(out)
+
+    # rag.query_embedder protocol: count calls so keyword-only answers show up
+    def embed(self, texts):
+        self.embed_calls += len(texts)
+        return self.embedder.embed(texts)
+
+    def distractor(self, rng, tokens):
+        # the filler words are all single tokens
+        return " ".join(rng.choice(DISTRACTOR_WORDS, size=tokens))
+
+    def insert(self, rows):
+        for start in range(0, len(rows), 2000):
+            batch = []
+            for source, text in rows[start:start + 2000]:
+                blob, scale = encode_embedding(self.embedder.embed_one(text))
+                batch.append(KBChunk(source=source, text=text, embedding=blob, embedding_scale=scale,
+                                     term_freqs=term_frequencies(text), token_count=count_tokens(text)))
+            KBChunk.objects.bulk_create(batch)
+
+    def measure(self, size, questions, opts):
+        vector_index.mark_dirty()
+        t0 = time.perf_counter()
+        vector_index.ensure_fresh()
+        run = {"chunks": size, "index_build_ms": round((time.perf_counter() - t0) * 1000, 1), "modes": {}}
+
+        for mode in MODES:
+            hits = 0
+            reciprocal_ranks, latencies = [], []
+            self.embed_calls = 0
+            caches["chatbot"].clear()  # every mode starts with a cold embedding cache
+            for q in questions:
+                t0 = time.perf_counter()
+                chunks = rag.hybrid_chunks(q["question"], k=opts["k"], mode=mode)
+                latencies.append((time.perf_counter() - t0) * 1000)
+                rank = next((i for i, (_, row) in enumerate(chunks, 1) if q["answer"] in row.text), None)
+                hits += rank is not None
+                reciprocal_ranks.append(1.0 / rank if rank else 0.0)
+            embed_calls = self.embed_calls
+
+            context_ms, context_tokens = [], []
+            for q in questions:
+                t0 = time.perf_counter()
+                context = rag.build_context(q["question"], k=opts["k"], max_tokens=opts["max_tokens"], mode=mode)
+                context_ms.append((time.perf_counter() - t0) * 1000)
+                context_tokens.append(count_tokens(context))
+
+            run["modes"][mode] = {
+                f"recall@{opts['k']}": round(hits / len(questions), 4),
+                "mrr": round(float(np.mean(reciprocal_ranks)), 4),
+                "latency_ms_p50": round(float(np.percentile(latencies, 50)), 3),
+                "latency_ms_p95": round(float(np.percentile(latencies, 95)), 3),
+                "embedding_calls": embed_calls,
+                "context_ms_p50": round(float(np.percentile(context_ms, 50)), 3),
+                "context_tokens_mean": round(float(np.mean(context_tokens)), 1),
+            }
+        return run
@@ -1,52 +1,200 @@
-import os, math, json
-from django.core.management.base import BaseCommand
+import os, hashlib
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from django.core.management.base import BaseCommand, CommandError
 from django.conf import settings
-from openai import OpenAI
+from django.db import transaction
+from django.db.models import Q
 from chatbot.models import dataChunks as KBChunk
+from chatbot.lexical import term_frequencies
+from chatbot.chunking import CHUNK_OVERLAP_TOKENS, CHUNK_TOKENS, chunk_document, count_tokens
+from chatbot.embeddings import DEFAULT_DTYPE, EMBEDDERS, EMBEDDING_DTYPES, encode_embedding, get_embedder
 from PyPDF2 import PdfReader
 
-CHUNK_SIZE = 900     
-CHUNK_OVERLAP = 150
+BATCH_SIZE = 100
+
+# Stored alongside each chunk; refreshed for chunks whose text is unchanged
+POSITION_FIELDS = ["heading", "char_start", "char_end", "page_start", "page_end", "token_count"]
+
+
+def text_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def file_fingerprint(path, *params):
+    """sha256 of the file, salted with the chunking params so changing them re-chunks"""
+    h = hashlib.sha256(repr(params).encode("utf-8"))
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def extract_text(path):
+    """Return the text of a .txt/.md file, a list of page texts for a .pdf,
+    or None if unsupported.
+
+    Module-level so it can run inside a ProcessPoolExecutor worker.
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext in [".txt", ".md"]:
+        with open(path, "r", encoding="utf-8", errors="ignore") as f:
+            return f.read()
+    if ext == ".pdf":
+        reader = PdfReader(path)
+        return [p.extract_text() or "" for p in reader.pages]
+    return None
+
+
+def batched(iterable, n):
+    it = iter(iterable)
+    while batch := list(islice(it, n)):
+        yield batch
 
-def chunk_text(text, size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
-    text = " ".join(text.split())  # normalize spaces
-    i = 0
-    while i < len(text):
-        yield text[i:i+size]
-        i += size - overlap
 
 class Command(BaseCommand):
-    help = "Embed files in chatbot/resources into KBChunk"
-
-    def handle(self, *args, **kwargs):
-        client = OpenAI()
-        resources_dir = os.path.join(settings.BASE_DIR, "chatbot", "resources")
-        files = [os.path.join(resources_dir, f) for f in os.listdir(resources_dir) if not f.startswith(".")]
-
-        total_chunks = 0
-        for path in files:
-            ext = os.path.splitext(path)[1].lower()
-            if ext in [".txt", ".md"]:
-                with open(path, "r", encoding="utf-8", errors="ignore") as f:
-                    content = f.read()
-            elif ext == ".pdf":
-                reader = PdfReader(path)
-                content = "\n".join([p.extract_text() or "" for p in reader.pages])
+    help = "Embed new or changed files in chatbot/resources into KBChunk"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=BATCH_SIZE,
+                            help="Chunks per embeddings request / bulk insert")
+        parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                            help="Processes used to extract text from files")
+        parser.add_argument("--embedder", choices=sorted(EMBEDDERS), default="openai",
+                            help="'stub' embeds offline with a deterministic hash embedder")
+        parser.add_argument("--dtype", choices=list(EMBEDDING_DTYPES), default=DEFAULT_DTYPE,
+                            help="Storage format for new embeddings (fp32, fp16, or int8 + per-row scale)")
+        parser.add_argument("--resources", default=None,
+                            help="Directory to index (default: chatbot/resources)")
+        parser.add_argument("--chunk-tokens", type=int, default=CHUNK_TOKENS,
+                            help="Maximum tokens per chunk")
+        parser.add_argument("--overlap-tokens", type=int, default=CHUNK_OVERLAP_TOKENS,
+                            help="Tokens repeated when a section continues into the next chunk")
+        parser.add_argument("--full", action="store_true",
+                            help="Drop every stored chunk and re-embed all files")
+
+    def handle(self, *args, **opts):
+        if opts["batch_size"] < 1:
+            raise CommandError("--batch-size must be at least 1")
+        if opts["chunk_tokens"] < 16:
+            raise CommandError("--chunk-tokens must be at least 16")
+
+        self.embedder = get_embedder(opts["embedder"])
+        self.batch_size = opts["batch_size"]
+        self.dtype = opts["dtype"]
+        self.added = self.skipped = self.removed = self.embedded = 0
+
+        resources_dir = opts["resources"] or os.path.join(settings.BASE_DIR, "chatbot", "resources")
+        files = {
+            f: os.path.join(resources_dir, f)
+            for f in sorted(os.listdir(resources_dir)) if not f.startswith(".")
+        }
+
+        if opts["full"]:
+            self.removed += KBChunk.objects.all().delete()[0]
+
+        # Garbage-collect chunks whose source file no longer exists
+        self.removed += KBChunk.objects.exclude(source__in=list(files)).delete()[0]
+
+        # A file is up to date when it has chunks and all of them carry its
+        # current fingerprint. Rows written by an interrupted run keep an empty
+        # fingerprint, so that file is revisited and its finished chunks reused.
+        stored = defaultdict(set)
+        counts = defaultdict(int)
+        for source, source_hash in KBChunk.objects.values_list("source", "source_hash"):
+            stored[source].add(source_hash)
+            counts[source] += 1
+
+        changed = {}
+        for name, path in files.items():
+            fp = file_fingerprint(path, opts["chunk_tokens"], opts["overlap_tokens"])
+            if stored.get(name) == {fp}:
+                self.skipped += counts[name]
             else:
-                self.stdout.write(self.style.WARNING(f"Skip {path}"))
+                changed[name] = fp
+
+        for name, content in self.extract_all({n: files[n] for n in changed}, opts["workers"]):
+            if content is None:
+                self.stdout.write(self.style.WARNING(f"Skip {files[name]}"))
                 continue
+            chunks = chunk_document(content, max_tokens=opts["chunk_tokens"],
+                                    overlap_tokens=opts["overlap_tokens"])
+            self.index_file(name, changed[name], chunks)
+
+        self.backfill()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Indexed: {self.added} added, {self.skipped} skipped, {self.removed} removed "
+            f"({self.embedded} embedded)"
+        ))
+
+    def index_file(self, name, fingerprint, chunks):
+        existing = defaultdict(list)
+        for pk, h in KBChunk.objects.filter(source=name).values_list("id", "content_hash"):
+            existing[h].append(pk)
+
+        # Keep one stored row per occurrence of an unchanged chunk; only its
+        # position may have moved
+        keep, new_pieces = [], []
+        for chunk in chunks:
+            h = text_hash(chunk.text)
+            if existing.get(h):
+                keep.append(KBChunk(id=existing[h].pop(), **self.position(chunk)))
+            else:
+                new_pieces.append((h, chunk))
+        KBChunk.objects.bulk_update(keep, POSITION_FIELDS, batch_size=500)
+        self.skipped += len(keep)
+
+        # Identical text indexed under another source already has an embedding;
+        # known maps hash -> (blob, dtype, scale)
+        known = {}
+        for h_batch in batched({h for h, _ in new_pieces}, 500):
+            rows = KBChunk.objects.filter(content_hash__in=h_batch).values_list(
+                "content_hash", "embedding", "embedding_dtype", "embedding_scale")
+            known.update((h, (bytes(blob), dtype, scale)) for h, blob, dtype, scale in rows)
+
+        for batch in batched(new_pieces, self.batch_size):
+            to_embed = {h: chunk.text for h, chunk in batch if h not in known}
+            if to_embed:
+                for h, vector in zip(to_embed, self.embedder.embed(list(to_embed.values()))):
+                    blob, scale = encode_embedding(vector, self.dtype)
+                    known[h] = (blob, self.dtype, scale)
+                self.embedded += len(to_embed)
+            with transaction.atomic():
+                KBChunk.objects.bulk_create([
+                    KBChunk(source=name, text=chunk.text, content_hash=h, embedding=known[h][0],
+                            embedding_dtype=known[h][1], embedding_scale=known[h][2],
+                            term_freqs=term_frequencies(chunk.text), **self.position(chunk))
+                    for h, chunk in batch
+                ])
+            self.added += len(batch)
+
+        # Whole file done: drop stale chunks and stamp the survivors
+        with transaction.atomic():
+            stale = [pk for pks in existing.values() for pk in pks]
+            if stale:
+                self.removed += KBChunk.objects.filter(id__in=stale).delete()[0]
+            KBChunk.objects.filter(source=name).update(source_hash=fingerprint)
 
-            for piece in chunk_text(content):
-                emb = client.embeddings.create(
-                    model="text-embedding-3-small",
-                    input=piece
-                ).data[0].embedding
+    @staticmethod
+    def position(chunk):
+        return {field: getattr(chunk, field) for field in POSITION_FIELDS}
 
-                KBChunk.objects.create(
-                    source=os.path.basename(path),
-                    text=piece,
-                    embedding=emb
-                )
-                total_chunks += 1
+    def backfill(self):
+        """Precompute BM25 term counts and token counts for chunks stored before they existed"""
+        rows = list(KBChunk.objects.filter(Q(term_freqs={}) | Q(token_count=0)).only("id", "text"))
+        for row in rows:
+            row.term_freqs = term_frequencies(row.text)
+            row.token_count = count_tokens(row.text)
+        KBChunk.objects.bulk_update(rows, ["term_freqs", "token_count"], batch_size=500)
 
-        self.stdout.write(self.style.SUCCESS(f"Indexed {total_chunks} chunks"))
+    def extract_all(self, files, workers):
+        """Yield (name, text) in name order, extracting in a process pool"""
+        names, paths = list(files), list(files.values())
+        if workers <= 1 or len(paths) <= 1:
+            for name, path in zip(names, paths):
+                yield name, extract_text(path)
+            return
+        with ProcessPoolExecutor(max_workers=min(workers, len(paths))) as pool:
+            yield from zip(names, pool.map(extract_text, paths))
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.5 on 2026-10-18 17:48
+
+import hashlib
+
+from django.db import migrations, models
+
+
+def backfill_content_hash(apps, schema_editor):
+    # Existing chunks keep their embeddings: the next index_kb run matches
+    # them by hash instead of re-embedding. source_hash stays empty, so every
+    # file is re-checked once.
+    KBChunk = apps.get_model("chatbot", "dataChunks")
+    batch = []
+    for row in KBChunk.objects.only("id", "text").iterator(chunk_size=1000):
+        row.content_hash = hashlib.sha256(row.text.encode("utf-8")).hexdigest()
+        batch.append(row)
+        if len(batch) >= 1000:
+            KBChunk.objects.bulk_update(batch, ["content_hash"])
+            batch = []
+    if batch:
+        KBChunk.objects.bulk_update(batch, ["content_hash"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='datachunks',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='datachunks',
+            name='source_hash',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.RunPython(backfill_content_hash, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,85 @@
+import json
+
+import numpy as np
+from django.db import migrations, models
+
+
+def json_to_fp32(apps, schema_editor):
+    KBChunk = apps.get_model("chatbot", "dataChunks")
+    batch = []
+    for row in KBChunk.objects.only("id", "embedding").iterator(chunk_size=500):
+        emb = row.embedding
+        if isinstance(emb, str):
+            emb = json.loads(emb)
+        row.embedding_blob = np.asarray(emb, dtype=np.float32).tobytes()
+        batch.append(row)
+        if len(batch) >= 500:
+            KBChunk.objects.bulk_update(batch, ["embedding_blob"])
+            batch = []
+    if batch:
+        KBChunk.objects.bulk_update(batch, ["embedding_blob"])
+
+
+def fp_to_json(apps, schema_editor):
+    KBChunk = apps.get_model("chatbot", "dataChunks")
+    dtypes = {"fp32": np.float32, "fp16": np.float16, "int8": np.int8}
+    batch = []
+    for row in KBChunk.objects.only("id", "embedding_blob", "embedding_dtype", "embedding_scale").iterator(chunk_size=500):
+        v = np.frombuffer(bytes(row.embedding_blob), dtype=dtypes[row.embedding_dtype]).astype(np.float32)
+        if row.embedding_dtype == "int8":
+            v = v * row.embedding_scale
+        row.embedding = v.tolist()
+        batch.append(row)
+        if len(batch) >= 500:
+            KBChunk.objects.bulk_update(batch, ["embedding"])
+            batch = []
+    if batch:
+        KBChunk.objects.bulk_update(batch, ["embedding"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0002_datachunks_content_hash_datachunks_source_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='datachunks',
+            name='embedding_blob',
+            field=models.BinaryField(default=b''),
+        ),
+        migrations.AddField(
+            model_name='datachunks',
+            name='embedding_dtype',
+            field=models.CharField(choices=[('fp32', 'fp32'), ('fp16', 'fp16'), ('int8', 'int8')], default='fp32', max_length=8),
+        ),
+        migrations.AddField(
+            model_name='datachunks',
+            name='embedding_scale',
+            field=models.FloatField(default=1.0),
+        ),
+        # nullable first so the migration can be reversed on a populated table
+        migrations.AlterField(
+            model_name='datachunks',
+            name='embedding',
+            field=models.JSONField(null=True),
+        ),
+        # Existing JSON lists become raw float32; re-run index_kb --full --dtype
+        # fp16/int8 to shrink them further.
+        migrations.RunPython(json_to_fp32, fp_to_json),
+        migrations.RemoveField(
+            model_name='datachunks',
+            name='embedding',
+        ),
+        migrations.RenameField(
+            model_name='datachunks',
+            old_name='embedding_blob',
+            new_name='embedding',
+        ),
+        migrations.AlterField(
+            model_name='datachunks',
+            name='embedding',
+            field=models.BinaryField(),
+        ),
+    ]
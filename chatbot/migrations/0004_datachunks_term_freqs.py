@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-18 17:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0003_datachunks_binary_embedding'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='datachunks',
+            name='term_freqs',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.5 on 2026-10-18 18:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0004_datachunks_term_freqs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='datachunks',
+            name='char_end',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='datachunks',
+            name='char_start',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='datachunks',
+            name='heading',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='datachunks',
+            name='page_end',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='datachunks',
+            name='page_start',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='datachunks',
+            name='token_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -1,11 +1,39 @@
 from django.db import models
+from .embeddings import DEFAULT_DTYPE, EMBEDDING_DTYPES, decode_embedding, encode_embedding
 
 # Create your models here.
 class dataChunks(models.Model):
+    DTYPE_CHOICES = [(name, name) for name in EMBEDDING_DTYPES]
+
     source = models.CharField(max_length=255)
     text = models.TextField()
-    embedding = models.JSONField()
+    # raw vector bytes, read with np.frombuffer (see chatbot.embeddings)
+    embedding = models.BinaryField()
+    embedding_dtype = models.CharField(max_length=8, choices=DTYPE_CHOICES, default=DEFAULT_DTYPE)
+    embedding_scale = models.FloatField(default=1.0)
+    # {term: count} for BM25, precomputed by index_kb (chatbot.lexical)
+    term_freqs = models.JSONField(default=dict, blank=True)
+    # sha256 of `text`; lets index_kb reuse embeddings for unchanged chunks
+    content_hash = models.CharField(max_length=64, blank=True, default="", db_index=True)
+    # sha256 of the source file, set once the whole file has been indexed
+    source_hash = models.CharField(max_length=64, blank=True, default="")
+    # where the chunk sits in its source (see chatbot.chunking)
+    heading = models.CharField(max_length=255, blank=True, default="")
+    char_start = models.PositiveIntegerField(null=True, blank=True)
+    char_end = models.PositiveIntegerField(null=True, blank=True)
+    page_start = models.PositiveIntegerField(null=True, blank=True)
+    page_end = models.PositiveIntegerField(null=True, blank=True)
+    # chat-model tokens in `text`; build_context packs by this
+    token_count = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
-        return f"{self.source} ({len(self.text)} chars)"
\ No newline at end of file
+        return f"{self.source} ({len(self.text)} chars)"
+
+    @property
+    def vector(self):
+        return decode_embedding(self.embedding, self.embedding_dtype, self.embedding_scale)
+
+    def set_vector(self, vector, dtype=DEFAULT_DTYPE):
+        self.embedding, self.embedding_scale = encode_embedding(vector, dtype)
+        self.embedding_dtype = dtype
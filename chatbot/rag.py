@@ -1,45 +1,130 @@
-import numpy as np
+from asgiref.sync import sync_to_async
 from openai import OpenAI
 from .models import dataChunks as KBChunk
+from .index import vector_index
+from .cache import acached_query_embedding, cached_query_embedding
+from .chunking import count_tokens
+from .openai_client import async_client
 
 client = OpenAI()
 
+# Set to an embedder from chatbot.embeddings (e.g. StubEmbedder) to run
+# retrieval offline; None means the OpenAI API.
+query_embedder = None
+
 # ---- Embed Query ----
 def embed_query(q: str, model="text-embedding-3-small"):
     """Return embedding vector for a query"""
+    if query_embedder is not None:
+        return query_embedder.embed([q])[0]
     return client.embeddings.create(
         model=model,
         input=q
     ).data[0].embedding
 
+
+async def aembed_query(q: str, model="text-embedding-3-small"):
+    """embed_query() on the async client, so no worker thread waits on the API"""
+    if query_embedder is not None:
+        return query_embedder.embed([q])[0]
+    response = await async_client.embeddings.create(model=model, input=q)
+    return response.data[0].embedding
+
 # ---- Top K Retrieval ----
+RRF_K = 60          # reciprocal rank fusion damping constant
+CANDIDATES = 20     # hits taken from each retriever before fusing
+
+
+def _load_rows(hits):
+    """[(score, chunk_id, source), ...] -> [(score, KBChunk), ...] in one query"""
+    if not hits:
+        return []
+    rows = KBChunk.objects.only("text", "source", "page_start", "page_end", "token_count").in_bulk([chunk_id for _, chunk_id, _ in hits])
+    return [(score, rows[chunk_id]) for score, chunk_id, _ in hits if chunk_id in rows]
+
+
 def top_k_chunks(query: str, k: int = 4):
-    """Retrieve top-k most relevant chunks from DB"""
-    qv = np.array(embed_query(query), dtype=np.float32)
-    qv = qv / (np.linalg.norm(qv) + 1e-10)  # normalize
+    """Retrieve top-k most relevant chunks using the in-memory vector index"""
+    return _load_rows(vector_index.search(cached_query_embedding(query, embed_query), k=k))
+
+
+def _rank(query_vector, lexical, k):
+    """Top-k rows for a query vector, fused by RRF with the lexical hits if any"""
+    if lexical is None:
+        return _load_rows(vector_index.search(query_vector, k=k))
+
+    vector = vector_index.search(query_vector, k=CANDIDATES)
+    fused = {}
+    for ranking in (lexical, vector):
+        for rank, (_, chunk_id, source) in enumerate(ranking):
+            score = fused.get(chunk_id, (0.0, source))[0] + 1.0 / (RRF_K + rank + 1)
+            fused[chunk_id] = (score, source)
+
+    best = sorted(fused.items(), key=lambda item: item[1][0], reverse=True)[:k]
+    return _load_rows([(score, chunk_id, source) for chunk_id, (score, source) in best])
+
 
-    rows = KBChunk.objects.all().only("text", "embedding", "source")
-    scored = []
-    for r in rows:
-        dv = np.array(r.embedding, dtype=np.float32)
-        dv = dv / (np.linalg.norm(dv) + 1e-10)
-        score = float(np.dot(qv, dv))
-        scored.append((score, r))
+def hybrid_chunks(query: str, k: int = 4, mode: str = "hybrid"):
+    """Retrieve top-k chunks by BM25 and cosine similarity fused with RRF.
 
-    scored.sort(key=lambda x: x[0], reverse=True)
-    return scored[:k]
+    mode="hybrid" skips the embedding call entirely when the lexical match is
+    confident (e.g. a subject code or staff name found verbatim);
+    "lexical" and "vector" use a single retriever.
+    """
+    lexical = None
+    if mode != "vector":
+        lexical, confident = vector_index.lexical_search(query, k=CANDIDATES)
+        if mode == "lexical" or (confident and mode == "hybrid"):
+            return _load_rows(lexical[:k])
+    return _rank(cached_query_embedding(query, embed_query), lexical, k)
+
+
+async def ahybrid_chunks(query: str, k: int = 4, mode: str = "hybrid"):
+    """hybrid_chunks() for async views: the embeddings request is awaited, and
+    only the index and database work runs in a worker thread"""
+    lexical = None
+    if mode != "vector":
+        lexical, confident = await sync_to_async(vector_index.lexical_search)(query, k=CANDIDATES)
+        if mode == "lexical" or (confident and mode == "hybrid"):
+            return await sync_to_async(_load_rows)(lexical[:k])
+    query_vector = await acached_query_embedding(query, aembed_query)
+    return await sync_to_async(_rank)(query_vector, lexical, k)
 
 
 # ---- Build Context ----
-def build_context(query: str, k: int = 4, max_chars: int = 2000):
-    """Build context string from retrieved chunks"""
-    chunks = top_k_chunks(query, k=k)
+CONTEXT_TOKENS = 768  # prompt tokens spent on retrieved chunks
+
+
+def _cite(row):
+    if row.page_start is None:
+        return row.source
+    if row.page_end in (None, row.page_start):
+        return f"{row.source}, p. {row.page_start}"
+    return f"{row.source}, pp. {row.page_start}-{row.page_end}"
+
+
+def _pack(chunks, max_tokens):
     ctx_parts, total = [], 0
     for score, row in chunks:
-        part = f"Source: {row.source}\nText: {row.text}\n---\n"
-        if total + len(part) > max_chars:
-            break
-        ctx_parts.append(part)
-        total += len(part)
+        header = f"Source: {_cite(row)}\nText: "
+        cost = count_tokens(header) + (row.token_count or count_tokens(row.text)) + 2
+        if total + cost > max_tokens:
+            continue
+        ctx_parts.append(f"{header}{row.text}\n---\n")
+        total += cost
 
     return "\n".join(ctx_parts)
+
+
+def build_context(query: str, k: int = 4, max_tokens: int = CONTEXT_TOKENS, mode: str = "hybrid"):
+    """Build context string from retrieved chunks, packed best-first into max_tokens.
+
+    A chunk too big for the remaining budget is skipped rather than ending the
+    context, so a smaller lower-ranked chunk can still fill the gap.
+    """
+    return _pack(hybrid_chunks(query, k=k, mode=mode), max_tokens)
+
+
+async def abuild_context(query: str, k: int = 4, max_tokens: int = CONTEXT_TOKENS, mode: str = "hybrid"):
+    """build_context() for async views (see ahybrid_chunks)"""
+    return _pack(await ahybrid_chunks(query, k=k, mode=mode), max_tokens)
@@ -1,3 +1,759 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import re
+import tempfile
+import threading
+from io import StringIO
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import AsyncRequestFactory, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase
+
+from . import rag, views
+from .chunking import chunk_document
+from .cache import cache_stats, cached_query_embedding, get_cached_answer, normalize_message, set_cached_answer
+from .embeddings import EMBEDDING_DTYPES, StubEmbedder, decode_embedding, encode_embedding
+from .index import vector_index
+from .lexical import BM25Index, term_frequencies, tokenize
+from .limiter import ChatLimiter
+from .management.commands.index_kb import text_hash
+from .models import dataChunks
+
+
+class FakeCompletions:
+    """Stands in for AsyncOpenAI().chat.completions: answers after `delay` seconds"""
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.calls = 0
+        self.in_flight = 0
+        self.peak = 0
+
+    async def create(self, **kwargs):
+        self.calls += 1
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.in_flight -= 1
+        content = json.dumps({"answer": "ok"})
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+
+class ChatLimiterTests(SimpleTestCase):
+    def test_admits_up_to_max_active_then_queues_then_sheds(self):
+        async def scenario():
+            limiter = ChatLimiter(max_active=1, max_queue=1, timeout=5)
+            self.assertTrue(await limiter.acquire())
+            queued = asyncio.ensure_future(limiter.acquire())
+            await asyncio.sleep(0)
+            self.assertEqual(limiter.waiting, 1)
+            self.assertFalse(await limiter.acquire())  # queue full: shed at once
+            limiter.release()
+            self.assertTrue(await queued)
+            self.assertEqual((limiter.active, limiter.waiting), (1, 0))
+            limiter.release()
+            self.assertEqual(limiter.active, 0)
+
+        asyncio.run(scenario())
+
+    def test_waiters_are_served_in_arrival_order(self):
+        async def scenario():
+            limiter = ChatLimiter(max_active=1, max_queue=10, timeout=5)
+            await limiter.acquire()
+            order = []
+
+            async def wait(name):
+                await limiter.acquire()
+                order.append(name)
+
+            waiters = [asyncio.ensure_future(wait(i)) for i in range(3)]
+            await asyncio.sleep(0)
+            for _ in waiters:
+                limiter.release()
+                await asyncio.sleep(0.01)
+            await asyncio.gather(*waiters)
+            self.assertEqual(order, [0, 1, 2])
+
+        asyncio.run(scenario())
+
+    def test_new_arrival_queues_behind_waiters(self):
+        async def scenario():
+            limiter = ChatLimiter(max_active=1, max_queue=10, timeout=5)
+            await limiter.acquire()
+            first = asyncio.ensure_future(limiter.acquire())
+            await asyncio.sleep(0)
+            limiter.release()
+            # the slot went to `first`, not to whoever asks next
+            late = asyncio.ensure_future(limiter.acquire())
+            await asyncio.sleep(0)
+            self.assertTrue(await first)
+            self.assertFalse(late.done())
+            limiter.release()
+            self.assertTrue(await late)
+
+        asyncio.run(scenario())
+
+    def test_wait_times_out(self):
+        async def scenario():
+            limiter = ChatLimiter(max_active=1, max_queue=1, timeout=0.05)
+            await limiter.acquire()
+            self.assertFalse(await limiter.acquire())
+            self.assertEqual((limiter.active, limiter.waiting), (1, 0))
+
+        asyncio.run(scenario())
+
+    def test_cancelled_waiter_leaves_the_queue(self):
+        async def scenario():
+            limiter = ChatLimiter(max_active=1, max_queue=1, timeout=5)
+            await limiter.acquire()
+            queued = asyncio.ensure_future(limiter.acquire())
+            await asyncio.sleep(0)
+            queued.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await queued
+            self.assertEqual(limiter.waiting, 0)
+            limiter.release()
+            self.assertEqual(limiter.active, 0)
+
+        asyncio.run(scenario())
+
+    def test_slot_handed_to_waiter_on_another_event_loop(self):
+        # async views under WSGI run each request on its own loop
+        limiter = ChatLimiter(max_active=1, max_queue=1, timeout=5)
+        asyncio.run(limiter.acquire())
+        queued = threading.Event()
+        result = []
+
+        async def wait():
+            acquiring = asyncio.ensure_future(limiter.acquire())
+            await asyncio.sleep(0)
+            queued.set()
+            result.append(await acquiring)
+
+        thread = threading.Thread(target=asyncio.run, args=(wait(),))
+        thread.start()
+        queued.wait(5)
+        limiter.release()
+        thread.join(5)
+        self.assertEqual(result, [True])
+        self.assertEqual(limiter.active, 1)
+
+
+class ChatApiBackpressureTests(SimpleTestCase):
+    """chat_api against a fake slow OpenAI backend.
+
+    The view is awaited directly: the test client's sync middleware would run
+    the requests one at a time.
+    """
+
+    def post_many(self, limiter, completions, n):
+        factory = AsyncRequestFactory()
+
+        async def scenario():
+            with mock.patch("chatbot.views.chat_limiter", limiter), \
+                    mock.patch("chatbot.views.async_client", SimpleNamespace(chat=SimpleNamespace(completions=completions))), \
+                    mock.patch("chatbot.views.abuild_context", return_value="context"), \
+                    mock.patch("chatbot.views.get_cached_answer", return_value=None), \
+                    mock.patch("chatbot.views.set_cached_answer"):
+                return await asyncio.gather(*(
+                    views.chat_api(factory.post("/chat-api/", json.dumps({"message": f"question {i}"}),
+                                                content_type="application/json"))
+                    for i in range(n)
+                ))
+
+        return asyncio.run(scenario())
+
+    def test_excess_requests_are_shed_with_503(self):
+        completions = FakeCompletions(delay=0.3)
+        responses = self.post_many(ChatLimiter(max_active=2, max_queue=2, timeout=5), completions, 6)
+
+        statuses = sorted(r.status_code for r in responses)
+        self.assertEqual(statuses, [200, 200, 200, 200, 503, 503])
+        self.assertEqual(completions.calls, 4)
+        self.assertEqual(completions.peak, 2)
+        busy = next(r for r in responses if r.status_code == 503)
+        self.assertEqual(busy["Retry-After"], "5")
+        self.assertEqual(json.loads(busy.content)["error"], "busy")
+
+    def test_queued_requests_give_up_after_timeout(self):
+        completions = FakeCompletions(delay=0.5)
+        limiter = ChatLimiter(max_active=1, max_queue=2, timeout=0.1)
+        responses = self.post_many(limiter, completions, 3)
+
+        self.assertEqual(sorted(r.status_code for r in responses), [200, 503, 503])
+        self.assertEqual((limiter.active, limiter.waiting), (0, 0))
+
+    def test_slot_released_when_backend_fails(self):
+        completions = FakeCompletions(delay=0)
+        completions.create = mock.AsyncMock(side_effect=RuntimeError("upstream down"))
+        limiter = ChatLimiter(max_active=1, max_queue=0, timeout=1)
+        responses = self.post_many(limiter, completions, 1)
+
+        self.assertEqual(json.loads(responses[0].content)["reply"], "Error: upstream down")
+        self.assertEqual(limiter.active, 0)
+
+
+class FakeEmbeddings:
+    """Stands in for AsyncOpenAI().embeddings, answering with StubEmbedder vectors"""
+
+    def __init__(self):
+        self.embedder = StubEmbedder()
+        self.calls = 0
+
+    async def create(self, model, input):
+        self.calls += 1
+        await asyncio.sleep(0)
+        return SimpleNamespace(data=[SimpleNamespace(embedding=self.embedder.embed_one(input), index=0)])
+
+
+class KnowledgeBaseTestCase(TestCase):
+    TEXTS = {
+        "fees.md": "Tuition fees are paid each semester at the accounts office.",
+        "library.md": "The library opens at nine and lends books for two weeks.",
+        "hostel.md": "Hostel rooms are shared by two students and include meals.",
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        embedder = StubEmbedder()
+        for source, text in cls.TEXTS.items():
+            chunk = dataChunks(source=source, text=text, token_count=len(text.split()))
+            chunk.set_vector(embedder.embed_one(text))
+            chunk.save()
+
+    def setUp(self):
+        caches["chatbot"].clear()
+        vector_index.mark_dirty()
+
+
+class AsyncRetrievalTests(KnowledgeBaseTestCase):
+    # async tests, so the database work sync_to_async hands off runs on the
+    # test's own connection
+    async def test_query_is_embedded_on_the_async_client(self):
+        embeddings = FakeEmbeddings()
+        sync_client = mock.Mock()
+        sync_client.embeddings.create.side_effect = AssertionError("sync OpenAI client used")
+        with mock.patch.object(rag, "async_client", SimpleNamespace(embeddings=embeddings)), \
+                mock.patch.object(rag, "client", sync_client):
+            first = await rag.abuild_context("when does the library open", k=1, mode="vector")
+            again = await rag.abuild_context("When does the library open?", k=1, mode="vector")
+
+        self.assertIn("Source: library.md", first)
+        self.assertEqual(again, first)
+        self.assertEqual(embeddings.calls, 1)  # the second query hit the embedding cache
+
+    async def test_async_and_sync_retrieval_agree(self):
+        query = "how are tuition fees paid"
+        with mock.patch.object(rag, "query_embedder", StubEmbedder()):
+            expected = await sync_to_async(rag.build_context)(query, k=2)
+        await caches["chatbot"].aclear()
+        with mock.patch.object(rag, "async_client", SimpleNamespace(embeddings=FakeEmbeddings())):
+            self.assertEqual(await rag.abuild_context(query, k=2), expected)
+        self.assertIn("Source: fees.md", expected)
+
+
+class RecordingEmbedder(StubEmbedder):
+    """StubEmbedder that records each batch it embeds; call number `fail_on`
+    raises instead, like an embeddings API going down mid-run"""
+
+    def __init__(self, fail_on=None):
+        super().__init__()
+        self.batches = []
+        self.fail_on = fail_on
+
+    def embed(self, texts):
+        if len(self.batches) + 1 == self.fail_on:
+            raise RuntimeError("embeddings API down")
+        self.batches.append(list(texts))
+        return super().embed(texts)
+
+
+class IndexKbTestCase(TestCase):
+    RULES = [f"Rule {n}: every student carries an identity card into block {n}." for n in range(1, 7)]
+    DOCS = {
+        "rules.md": "# Campus rules\n\n" + "\n\n".join(RULES),
+        "timings.txt": "The accounts office is open from ten to four on weekdays.",
+    }
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.resources = tmp.name
+        for name, text in self.DOCS.items():
+            self.write(name, text)
+
+    def write(self, name, text):
+        with open(os.path.join(self.resources, name), "w", encoding="utf-8") as f:
+            f.write(text)
+
+    def index(self, *args, embedder=None):
+        """Run index_kb offline; returns (added, skipped, removed, embedded) and the embedder"""
+        embedder = embedder or RecordingEmbedder()
+        out = StringIO()
+        with mock.patch("chatbot.management.commands.index_kb.get_embedder", return_value=embedder):
+            call_command("index_kb", "--resources", self.resources, "--workers", "1",
+                         "--chunk-tokens", "24", *args, stdout=out)
+        counts = re.search(r"(\d+) added, (\d+) skipped, (\d+) removed \((\d+) embedded\)", out.getvalue())
+        return tuple(int(n) for n in counts.groups()), embedder
+
+    def hashes(self, source):
+        return sorted(dataChunks.objects.filter(source=source).values_list("content_hash", flat=True))
+
+
+class IndexKbResumeTests(IndexKbTestCase):
+    def test_chunks_are_embedded_in_batches(self):
+        (added, skipped, removed, embedded), embedder = self.index("--batch-size", "2")
+
+        total = dataChunks.objects.count()
+        self.assertGreater(total, 2)
+        self.assertEqual((added, skipped, removed, embedded), (total, 0, 0, total))
+        self.assertTrue(all(len(batch) <= 2 for batch in embedder.batches))
+        self.assertEqual(len(embedder.batches), sum(-(-dataChunks.objects.filter(source=s).count() // 2)
+                                                    for s in self.DOCS))
+        self.assertFalse(dataChunks.objects.filter(source_hash="").exists())
+
+    def test_rerun_skips_unchanged_files(self):
+        (added, _, _, _), _ = self.index()
+        counts, embedder = self.index()
+
+        self.assertEqual(counts, (0, added, 0, 0))
+        self.assertEqual(embedder.batches, [])
+
+    def test_removed_source_is_garbage_collected(self):
+        self.index()
+        rules = dataChunks.objects.filter(source="rules.md").count()
+        os.remove(os.path.join(self.resources, "rules.md"))
+
+        (added, skipped, removed, embedded), _ = self.index()
+
+        self.assertEqual((added, removed, embedded), (0, rules, 0))
+        self.assertEqual(set(dataChunks.objects.values_list("source", flat=True)), {"timings.txt"})
+
+    def test_interrupted_run_resumes_where_it_stopped(self):
+        with self.assertRaisesMessage(RuntimeError, "embeddings API down"):
+            self.index("--batch-size", "1", embedder=RecordingEmbedder(fail_on=3))
+        # the first two batches were stored, but the file was never stamped done
+        self.assertEqual(dataChunks.objects.count(), 2)
+        self.assertEqual(set(dataChunks.objects.values_list("source_hash", flat=True)), {""})
+        done = set(self.hashes("rules.md"))
+
+        (added, skipped, removed, embedded), embedder = self.index("--batch-size", "1")
+
+        total = dataChunks.objects.count()
+        self.assertEqual((added, skipped, removed, embedded), (total - 2, 2, 0, total - 2))
+        self.assertFalse(done & {text_hash(t) for batch in embedder.batches for t in batch})
+        self.assertEqual(len(set(self.hashes("rules.md"))), len(self.hashes("rules.md")))
+        self.assertFalse(dataChunks.objects.filter(source_hash="").exists())
+        # and the next run has nothing left to do
+        self.assertEqual(self.index()[0], (0, total, 0, 0))
+
+
+class IndexKbIncrementalTests(IndexKbTestCase):
+    def test_edited_file_reembeds_only_changed_chunks(self):
+        self.index()
+        before = set(self.hashes("rules.md"))
+        timings = len(self.hashes("timings.txt"))
+        rules = self.RULES[:-1] + ["Rule 6: visitors sign the register at the main gate."]
+        self.write("rules.md", "# Campus rules\n\n" + "\n\n".join(rules))
+
+        (added, skipped, removed, embedded), embedder = self.index()
+
+        after = set(self.hashes("rules.md"))
+        self.assertTrue(after - before)
+        self.assertTrue(before & after)
+        self.assertEqual((added, embedded), (len(after - before), len(after - before)))
+        self.assertEqual(removed, len(before - after))
+        self.assertEqual(skipped, timings + len(before & after))
+        self.assertEqual({text_hash(t) for batch in embedder.batches for t in batch}, after - before)
+
+    def test_identical_text_in_another_source_reuses_its_embedding(self):
+        self.index()
+        self.write("timings-copy.txt", self.DOCS["timings.txt"])
+
+        (added, _, removed, embedded), embedder = self.index()
+
+        self.assertEqual((added, removed, embedded), (1, 0, 0))
+        original, copy = dataChunks.objects.filter(source__startswith="timings").order_by("source")
+        self.assertEqual(bytes(copy.embedding), bytes(original.embedding))
+
+    def test_full_rebuild_drops_and_reembeds_everything(self):
+        self.index()
+        total = dataChunks.objects.count()
+
+        counts, _ = self.index("--full")
+
+        self.assertEqual(counts, (total, 0, total, total))
+        self.assertEqual(dataChunks.objects.count(), total)
+
+
+class EmbeddingStorageTests(TestCase):
+    def setUp(self):
+        self.vector = np.asarray(StubEmbedder(dim=64).embed_one("hostel fees are paid each semester"), dtype=np.float32)
+
+    def test_every_dtype_round_trips(self):
+        for dtype, itemsize, tolerance in [("fp32", 4, 0), ("fp16", 2, 1e-3), ("int8", 1, None)]:
+            with self.subTest(dtype=dtype):
+                blob, scale = encode_embedding(self.vector, dtype)
+                self.assertEqual(len(blob), 64 * itemsize)
+                decoded = decode_embedding(blob, dtype, scale)
+                self.assertEqual(decoded.dtype, np.float32)
+                # int8 is off by at most half a quantization step
+                self.assertLessEqual(np.abs(decoded - self.vector).max(), tolerance if tolerance is not None else scale / 2)
+
+    def test_zero_vector_quantizes_without_dividing_by_zero(self):
+        blob, scale = encode_embedding(np.zeros(8), "int8")
+        self.assertEqual(scale, 1.0)
+        self.assertFalse(decode_embedding(blob, "int8", scale).any())
+
+    def test_chunk_vector_survives_a_save(self):
+        for dtype in EMBEDDING_DTYPES:
+            chunk = dataChunks(source="fees.md", text="fees")
+            chunk.set_vector(self.vector, dtype)
+            chunk.save()
+            chunk.refresh_from_db()
+            self.assertEqual(chunk.embedding_dtype, dtype)
+            np.testing.assert_allclose(chunk.vector, self.vector, atol=chunk.embedding_scale / 2 if dtype == "int8" else 1e-3)
+
+    def test_benchmark_leaves_no_rows_behind(self):
+        out = StringIO()
+        call_command("bench_embeddings", "--rows", "20", "--dim", "8", stdout=out)
+        self.assertEqual([line.split()[0] for line in out.getvalue().splitlines()[2:]], ["json", *EMBEDDING_DTYPES])
+        self.assertFalse(dataChunks.objects.exists())
+
+
+class BinaryEmbeddingMigrationTests(TransactionTestCase):
+    """0003 turns JSON embedding lists into float32 bytes, and back on reverse"""
+
+    before = [("chatbot", "0002_datachunks_content_hash_datachunks_source_hash")]
+    after = [("chatbot", "0003_datachunks_binary_embedding")]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        self.migrate(MigrationExecutor(connection).loader.graph.leaf_nodes())
+
+    def test_json_embeddings_are_converted_both_ways(self):
+        apps = self.migrate(self.before)
+        vector = [0.5, -0.25, 0.125]
+        apps.get_model("chatbot", "dataChunks").objects.create(source="fees.md", text="fees", embedding=vector)
+
+        row = self.migrate(self.after).get_model("chatbot", "dataChunks").objects.get()
+        self.assertEqual(row.embedding_dtype, "fp32")
+        self.assertEqual(decode_embedding(bytes(row.embedding)).tolist(), vector)
+
+        row = self.migrate(self.before).get_model("chatbot", "dataChunks").objects.get()
+        self.assertEqual(row.embedding, vector)
+
+
+class ChatCacheTests(KnowledgeBaseTestCase):
+    def test_messages_differing_in_case_spacing_and_punctuation_share_entries(self):
+        self.assertEqual(normalize_message("  What are the   FEES?? "), "what are the fees")
+        embed = mock.Mock(side_effect=StubEmbedder().embed_one)
+
+        first = cached_query_embedding("What are the fees?", embed)
+        again = cached_query_embedding("  what are the FEES ", embed)
+
+        embed.assert_called_once_with("What are the fees?")
+        np.testing.assert_array_equal(again, first)
+        stats = cache_stats()
+        self.assertEqual((stats["embedding_hit"], stats["embedding_miss"], stats["embedding_hit_rate"]), (1, 1, 0.5))
+
+    def test_answers_expire_when_index_kb_changes_the_corpus(self):
+        set_cached_answer("library hours", "Nine to five.")
+        self.assertEqual(get_cached_answer("Library hours?"), "Nine to five.")
+
+        # index_kb writes in bulk from another process: no signal reaches us,
+        # only the knowledge-base version stamp moves
+        chunk = dataChunks(source="library.md", text="Closed on Sundays.")
+        chunk.set_vector(StubEmbedder().embed_one(chunk.text))
+        dataChunks.objects.bulk_create([chunk])
+        with mock.patch("chatbot.index.REFRESH_INTERVAL", 0):
+            self.assertIsNone(get_cached_answer("Library hours?"))
+            set_cached_answer("library hours", "Nine to five, closed on Sundays.")
+            self.assertEqual(get_cached_answer("library hours"), "Nine to five, closed on Sundays.")
+        stats = cache_stats()
+        self.assertEqual((stats["answer_hit"], stats["answer_miss"]), (2, 1))
+
+    async def test_repeated_question_skips_embedding_and_completion(self):
+        completions = FakeCompletions(delay=0)
+        embedder = mock.Mock(wraps=StubEmbedder())
+        factory = AsyncRequestFactory()
+        with mock.patch("chatbot.views.async_client", SimpleNamespace(chat=SimpleNamespace(completions=completions))), \
+                mock.patch.object(rag, "query_embedder", embedder):
+            replies = [
+                json.loads((await views.chat_api(factory.post(
+                    "/chat-api/", json.dumps({"message": message}), content_type="application/json"))).content)
+                for message in ["When does the library open?", "when does the LIBRARY open"]
+            ]
+
+        self.assertEqual(replies, [{"reply": "ok"}, {"reply": "ok"}])
+        self.assertEqual((completions.calls, embedder.embed.call_count), (1, 1))
+
+    def test_stats_are_for_management_only(self):
+        get_cached_answer("fees")
+        request = RequestFactory().get("/chat-api/stats/")
+        request.user = SimpleNamespace(is_authenticated=True, is_superuser=False, role="management")
+        self.assertEqual(json.loads(views.chat_cache_stats(request).content)["answer_miss"], 1)
+        request.user = SimpleNamespace(is_authenticated=True, is_superuser=False, role="student")
+        self.assertEqual(views.chat_cache_stats(request).status_code, 302)
+
+
+class FakeStreamingCompletions:
+    """AsyncOpenAI().chat.completions with stream=True: yields `tokens` as deltas,
+    then raises `error` if one is given"""
+
+    def __init__(self, tokens, error=None):
+        self.tokens = tokens
+        self.error = error
+
+    async def create(self, **kwargs):
+        assert kwargs["stream"]
+        return self.stream()
+
+    async def stream(self):
+        yield SimpleNamespace(choices=[])  # usage-only chunk
+        for token in self.tokens:
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=token))])
+        if self.error:
+            raise self.error
+
+
+class ChatStreamTests(KnowledgeBaseTestCase):
+    async def stream(self, completions, message="When does the library open?", limiter=None):
+        """POST to chat_stream; returns the response, its events as [(event, data), ...]
+        and the mocked view logger"""
+        limiter = limiter or ChatLimiter(max_active=1, max_queue=0, timeout=1)
+        with mock.patch("chatbot.views.chat_limiter", limiter), \
+                mock.patch("chatbot.views.async_client", SimpleNamespace(chat=SimpleNamespace(completions=completions))), \
+                mock.patch.object(rag, "query_embedder", StubEmbedder()), \
+                mock.patch("chatbot.views.logger") as logger:
+            response = await views.chat_stream(AsyncRequestFactory().post(
+                "/chat-api/stream/", json.dumps({"message": message}), content_type="application/json"))
+            body = b"".join([part async for part in response.streaming_content]).decode()
+            await sync_to_async(response.close)()
+        events = []
+        for block in body.strip().split("\n\n"):
+            event, data = block.split("\n")
+            events.append((event.removeprefix("event: "), json.loads(data.removeprefix("data: "))))
+        return response, events, logger
+
+    async def test_tokens_stream_then_done_carries_the_reply(self):
+        limiter = ChatLimiter(max_active=1, max_queue=0, timeout=1)
+        response, events, logger = await self.stream(FakeStreamingCompletions(["Nine", " to", " five."]), limiter=limiter)
+
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        self.assertEqual(events, [("token", {"t": "Nine"}), ("token", {"t": " to"}), ("token", {"t": " five."}),
+                                  ("done", {"reply": "Nine to five."})])
+        self.assertEqual(limiter.active, 0)
+        ttft, _, chars = logger.info.call_args.args[1:]
+        self.assertRegex(ttft, r"^[\d.]+s$")
+        self.assertEqual(chars, 13)
+
+    async def test_cached_reply_is_a_single_done_event(self):
+        await self.stream(FakeStreamingCompletions(["Nine to five."]))
+        completions = FakeStreamingCompletions([])
+        completions.create = mock.AsyncMock(side_effect=AssertionError("completion requested"))
+
+        _, events, logger = await self.stream(completions, message="when does the library open")
+
+        self.assertEqual(events, [("done", {"reply": "Nine to five."})])
+        logger.info.assert_not_called()
+
+    async def test_failure_mid_stream_ends_with_an_error_and_frees_the_slot(self):
+        limiter = ChatLimiter(max_active=1, max_queue=0, timeout=1)
+        _, events, _ = await self.stream(FakeStreamingCompletions(["Nine"], error=RuntimeError("upstream down")),
+                                         limiter=limiter)
+
+        self.assertEqual(events, [("token", {"t": "Nine"}), ("done", {"reply": "Error: upstream down"})])
+        self.assertEqual(limiter.active, 0)
+        self.assertIsNone(await sync_to_async(get_cached_answer)("When does the library open?"))
+
+
+class BM25IndexTests(SimpleTestCase):
+    def test_subject_codes_survive_tokenizing(self):
+        self.assertEqual(tokenize("Where is the PCC-CS301 lab?"), ["pcc", "cs301", "lab", "pcc-cs301"])
+
+    def test_rare_terms_outrank_common_ones(self):
+        index = BM25Index([term_frequencies(t) for t in [
+            "exam schedule for all students", "students pay hostel fees", "hostel warden office hours"]])
+        hits, confident = index.search("hostel warden", k=3)
+        self.assertEqual([row for _, row in hits], [2, 1])
+        self.assertTrue(confident)
+
+    def test_partial_match_is_not_confident(self):
+        index = BM25Index([term_frequencies(t) for t in ["hostel fees", "library fees"]])
+        hits, confident = index.search("hostel curfew", k=2)
+        self.assertEqual([row for _, row in hits], [0])
+        self.assertFalse(confident)
+        self.assertEqual(index.search("curfew", k=2), ([], False))
+
+
+class HybridRetrievalTests(KnowledgeBaseTestCase):
+    TEXTS = {
+        **KnowledgeBaseTestCase.TEXTS,
+        "timetable.md": "PCC-CS301 Data Structures meets in room 204 on Mondays.",
+    }
+
+    def setUp(self):
+        super().setUp()
+        self.embedder = mock.Mock(wraps=StubEmbedder())
+
+    def retrieve(self, query, mode="hybrid", k=4):
+        with mock.patch.object(rag, "query_embedder", self.embedder):
+            return [row.source for _, row in rag.hybrid_chunks(query, k=k, mode=mode)]
+
+    def test_confident_keyword_match_skips_the_embedding_call(self):
+        self.assertEqual(self.retrieve("PCC-CS301 room", k=1), ["timetable.md"])
+        self.embedder.embed.assert_not_called()
+
+    def test_weak_keyword_match_is_fused_with_vector_ranking(self):
+        sources = self.retrieve("where do students stay", k=len(self.TEXTS))
+
+        self.embedder.embed.assert_called_once()
+        self.assertEqual(sources[0], "hostel.md")
+        # chunks with no keyword in common still come back from the vector side
+        self.assertCountEqual(sources, self.TEXTS)
+
+    def test_fused_scores_are_reciprocal_ranks(self):
+        with mock.patch.object(rag, "query_embedder", self.embedder):
+            scores = [score for score, _ in rag.hybrid_chunks("where do students stay", k=2)]
+        self.assertAlmostEqual(scores[0], 2 / (rag.RRF_K + 1))  # first in both rankings
+        self.assertLess(scores[1], scores[0])
+
+    def test_single_retriever_modes(self):
+        self.assertEqual(self.retrieve("students", mode="lexical", k=1), ["hostel.md"])
+        self.embedder.embed.assert_not_called()
+        self.assertEqual(self.retrieve("PCC-CS301 room", mode="vector", k=1), ["timetable.md"])
+        self.embedder.embed.assert_called_once()
+
+
+class BenchRagTests(KnowledgeBaseTestCase):
+    def bench(self, *args):
+        out = StringIO()
+        call_command("bench_rag", "--sizes", "100,40", "--dim", "64", *args, stdout=out)
+        return out.getvalue()
+
+    def test_report_is_json_per_size_and_mode(self):
+        report = json.loads(self.bench("--k", "3"))
+
+        self.assertEqual(report["config"]["k"], 3)
+        self.assertEqual(report["config"]["questions"], 18)
+        self.assertEqual([run["chunks"] for run in report["runs"]], [40, 100])
+        for run in report["runs"]:
+            self.assertEqual(list(run["modes"]), ["vector", "lexical", "hybrid"])
+            for mode, metrics in run["modes"].items():
+                with self.subTest(chunks=run["chunks"], mode=mode):
+                    self.assertLessEqual(0, metrics["mrr"])
+                    self.assertLessEqual(metrics["mrr"], metrics["recall@3"])
+                    self.assertLessEqual(metrics["recall@3"], 1)
+                    self.assertLessEqual(metrics["latency_ms_p50"], metrics["latency_ms_p95"])
+            self.assertEqual(run["modes"]["lexical"]["embedding_calls"], 0)
+            self.assertEqual(run["modes"]["vector"]["embedding_calls"], 18)
+            self.assertLess(run["modes"]["hybrid"]["embedding_calls"], 18)
+
+    def test_knowledge_base_and_embedder_are_restored(self):
+        report = os.path.join(self.enterContext(tempfile.TemporaryDirectory()), "report.json")
+        self.assertIn("Wrote", self.bench("--output", report))
+        with open(report, encoding="utf-8") as f:
+            self.assertEqual(len(json.load(f)["runs"]), 2)
+
+        self.assertCountEqual(dataChunks.objects.values_list("source", flat=True), self.TEXTS)
+        self.assertIsNone(rag.query_embedder)
+
+
+class ChunkerTests(SimpleTestCase):
+    STEPS = [f"Step {n}: applicants upload form {n} before the stated deadline." for n in range(1, 6)]
+    DOC = "# Admissions\n\n" + "\n\n".join(STEPS) + "\n\n# Hostel\n\nRooms are shared by two students."
+
+    def test_chunks_keep_paragraphs_whole_within_the_token_budget(self):
+        chunks = chunk_document(self.DOC, max_tokens=40, overlap_tokens=0)
+
+        self.assertGreater(len(chunks), 1)
+        for chunk in chunks:
+            self.assertLessEqual(chunk.token_count, 40)
+        for step in self.STEPS:
+            self.assertTrue(any(step in chunk.text for chunk in chunks), step)
+
+    def test_continued_section_repeats_its_heading(self):
+        first, *rest = chunk_document(self.DOC, max_tokens=40, overlap_tokens=0)
+
+        self.assertTrue(first.text.startswith("# Admissions\n\nStep 1"))
+        for chunk in rest:
+            self.assertEqual(chunk.heading, "Admissions")
+            self.assertTrue(chunk.text.startswith("Admissions\nStep"))
+
+    def test_offsets_point_back_into_the_source(self):
+        for chunk in chunk_document(self.DOC, max_tokens=40, overlap_tokens=0):
+            self.assertTrue(chunk.text.endswith(self.DOC[chunk.char_start:chunk.char_end]))
+            self.assertIsNone(chunk.page_start)
+
+    def test_pages_are_recorded_for_paged_sources(self):
+        pages = ["Fees are paid online.", "Hostel\n\nRooms are shared.", "Library\n\nBooks are lent for two weeks."]
+        chunks = chunk_document(pages, max_tokens=20, overlap_tokens=0)
+
+        self.assertEqual([(c.page_start, c.page_end) for c in chunks], [(1, 2), (3, 3)])
+        text = "\n\n".join(pages)
+        self.assertEqual([text[c.char_start:c.char_end] for c in chunks], [c.text for c in chunks])
+
+    def test_oversized_paragraph_is_cut_at_sentences(self):
+        paragraph = " ".join(f"Rule {n} applies to block {n}." for n in range(1, 21))
+
+        chunks = chunk_document(paragraph, max_tokens=24, overlap_tokens=0)
+
+        self.assertGreater(len(chunks), 1)
+        for chunk in chunks:
+            self.assertLessEqual(chunk.token_count, 24)
+            self.assertRegex(chunk.text, r"^Rule \d+ .*\.$")
+
+
+class ContextPackingTests(KnowledgeBaseTestCase):
+    def context(self, max_tokens):
+        return rag.build_context("tuition fees library books", k=3, max_tokens=max_tokens, mode="lexical")
+
+    def test_chunk_over_the_budget_is_skipped_for_a_smaller_one(self):
+        self.assertIn("Source: fees.md", self.context(100))
+        dataChunks.objects.filter(source="fees.md").update(token_count=500)
+
+        context = self.context(100)
+
+        self.assertNotIn("fees.md", context)
+        self.assertIn("Source: library.md", context)
+        self.assertEqual(self.context(10), "")
+
+    def test_pages_are_cited(self):
+        dataChunks.objects.filter(source="fees.md").update(page_start=2, page_end=3)
+        dataChunks.objects.filter(source="library.md").update(page_start=4, page_end=4)
+
+        context = self.context(200)
+
+        self.assertIn("Source: fees.md, pp. 2-3", context)
+        self.assertIn("Source: library.md, p. 4", context)
+
+
+class IndexKbPositionTests(IndexKbTestCase):
+    def test_unchanged_chunks_move_with_their_text(self):
+        self.index()
+        before = dict(dataChunks.objects.filter(source="rules.md").values_list("content_hash", "char_start"))
+        text = "Read these before term starts.\n\n" + self.DOCS["rules.md"]
+        self.write("rules.md", text)
+
+        (added, _, removed, embedded), _ = self.index()
+
+        self.assertEqual((added, removed, embedded), (1, 0, 1))
+        for chunk in dataChunks.objects.filter(source="rules.md", content_hash__in=before):
+            self.assertEqual(chunk.char_start, before[chunk.content_hash] + 32)
+            self.assertTrue(chunk.text.endswith(text[chunk.char_start:chunk.char_end]))
+            self.assertEqual(chunk.heading, "Campus rules")
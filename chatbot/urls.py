@@ -4,4 +4,6 @@ from . import views
 urlpatterns = [
     path("", views.chat_page, name="chat_page"),
     path("chat-api/", views.chat_api, name="chat_api"),
+    path("chat-api/stream/", views.chat_stream, name="chat_stream"),
+    path("chat-api/stats/", views.chat_cache_stats, name="chat_cache_stats"),
 ]
@@ -1,64 +1,169 @@
 from django.shortcuts import render
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
+from django.contrib.auth.decorators import login_required, user_passes_test
+from asgiref.sync import sync_to_async
 import json
-from .openai_client import client
-from .rag import build_context
+import logging
+import time
+from .openai_client import async_client
+from .limiter import chat_limiter
+from .rag import abuild_context
+from .cache import get_cached_answer, set_cached_answer, cache_stats
+
+logger = logging.getLogger(__name__)
+
+CHAT_MODEL = "gpt-4o-mini"
+
+SYSTEM_PROMPT = (
+    "You are RAG-GPT, a strict assistant.\n"
+    "RULES:\n"
+    "1. Answer ONLY using the provided context.\n"
+    "2. If the answer is not found, reply exactly: "
+    "'Oops! Not my fault, Rohan kept this secret.'\n"
+    "3. Elitte College Of Engineering and  elitte . elite , ece all same name \n"
+    "4. Be concise and accurate.\n"
+)
+
+BUSY_REPLY = "The assistant is busy right now. Please try again in a moment."
+
+
+def build_messages(user_msg, context):
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": f"Context:\n{context}\n\nQuestion: {user_msg}"},
+    ]
 
 
 def chat_page(request):
     return render(request, "includes/chatbot.html")
 
 
+def busy_response():
+    response = JsonResponse({"reply": BUSY_REPLY, "error": "busy"}, status=503)
+    response["Retry-After"] = "5"
+    return response
+
+
 @csrf_exempt
-def chat_api(request):
-    if request.method == "POST":
-        user_msg = json.loads(request.body).get("message", "").strip()
-        if not user_msg:
-            return JsonResponse({"reply": "Please ask a valid question."})
+async def chat_api(request):
+    if request.method != "POST":
+        return JsonResponse({"error": "POST only"}, status=405)
 
+    user_msg = json.loads(request.body).get("message", "").strip()
+    if not user_msg:
+        return JsonResponse({"reply": "Please ask a valid question."})
+
+    cached = await sync_to_async(get_cached_answer)(user_msg)
+    if cached is not None:
+        return JsonResponse({"reply": cached})
+
+    if not await chat_limiter.acquire():
+        return busy_response()
+
+    try:
         # Build context from RAG
-        context = build_context(user_msg, k=5)
-
-        system_prompt = (
-            "You are RAG-GPT, a strict assistant.\n"
-            "RULES:\n"
-            "1. Answer ONLY using the provided context.\n"
-            "2. If the answer is not found, reply exactly: "
-            "'Oops! Not my fault, Rohan kept this secret.'\n"
-            "3. Elitte College Of Engineering and  elitte . elite , ece all same name \n"
-            "4. Be concise and accurate.\n"
-        )
+        context = await abuild_context(user_msg, k=5)
 
-        user_prompt = f"Context:\n{context}\n\nQuestion: {user_msg}"
-
-        try:
-            completion = client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt},
-                ],
-                temperature=0,
-                response_format={
-                    "type": "json_schema",
-                    "json_schema": {
-                        "name": "rag_answer",
-                        "schema": {
-                            "type": "object",
-                            "properties": {"answer": {"type": "string"}},
-                            "required": ["answer"],
-                        },
+        completion = await async_client.chat.completions.create(
+            model=CHAT_MODEL,
+            messages=build_messages(user_msg, context),
+            temperature=0,
+            response_format={
+                "type": "json_schema",
+                "json_schema": {
+                    "name": "rag_answer",
+                    "schema": {
+                        "type": "object",
+                        "properties": {"answer": {"type": "string"}},
+                        "required": ["answer"],
                     },
                 },
-            )
+            },
+        )
+
+        reply_json = completion.choices[0].message.content
+        reply = json.loads(reply_json)["answer"]
+        await sync_to_async(set_cached_answer)(user_msg, reply)
+
+    except Exception as e:
+        reply = f"Error: {str(e)}"
+    finally:
+        chat_limiter.release()
+
+    return JsonResponse({"reply": reply})
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def stream_reply(user_msg):
+    """Yield SSE 'token' events as the completion streams, then one 'done'
+    event carrying the same {"reply": ...} payload chat_api returns."""
+    started = time.perf_counter()
+    parts, ttft = [], None
+    try:
+        context = await abuild_context(user_msg, k=5)
+
+        # plain-text output here: a JSON-schema answer can't be shown token by token
+        stream = await async_client.chat.completions.create(
+            model=CHAT_MODEL,
+            messages=build_messages(user_msg, context),
+            temperature=0,
+            stream=True,
+        )
+        async for chunk in stream:
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if not delta:
+                continue
+            if ttft is None:
+                ttft = time.perf_counter() - started
+            parts.append(delta)
+            yield sse_event("token", {"t": delta})
+
+        reply = "".join(parts).strip()
+        await sync_to_async(set_cached_answer)(user_msg, reply)
+    except Exception as e:
+        reply = f"Error: {str(e)}"
+
+    total = time.perf_counter() - started
+    logger.info(
+        "chat_stream ttft=%s total=%.3fs chars=%d",
+        f"{ttft:.3f}s" if ttft is not None else "-", total, len(reply),
+    )
+    yield sse_event("done", {"reply": reply})
+
+
+async def single_event(reply):
+    yield sse_event("done", {"reply": reply})
+
+
+@csrf_exempt
+async def chat_stream(request):
+    """Opt-in streaming variant of chat_api (text/event-stream)"""
+    if request.method != "POST":
+        return JsonResponse({"error": "POST only"}, status=405)
+
+    user_msg = json.loads(request.body).get("message", "").strip()
+    if not user_msg:
+        return JsonResponse({"reply": "Please ask a valid question."})
 
-            reply_json = completion.choices[0].message.content
-            reply = json.loads(reply_json)["answer"]
+    cached = await sync_to_async(get_cached_answer)(user_msg)
+    if cached is not None:
+        events = single_event(cached)
+    elif await chat_limiter.acquire():
+        events = chat_limiter.hold(stream_reply(user_msg))
+    else:
+        return busy_response()
 
-        except Exception as e:
-            reply = f"Error: {str(e)}"
+    response = StreamingHttpResponse(events, content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"  # don't let a proxy buffer the stream
+    return response
 
-        return JsonResponse({"reply": reply})
 
-    return JsonResponse({"error": "POST only"}, status=405)
\ No newline at end of file
+@login_required
+@user_passes_test(lambda u: u.is_superuser or u.role == "management")
+def chat_cache_stats(request):
+    return JsonResponse(cache_stats())
@@ -66,8 +66,33 @@ CACHES = {
     'default': {
         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
         'LOCATION': 'unique-snowflake',
-    }
+    },
+    # chatbot query-embedding / answer cache; locmem culls least recently used
+    'chatbot': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'chatbot',
+        'TIMEOUT': 60 * 60 * 24,
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    },
 }
+# chatbot latency lines (time-to-first-token, total) go to the console / Render logs
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'chatbot': {'handlers': ['console'], 'level': 'INFO'},
+    },
+}
+
+# Chatbot backpressure (per worker): OpenAI calls in flight, extra requests
+# allowed to wait for a slot, and how long they wait before a 503 "busy"
+CHATBOT_MAX_CONCURRENCY = config("CHATBOT_MAX_CONCURRENCY", default=8, cast=int)
+CHATBOT_MAX_QUEUE = config("CHATBOT_MAX_QUEUE", default=16, cast=int)
+CHATBOT_QUEUE_TIMEOUT = config("CHATBOT_QUEUE_TIMEOUT", default=10.0, cast=float)
+
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
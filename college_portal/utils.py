@@ -0,0 +1,62 @@
+import time
+
+import numpy as np
+from django.core.cache import cache
+from django.core.exceptions import PermissionDenied
+from django.http import Http404
+from django.shortcuts import get_object_or_404
+
+from account.models import Department
+
+
+class CacheVersion:
+    """A counter in the default cache that is part of a family of cache keys.
+
+    bump() orphans every key built with the old value at once, instead of
+    deleting them one by one. Seeded from the clock so an evicted counter
+    never reuses an old version.
+    """
+
+    def __init__(self, key):
+        self.key = key
+
+    def get(self):
+        return cache.get_or_set(self.key, time.time_ns, timeout=None)
+
+    def bump(self):
+        try:
+            cache.incr(self.key)
+        except ValueError:  # not set yet, or evicted
+            cache.set(self.key, time.time_ns(), timeout=None)
+
+
+def percent_of(part, whole):
+    """Elementwise part / whole * 100, NaN where whole is 0"""
+    return np.divide(part * 100.0, whole, out=np.full(np.shape(whole), np.nan), where=whole > 0)
+
+
+def rounded(values):
+    """JSON-friendly list: 2 decimals, None where there was nothing to count"""
+    return [None if np.isnan(v) else round(v, 2) for v in np.asarray(values, dtype=float).tolist()]
+
+
+def analytics_department(request):
+    """The department an analytics page reports on, None for the whole college.
+
+    HODs see their own department; management and admins pick one with
+    ?department=<id> or get the whole college. Raises PermissionDenied for
+    anyone else and Http404 for an unknown or malformed id.
+    """
+    role = getattr(request.user, "role", None)
+    if role == "hod":
+        if request.user.department is None:
+            raise PermissionDenied
+        return request.user.department
+    if role not in ("management", "admin"):
+        raise PermissionDenied
+    department_id = request.GET.get("department")
+    if not department_id:
+        return None
+    if not department_id.isdecimal():
+        raise Http404("No such department.")
+    return get_object_or_404(Department, id=department_id)
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import ExamSession, ExamMark
+from .models import ExamSession, ExamMark, ResultCard
 
 @admin.register(ExamSession)
 class ExamSessionAdmin(admin.ModelAdmin):
@@ -11,3 +11,9 @@ class ExamMarkAdmin(admin.ModelAdmin):
     list_display = ("session", "student", "marks")
     search_fields = ("student__username", "student__first_name", "student__last_name")
     list_filter = ("session__exam_type",)
+
+@admin.register(ResultCard)
+class ResultCardAdmin(admin.ModelAdmin):
+    list_display = ("student", "semester", "built_at")
+    search_fields = ("student__username", "student__first_name", "student__last_name")
+    list_filter = ("semester__department", "semester")
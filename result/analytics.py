@@ -0,0 +1,277 @@
+from functools import cached_property
+
+import numpy as np
+from django.core.cache import cache
+from django.db.models import F, FloatField
+from django.db.models.functions import Cast
+
+from college_portal.utils import CacheVersion, percent_of, rounded
+from .models import ExamMark
+
+PASS_PERCENT = 40.0  # of full marks, per CA exam and per subject
+QUANTILES = (0, 10, 25, 50, 75, 90, 100)  # min, percentile bands, median, max
+BINS = 10  # histogram bins, each 10% of full marks
+RANKING_SIZE = 100
+
+# Every change to marks, exam sessions or subjects bumps the version (see the
+# receivers in result.models and the bulk writes in result.views/sheets),
+# orphaning all cached reports at once. Other workers' locmem copies only go
+# when they expire, so keep the TTL short.
+REPORT_TTL = 60 * 5
+_version = CacheVersion("result:analytics:version")
+
+
+def invalidate_grade_analytics():
+    _version.bump()
+
+
+def grouped_quantiles(values, groups, ngroups, quantiles=QUANTILES):
+    """Percentiles of values within each group, as np.percentile(..., method="linear").
+
+    One sort for all groups; returns (ngroups, len(quantiles)), NaN rows for
+    empty groups.
+    """
+    counts = np.bincount(groups, minlength=ngroups)
+    if not len(values):
+        return np.full((ngroups, len(quantiles)), np.nan)
+    ordered = values[np.lexsort((values, groups))]
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    position = starts[:, None] + np.maximum(counts - 1, 0)[:, None] * (np.asarray(quantiles) / 100.0)
+    lo = np.minimum(np.floor(position).astype(np.int64), len(ordered) - 1)
+    hi = np.minimum(np.ceil(position).astype(np.int64), len(ordered) - 1)
+    out = ordered[lo] + (ordered[hi] - ordered[lo]) * (position - np.floor(position))
+    out[counts == 0] = np.nan
+    return out
+
+
+def competition_ranks(scores):
+    """1-based ranks, highest score first, ties sharing the better rank (1, 2, 2, 4)"""
+    order = np.argsort(-scores, kind="stable")
+    ordered = -scores[order]
+    ranks = np.empty(len(scores), dtype=np.int64)
+    ranks[order] = np.searchsorted(ordered, ordered, side="left") + 1
+    return ranks
+
+
+class SemesterMarks:
+    """Every ExamMark of a department (or the whole college) for one semester number, as arrays.
+
+    Exam sessions are the columns of session_*; marks reference them through
+    mark_session. Marks not entered yet are NaN in mark_value and count as
+    pending, never as zero. All statistics below are sorts and bincounts over
+    these arrays, with no per-student queries or loops.
+    """
+
+    def __init__(self, session_ids, session_subject, session_exam_type, session_full, session_department,
+                 mark_session, mark_student, mark_value):
+        self.session_ids = session_ids
+        self.session_subject = session_subject
+        self.session_exam_type = session_exam_type
+        self.session_full = session_full
+        self.session_department = session_department
+        self.mark_session = mark_session
+        self.mark_student = mark_student
+        self.mark_value = mark_value
+
+    @classmethod
+    def load(cls, department, semester_num):
+        """One query for the semester's marks of department (None for all departments)"""
+        marks = ExamMark.objects.filter(session__semester__semester=semester_num)
+        if department is not None:
+            marks = marks.filter(session__department=department)
+        rows = list(marks.order_by().values_list(
+            # as float in SQL: skips building a Decimal per mark
+            "session_id", "student_id", Cast("marks", FloatField()),
+            "session__subject_id", "session__exam_type", "session__full_marks", "session__department_id",
+        ))
+        session_id, student, value, subject, exam_type, full, dept = zip(*rows) if rows else ((),) * 7
+
+        session_ids, first, mark_session = np.unique(
+            np.asarray(session_id, dtype=np.int64), return_index=True, return_inverse=True)
+        return cls(
+            session_ids,
+            np.asarray(subject, dtype=np.int64)[first],
+            np.asarray(exam_type, dtype=str)[first],
+            np.asarray(full, dtype=float)[first],
+            np.asarray(dept, dtype=np.int64)[first],
+            mark_session.reshape(-1),
+            np.asarray(student, dtype=np.int64),
+            np.asarray([np.nan if v is None else v for v in value], dtype=float),
+        )
+
+    def __len__(self):
+        return len(self.mark_student)
+
+    @cached_property
+    def entered(self):
+        return ~np.isnan(self.mark_value)
+
+    @cached_property
+    def students(self):
+        """(student_ids, index of each mark's student in student_ids)"""
+        ids, inverse = np.unique(self.mark_student, return_inverse=True)
+        return ids, inverse.reshape(-1)
+
+    @cached_property
+    def subjects(self):
+        """(subject_ids, index of each session's subject in subject_ids)"""
+        ids, inverse = np.unique(self.session_subject, return_inverse=True)
+        return ids, inverse.reshape(-1)
+
+    def exam_stats(self, pass_percent=PASS_PERCENT):
+        """Per exam session: entered/pending counts, quantiles, mean, fails and a histogram of % of full marks"""
+        n = len(self.session_ids)
+        entered = self.entered
+        session, value = self.mark_session[entered], self.mark_value[entered]
+        count = np.bincount(session, minlength=n)
+        percent = value * 100.0 / self.session_full[session]
+        bins = np.minimum((percent // (100 / BINS)).astype(np.int64), BINS - 1)
+        return {
+            "session_id": self.session_ids,
+            "entered": count,
+            "pending": np.bincount(self.mark_session, minlength=n) - count,
+            "mean": np.divide(np.bincount(session, weights=value, minlength=n), count,
+                              out=np.full(n, np.nan), where=count > 0),
+            "quantiles": grouped_quantiles(value, session, n),
+            "fail": np.bincount(session, weights=percent < pass_percent, minlength=n).astype(np.int64),
+            "histogram": np.bincount(session * BINS + bins, minlength=n * BINS).reshape(n, BINS),
+        }
+
+    def subject_results(self):
+        """(student index, subject index, marks, full) per (student, subject), over entered CAs"""
+        students, student_index = self.students
+        subjects, session_subject = self.subjects
+        entered = self.entered
+        # one integer key per pair, so grouping is a 1-D sort and not a row-wise one
+        keys, inverse = np.unique(
+            student_index[entered] * len(subjects) + session_subject[self.mark_session[entered]],
+            return_inverse=True)
+        inverse = inverse.reshape(-1)
+        marks = np.bincount(inverse, weights=self.mark_value[entered], minlength=len(keys))
+        full = np.bincount(inverse, weights=self.session_full[self.mark_session[entered]], minlength=len(keys))
+        return keys // len(subjects), keys % len(subjects), marks, full
+
+    def failing(self, pass_percent=PASS_PERCENT, min_subjects=2):
+        """Students below pass_percent in at least min_subjects subjects, most failures first.
+
+        Returns (student indexes, failed subject counts, failed subject indexes per student).
+        """
+        pair_student, pair_subject, marks, full = self.subject_results()
+        failed = percent_of(marks, full) < pass_percent
+        counts = np.bincount(pair_student[failed], minlength=len(self.students[0]))
+        who = np.flatnonzero(counts >= min_subjects)
+        who = who[np.argsort(-counts[who], kind="stable")]
+        # failed subjects grouped by student with one sort
+        order = np.argsort(pair_student[failed], kind="stable")
+        by_student = np.split(pair_subject[failed][order], np.cumsum(counts)[:-1])
+        return who, counts[who], [by_student[i] for i in who.tolist()]
+
+    def ranking(self):
+        """(student_ids, marks, full, percent, rank) over all entered marks"""
+        students, student_index = self.students
+        entered = self.entered
+        n = len(students)
+        marks = np.bincount(student_index[entered], weights=self.mark_value[entered], minlength=n)
+        full = np.bincount(student_index[entered], weights=self.session_full[self.mark_session[entered]], minlength=n)
+        percent = percent_of(marks, full)
+        # students with nothing entered rank last
+        return students, marks, full, percent, competition_ranks(np.nan_to_num(percent, nan=-1.0))
+
+
+def semester_report(department, semester_num, pass_percent=PASS_PERCENT):
+    """Everything the grade analytics page and API show, as a JSON-ready dict"""
+    from account.models import Department, User
+    from subject.models import Subject
+
+    data = SemesterMarks.load(department, semester_num)
+    exams = data.exam_stats(pass_percent)
+    students, marks, full, percent, rank = data.ranking()
+    failing, failed_counts, failed_subjects = data.failing(pass_percent)
+    subject_ids = data.subjects[0]
+
+    top = np.argsort(rank, kind="stable")[:RANKING_SIZE]
+    people = {
+        row["id"]: row for row in User.objects.filter(
+            id__in=set(students[top].tolist()) | set(students[failing].tolist())
+        ).values(
+            "id", "username", "first_name", "last_name",
+            department_name=F("department__name"), registration_number=F("student_profile__registration_number"),
+        )
+    }
+    subjects = Subject.objects.in_bulk(subject_ids.tolist())
+    departments = dict(Department.objects.filter(id__in=set(data.session_department.tolist()))
+                       .values_list("id", "name"))
+
+    def person(i):
+        row = people.get(int(students[i]), {})
+        return {
+            "student_id": int(students[i]),
+            "name": f"{row.get('first_name', '')} {row.get('last_name', '')}".strip(),
+            "username": row.get("username"),
+            "registration_number": row.get("registration_number"),
+            "department": row.get("department_name"),
+        }
+
+    exam_rows = []
+    for i in range(len(data.session_ids)):
+        subject = subjects.get(int(data.session_subject[i]))
+        q = rounded(exams["quantiles"][i])
+        entered = int(exams["entered"][i])
+        exam_rows.append({
+            "session_id": int(data.session_ids[i]),
+            "subject_id": int(data.session_subject[i]),
+            "name": subject.name if subject else None,
+            "code": subject.code if subject else None,
+            "department": departments.get(int(data.session_department[i])),
+            "exam_type": str(data.session_exam_type[i]),
+            "full_marks": int(data.session_full[i]),
+            "entered": entered,
+            "pending": int(exams["pending"][i]),
+            "mean": rounded([exams["mean"][i]])[0],
+            "min": q[0], "p10": q[1], "p25": q[2], "median": q[3], "p75": q[4], "p90": q[5], "max": q[6],
+            "fail": int(exams["fail"][i]),
+            "fail_percent": rounded([percent_of(exams["fail"][i], entered)])[0],
+            "histogram": exams["histogram"][i].tolist(),
+        })
+    exam_rows.sort(key=lambda r: (r["department"] or "", r["code"] or "", r["exam_type"]))
+
+    scored = percent[~np.isnan(percent)]
+    overall = np.bincount(np.minimum((scored // (100 / BINS)).astype(np.int64), BINS - 1), minlength=BINS)
+    return {
+        "department": {"id": department.id, "name": department.name} if department else None,
+        "semester": semester_num,
+        "pass_percent": pass_percent,
+        "summary": {
+            "students": len(students),
+            "exams": len(data.session_ids),
+            "marks": int(data.entered.sum()),
+            "pending": int((~data.entered).sum()),
+            "mean_percent": rounded([scored.mean() if len(scored) else np.nan])[0],
+            "median_percent": rounded([np.median(scored) if len(scored) else np.nan])[0],
+            "failing_students": len(failing),
+        },
+        "exams": exam_rows,
+        "failing": [
+            {**person(i), "failed": int(n), "percent": rounded([percent[i]])[0],
+             "subjects": [subjects[int(subject_ids[s])].code for s in failed.tolist() if int(subject_ids[s]) in subjects]}
+            for i, n, failed in zip(failing.tolist(), failed_counts.tolist(), failed_subjects)
+        ],
+        "ranking": [
+            {**person(i), "rank": int(rank[i]), "marks": round(float(marks[i]), 2), "full": int(full[i]),
+             "percent": rounded([percent[i]])[0]}
+            for i in top.tolist()
+        ],
+        "histogram": {
+            "bins": [f"{b * 100 // BINS}-{(b + 1) * 100 // BINS}" for b in range(BINS)],
+            "students": overall.tolist(),
+        },
+    }
+
+
+def cached_semester_report(department, semester_num):
+    key = f"result:analytics:{_version.get()}:{department.pk if department else 'all'}:{semester_num}"
+    report = cache.get(key)
+    if report is None:
+        report = semester_report(department, semester_num)
+        cache.set(key, report, REPORT_TTL)
+    return report
@@ -0,0 +1,115 @@
+import io
+import json
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from account.models import Department, Semester, User
+from attendance.exports import csv_stream, xlsx_stream
+from student.models import Student
+from subject.models import Subject
+from result.models import ExamMark, ExamSession
+from result.sheets import export_header, export_rows, import_marks, read_rows
+
+BENCH_NAME = "__bench_marks__"
+
+
+class _Rollback(Exception):
+    pass
+
+
+class _QueryTimer:
+    """execute_wrapper that adds up time spent in the database"""
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        t0 = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - t0
+            self.queries += 1
+
+
+class Command(BaseCommand):
+    help = ("Time a marks sheet import (CSV and XLSX) for one synthetic exam session: "
+            "parse time, database time and query count")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=1000)
+        parser.add_argument("--repeat", type=int, default=5, help="Timings are the median of this many runs")
+        parser.add_argument("--output", default=None, help="Write the JSON report here instead of stdout")
+
+    def handle(self, *args, **opts):
+        report = {"config": {"rows": opts["rows"], "repeat": opts["repeat"], "database": connection.vendor}}
+        try:
+            # everything is generated inside a transaction that is rolled back
+            with transaction.atomic():
+                session = self.seed(opts["rows"])
+                for fmt in ("csv", "xlsx"):
+                    report[fmt] = self.run(session, fmt, opts["repeat"])
+                raise _Rollback
+        except _Rollback:
+            pass
+
+        out = json.dumps(report, indent=2)
+        if opts["output"]:
+            with open(opts["output"], "w", encoding="utf-8") as f:
+                f.write(out + "\n")
+            self.stdout.write(self.style.SUCCESS(f"Wrote {opts['output']}"))
+        else:
+            self.stdout.write(out)
+
+    def seed(self, n):
+        department = Department.objects.create(name=BENCH_NAME)
+        semester = Semester.objects.create(department=department, semester=1)
+        subject = Subject.objects.create(name="Subject", code=BENCH_NAME, subject_type="theory",
+                                         department=department, semester=semester)
+        students = User.objects.bulk_create(
+            User(username=f"{BENCH_NAME}{i}", first_name=f"Student {i:06d}", password="!", role="student",
+                 department=department, semester=semester)
+            for i in range(n)
+        )
+        Student.objects.bulk_create(
+            Student(user=student, registration_number=f"BENCH{i:06d}") for i, student in enumerate(students))
+        session = ExamSession.objects.create(department=department, semester=semester, subject=subject,
+                                             exam_type="CA1", full_marks=25)
+        ExamMark.objects.bulk_create(ExamMark(session=session, student=student) for student in students)
+        return session
+
+    def sheet(self, session, fmt, marks):
+        rows = ([*row[:3], mark] for row, mark in zip(export_rows(session), marks))
+        if fmt == "csv":
+            return io.BytesIO("".join(csv_stream(export_header(session), rows)).encode("utf-8"))
+        return io.BytesIO(b"".join(xlsx_stream("Marks", export_header(session), rows)))
+
+    def run(self, session, fmt, repeat):
+        rng = np.random.default_rng(0)
+        timings = {"total_ms": [], "db_ms": []}
+        for _ in range(repeat):
+            # fresh marks every run, so each import rewrites every row
+            marks = np.round(rng.uniform(0, session.full_marks, session.marks.count()), 2).tolist()
+            upload = self.sheet(session, fmt, marks)
+            timer = _QueryTimer()
+            t0 = time.perf_counter()
+            with connection.execute_wrapper(timer):
+                changed, errors = import_marks(session, read_rows(upload))
+            timings["total_ms"].append((time.perf_counter() - t0) * 1000)
+            timings["db_ms"].append(timer.seconds * 1000)
+            if errors:
+                raise CommandError(f"Import rejected the generated sheet: {errors[:3]}")
+            stored = [float(m) for m in
+                      session.marks.order_by("student__first_name", "student__last_name").values_list("marks", flat=True)]
+            if stored != marks:
+                raise CommandError("Imported marks differ from the sheet")
+
+        result = {name: round(float(np.median(ms)), 1) for name, ms in timings.items()}
+        result["parse_ms"] = round(result["total_ms"] - result["db_ms"], 1)
+        result["queries"] = timer.queries
+        result["changed"] = changed
+        result["file_bytes"] = len(upload.getvalue())
+        return result
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from account.models import Semester
+from result.provisioning import provision
+
+
+class Command(BaseCommand):
+    help = ("Create the missing ExamSession rows of the CA exams each department-semester runs, "
+            "and their ExamMark rows (or --verify none are missing)")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--department", type=int, help="Only this department id")
+        parser.add_argument("--semester", type=int, help="Only this semester number")
+        parser.add_argument("--verify", action="store_true",
+                            help="Only report semesters with missing rows; exit non-zero if any")
+
+    def handle(self, *args, **opts):
+        semesters = Semester.objects.select_related("department").order_by("department__name", "semester")
+        if opts["department"]:
+            semesters = semesters.filter(department_id=opts["department"])
+        if opts["semester"]:
+            semesters = semesters.filter(semester=opts["semester"])
+
+        total_sessions = total_marks = 0
+        for semester in semesters:
+            with transaction.atomic():
+                sessions, marks = provision(semester, dry_run=opts["verify"])
+            if opts["verify"] and (sessions or marks):
+                self.stdout.write(f"missing: {semester}: {sessions} sessions, {marks} marks")
+            total_sessions += sessions
+            total_marks += marks
+
+        if opts["verify"]:
+            if total_sessions or total_marks:
+                raise CommandError(
+                    f"Exam rows missing: {total_sessions} sessions, {total_marks} marks "
+                    "(run provision_exam_marks to fix)")
+            self.stdout.write(self.style.SUCCESS(f"Exam rows OK ({len(semesters)} semesters)"))
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f"Provisioned exam rows: {total_sessions} sessions, {total_marks} marks across {len(semesters)} semesters"))
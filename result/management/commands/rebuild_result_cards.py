@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from account.models import Semester
+from result.models import ExamSession, ResultCard
+
+
+class Command(BaseCommand):
+    help = "Recompute ResultCard for every semester with a locked exam (or --verify it without writing)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--verify", action="store_true",
+                            help="Only report cards that differ from a recompute; exit non-zero on drift")
+
+    def handle(self, *args, **opts):
+        with transaction.atomic():
+            started = ExamSession.objects.filter(locked=True).values("semester_id")
+            expected = {}
+            for semester in Semester.objects.filter(id__in=started):
+                for student_id, rows in ResultCard.compute(
+                        semester, ResultCard.students(semester), locked_only=True).items():
+                    expected[student_id, semester.id] = rows
+            if opts["verify"]:
+                self.verify(expected)
+                return
+
+            deleted = ResultCard.objects.all().delete()[0]
+            ResultCard.objects.bulk_create(
+                (ResultCard(student_id=student_id, semester_id=semester_id, rows=rows)
+                 for (student_id, semester_id), rows in expected.items()),
+                batch_size=1000,
+            )
+
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt result cards: {len(expected)} cards ({deleted} replaced)"))
+
+    def verify(self, expected):
+        stored = {(r[0], r[1]): r[2] for r in ResultCard.objects.values_list("student_id", "semester_id", "rows").iterator()}
+        missing = expected.keys() - stored.keys()
+        extra = stored.keys() - expected.keys()
+        wrong = [k for k in expected.keys() & stored.keys() if expected[k] != stored[k]]
+
+        for label, keys in [("missing", missing), ("stale", extra), ("wrong", wrong)]:
+            for student_id, semester_id in sorted(keys)[:20]:
+                self.stdout.write(f"{label}: student={student_id} semester={semester_id}")
+
+        if missing or extra or wrong:
+            raise CommandError(
+                f"Result cards drifted: {len(missing)} missing, {len(extra)} stale, {len(wrong)} wrong "
+                "(run rebuild_result_cards to fix)")
+        self.stdout.write(self.style.SUCCESS(f"Result cards OK ({len(stored)} cards)"))
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.5 on 2026-10-18 18:29
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('result', '0002_studentsgpa'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='exammark',
+            index=models.Index(fields=['student', 'session'], name='result_exammark_student_idx'),
+        ),
+    ]
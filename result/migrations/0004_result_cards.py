@@ -0,0 +1,67 @@
+# Generated by Django 5.2.5 on 2026-10-18 18:35
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def populate_cards(apps, schema_editor):
+    # ResultCard.compute() and students(), against the historical models
+    ExamSession = apps.get_model('result', 'ExamSession')
+    ExamMark = apps.get_model('result', 'ExamMark')
+    ResultCard = apps.get_model('result', 'ResultCard')
+    Semester = apps.get_model('account', 'Semester')
+    Subject = apps.get_model('subject', 'Subject')
+    User = apps.get_model('account', 'User')
+    exam_types = ['CA1', 'CA2', 'CA3', 'CA4']
+
+    complete = (
+        ExamSession.objects.values('semester_id')
+        .annotate(open=Count('id', filter=Q(locked=False)))
+        .filter(open=0).values_list('semester_id', flat=True)
+    )
+    cards = []
+    for semester in Semester.objects.filter(id__in=complete):
+        subjects = list(Subject.objects.filter(department_id=semester.department_id, semester=semester)
+                        .order_by('name').values_list('id', 'name', 'code'))
+        marks = {}
+        for student_id, subject_id, exam_type, value in ExamMark.objects.filter(
+                session__department_id=semester.department_id, session__semester=semester,
+        ).values_list('student_id', 'session__subject_id', 'session__exam_type', 'marks'):
+            marks.setdefault(student_id, {})[subject_id, exam_type] = None if value is None else str(value)
+        students = set(User.objects.filter(role='student', semester=semester).values_list('id', flat=True)) | set(
+            ExamMark.objects.filter(session__semester=semester).values_list('student_id', flat=True))
+        for student_id in students:
+            got = marks.get(student_id, {})
+            rows = [{'name': name, 'code': code, **{et: got.get((subject_id, et)) for et in exam_types}}
+                    for subject_id, name, code in subjects]
+            cards.append(ResultCard(student_id=student_id, semester=semester, rows=rows))
+    ResultCard.objects.bulk_create(cards, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0004_passwordresetotp'),
+        ('result', '0003_exammark_student_index'),
+        ('subject', '0002_subject_teachers'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResultCard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rows', models.JSONField(default=list)),
+                ('built_at', models.DateTimeField(auto_now=True)),
+                ('semester', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='result_cards', to='account.semester')),
+                ('student', models.ForeignKey(limit_choices_to={'role': 'student'}, on_delete=django.db.models.deletion.CASCADE, related_name='result_cards', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('student', 'semester')},
+            },
+        ),
+        migrations.RunPython(populate_cards, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.5 on 2026-10-18 19:55
+
+from django.db import migrations
+
+
+def rebuild_cards(apps, schema_editor):
+    # ResultCard.refresh() for every semester with a locked session, against
+    # the historical models: cards now hold the locked cells of semesters
+    # still running exams too, and each row its subject_id
+    ExamSession = apps.get_model('result', 'ExamSession')
+    ExamMark = apps.get_model('result', 'ExamMark')
+    ResultCard = apps.get_model('result', 'ResultCard')
+    Semester = apps.get_model('account', 'Semester')
+    Subject = apps.get_model('subject', 'Subject')
+    User = apps.get_model('account', 'User')
+    exam_types = ['CA1', 'CA2', 'CA3', 'CA4']
+
+    ResultCard.objects.all().delete()
+    cards = []
+    for semester in Semester.objects.filter(id__in=ExamSession.objects.filter(locked=True).values('semester_id')):
+        subjects = list(Subject.objects.filter(department_id=semester.department_id, semester=semester)
+                        .order_by('name').values_list('id', 'name', 'code'))
+        sessions = ExamSession.objects.filter(department_id=semester.department_id, semester=semester, locked=True)
+        cells = set(sessions.values_list('subject_id', 'exam_type'))
+        marks = {}
+        for student_id, subject_id, exam_type, value in ExamMark.objects.filter(session__in=sessions).values_list(
+                'student_id', 'session__subject_id', 'session__exam_type', 'marks'):
+            marks.setdefault(student_id, {})[subject_id, exam_type] = None if value is None else str(value)
+        students = set(User.objects.filter(role='student', semester=semester).values_list('id', flat=True)) | set(
+            ExamMark.objects.filter(session__semester=semester).values_list('student_id', flat=True))
+        for student_id in students:
+            got = marks.get(student_id, {})
+            rows = [{'subject_id': subject_id, 'name': name, 'code': code,
+                     **{et: got.get((subject_id, et)) for et in exam_types if (subject_id, et) in cells}}
+                    for subject_id, name, code in subjects]
+            cards.append(ResultCard(student_id=student_id, semester=semester, rows=rows))
+    ResultCard.objects.bulk_create(cards, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('result', '0004_result_cards'),
+    ]
+
+    operations = [
+        migrations.RunPython(rebuild_cards, migrations.RunPython.noop),
+    ]
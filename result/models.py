@@ -1,6 +1,10 @@
-from django.db import models
+from collections import defaultdict
+
+from django.db import models, transaction
 from django.conf import settings
-from account.models import Department, Semester
+from django.db.models.signals import post_delete, post_init, post_save, pre_save
+from django.dispatch import receiver
+from account.models import Department, Semester, User
 from subject.models import Subject
 
 
@@ -40,6 +44,10 @@ class ExamMark(models.Model):
 
     class Meta:
         unique_together = ("session", "student")
+        indexes = [
+            # a student's marks across sessions (result page)
+            models.Index(fields=["student", "session"], name="result_exammark_student_idx"),
+        ]
 
     def __str__(self):
         return f"{self.student} - {self.session}: {self.marks}"
@@ -57,3 +65,220 @@ class StudentSGPA(models.Model):
 
     def __str__(self):
         return f"{self.student} - Sem {self.semester_num}: {self.sgpa}"
+
+
+class ResultCard(models.Model):
+    """A student's CA table for one semester, as the result page shows it.
+
+    Holds the cells of the semester's locked exam sessions, so it exists for
+    every student of a semester as soon as one session is locked. The cells
+    of open sessions are left out and read from the marks when the page is
+    shown (rows_for), so a card is never stale. Cards are rebuilt or dropped
+    when a session is locked, unlocked or changed while locked, when a mark
+    in a locked session changes and when a subject of the semester changes;
+    opening a session touches no card.
+    `rebuild_result_cards` recomputes (or --verify checks) the table.
+    """
+    student = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="result_cards",
+                                limit_choices_to={"role": "student"})
+    semester = models.ForeignKey(Semester, on_delete=models.CASCADE, related_name="result_cards")
+    # [{"subject_id", "name", "code", "CA1".."CA4"}] by subject name, with a
+    # CA key only where that session is locked; marks as strings, None if not entered
+    rows = models.JSONField(default=list)
+    built_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ("student", "semester")
+
+    def __str__(self):
+        return f"{self.student} - {self.semester}"
+
+    @staticmethod
+    def compute(semester, student_ids, locked_only=False):
+        """{student_id: rows} from the semester's subjects and marks, two queries (three locked_only)"""
+        subjects = list(
+            Subject.objects.filter(department_id=semester.department_id, semester=semester)
+            .order_by("name").values_list("id", "name", "code")
+        )
+        sessions = ExamSession.objects.filter(department_id=semester.department_id, semester=semester)
+        if locked_only:
+            sessions = sessions.filter(locked=True)
+        marks = defaultdict(dict)
+        for student_id, subject_id, exam_type, value in ExamMark.objects.filter(
+                student_id__in=student_ids, session__in=sessions,
+        ).values_list("student_id", "session__subject_id", "session__exam_type", "marks"):
+            marks[student_id][subject_id, exam_type] = None if value is None else str(value)
+
+        exam_types = [value for value, _ in ExamSession.EXAM_TYPES]
+        cells = set(sessions.values_list("subject_id", "exam_type")) if locked_only else None
+        return {
+            student_id: [
+                {"subject_id": subject_id, "name": name, "code": code,
+                 **{et: marks[student_id].get((subject_id, et)) for et in exam_types
+                    if cells is None or (subject_id, et) in cells}}
+                for subject_id, name, code in subjects
+            ]
+            for student_id in student_ids
+        }
+
+    @staticmethod
+    def students(semester):
+        """Everyone with a card in the semester: its students and anyone with marks there"""
+        return (
+            set(User.objects.filter(role="student", semester=semester).values_list("id", flat=True))
+            | set(ExamMark.objects.filter(session__semester=semester).values_list("student_id", flat=True))
+        )
+
+    @classmethod
+    def refresh(cls, semester_id, student_ids=None, create=True):
+        """Rebuild the semester's cards (or just these students') from its locked sessions.
+
+        Drops them when no session is locked. With create=False only cards
+        that exist are rebuilt: on deletes the student may be going in the
+        same cascade.
+        """
+        with transaction.atomic():
+            # lock/unlock refreshes of one semester queue up here, so the last
+            # one to run sees the final state
+            locked = list(ExamSession.objects.select_for_update().filter(semester_id=semester_id)
+                          .values_list("locked", flat=True))
+            cards = cls.objects.filter(semester_id=semester_id)
+            if student_ids is not None:
+                cards = cards.filter(student_id__in=student_ids)
+            if not create:
+                student_ids = list(cards.values_list("student_id", flat=True))
+                if not student_ids:
+                    return 0
+            cards.delete()
+
+            semester = Semester.objects.filter(pk=semester_id).first()
+            if not any(locked) or semester is None:
+                return 0
+            if student_ids is None:
+                student_ids = cls.students(semester)
+            built = cls.compute(semester, student_ids, locked_only=True)
+            cls.objects.bulk_create(
+                (cls(student_id=student_id, semester=semester, rows=rows) for student_id, rows in built.items()),
+                batch_size=1000,
+            )
+            return len(built)
+
+    @classmethod
+    def rows_for(cls, student, semester_num):
+        """The student's rows for a semester, every CA filled in.
+
+        The card, with the cells of open sessions read from the marks in one
+        more query; without a card everything is read from the marks.
+        """
+        card = cls.objects.filter(
+            student=student, semester__department_id=student.department_id, semester__semester=semester_num,
+        ).values_list("semester_id", "rows").first()
+        if card is None:
+            semester = Semester.objects.filter(department_id=student.department_id, semester=semester_num).first()
+            return cls.compute(semester, [student.id])[student.id] if semester else []
+
+        semester_id, rows = card
+        exam_types = [value for value, _ in ExamSession.EXAM_TYPES]
+        if all(et in row for row in rows for et in exam_types):
+            return rows
+        live = {
+            (subject_id, exam_type): None if value is None else str(value)
+            for subject_id, exam_type, value in ExamMark.objects.filter(
+                student=student, session__semester_id=semester_id, session__locked=False,
+            ).values_list("session__subject_id", "session__exam_type", "marks")
+        }
+        for row in rows:
+            for et in exam_types:
+                if et not in row:
+                    row[et] = live.get((row["subject_id"], et))
+        return rows
+
+
+# Result cards follow their sources. Marks are only bulk-written while a
+# session is open, which no card holds; these cover lock/unlock, changes to
+# locked sessions, single-row edits (admin) and subject changes.
+@receiver(pre_save, sender=ExamSession)
+def remember_session_lock(sender, instance, raw=False, **kwargs):
+    if instance.pk and not raw:
+        instance._was_locked = ExamSession.objects.filter(pk=instance.pk).values_list("locked", flat=True).first()
+
+
+@receiver(post_save, sender=ExamSession)
+def refresh_cards_on_session_save(sender, instance, raw=False, **kwargs):
+    # an open session that stays open is in no card
+    if not raw and (instance.locked or getattr(instance, "_was_locked", False)):
+        ResultCard.refresh(instance.semester_id)
+
+
+@receiver(post_delete, sender=ExamSession)
+def refresh_cards_on_session_delete(sender, instance, **kwargs):
+    if instance.locked:
+        ResultCard.refresh(instance.semester_id)
+
+
+def _refresh_mark_card(mark, create=True):
+    # the session may be going in the same cascade
+    semester_id = (ExamSession.objects.filter(pk=mark.session_id, locked=True)
+                   .values_list("semester_id", flat=True).first())
+    if semester_id:
+        ResultCard.refresh(semester_id, [mark.student_id], create=create)
+
+
+@receiver(post_save, sender=ExamMark)
+def refresh_card_on_mark_save(sender, instance, raw=False, **kwargs):
+    if not raw:
+        _refresh_mark_card(instance)
+
+
+@receiver(post_delete, sender=ExamMark)
+def refresh_card_on_mark_delete(sender, instance, **kwargs):
+    # no create: the student may be going in the same cascade
+    _refresh_mark_card(instance, create=False)
+
+
+@receiver(pre_save, sender=Subject)
+def remember_subject_semester(sender, instance, raw=False, **kwargs):
+    if instance.pk and not raw:
+        instance._previous_semester_id = (
+            Subject.objects.filter(pk=instance.pk).values_list("semester_id", flat=True).first())
+
+
+@receiver([post_save, post_delete], sender=Subject)
+def refresh_cards_on_subject_change(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    for semester_id in {instance.semester_id, getattr(instance, "_previous_semester_id", None)} - {None}:
+        ResultCard.refresh(semester_id)
+
+
+# Grade analytics cache (result.analytics); bulk mark writes bump it themselves
+@receiver([post_save, post_delete], sender=ExamMark)
+@receiver([post_save, post_delete], sender=ExamSession)
+@receiver([post_save, post_delete], sender=Subject)
+def invalidate_grade_analytics_on_change(sender, **kwargs):
+    from .analytics import invalidate_grade_analytics
+    invalidate_grade_analytics()
+
+
+# Mark rows for students joining a semester (result.provisioning), so the
+# grade entry page only has to read them. Only on enrollment: other saves
+# (profile edits, last_login on every sign-in) leave the semester as loaded.
+def _enrollment(user):
+    # vars(), so a deferred field is not fetched just to be remembered
+    return vars(user).get("role"), vars(user).get("semester_id")
+
+
+@receiver(post_init, sender=settings.AUTH_USER_MODEL)
+def remember_enrollment(sender, instance, **kwargs):
+    instance._loaded_enrollment = _enrollment(instance)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def provision_marks_on_enrollment(sender, instance, created, raw=False, **kwargs):
+    enrollment, instance._loaded_enrollment = instance._loaded_enrollment, _enrollment(instance)
+    if raw or getattr(instance, "role", None) != "student" or not instance.semester_id:
+        return
+    if not created and enrollment == instance._loaded_enrollment:
+        return
+    from .provisioning import provision
+    provision(instance.semester, student_ids=[instance.pk])
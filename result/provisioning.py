@@ -0,0 +1,61 @@
+from account.models import User
+from subject.models import Subject
+from .analytics import invalidate_grade_analytics
+from .models import ExamMark, ExamSession
+
+# CA exams apply to theory subjects only (see teacher_grade_entry)
+EXAM_TYPES = [value for value, _ in ExamSession.EXAM_TYPES]
+BATCH_SIZE = 1000
+
+
+def provision(semester, student_ids=None, created_by=None, dry_run=False):
+    """Create the missing ExamSession and ExamMark rows of a department-semester.
+
+    Every theory subject of the semester gets a session of each CA exam the
+    semester runs, i.e. already has a session of (teacher_grade_entry opens
+    the first), and every student of the semester (or just student_ids, on
+    enrollment) a mark row, left empty, in each of the semester's sessions.
+    No sessions for CA exams the semester skips: result cards wait for every
+    session to be locked. A fixed handful of statements however large the semester; ignore_conflicts lets concurrent
+    runs race on the unique constraints. Returns (sessions, marks) created,
+    or that would be with dry_run.
+    """
+    department_id = semester.department_id
+    sessions = ExamSession.objects.filter(department_id=department_id, semester=semester)
+    existing = {(subject_id, exam_type): pk for pk, subject_id, exam_type
+                in sessions.values_list("id", "subject_id", "exam_type")}
+    running = {exam_type for _, exam_type in existing}
+    exam_types = [exam_type for exam_type in EXAM_TYPES if exam_type in running]
+    missing = [
+        ExamSession(department_id=department_id, semester=semester, subject_id=subject_id, exam_type=exam_type,
+                    created_by=created_by)
+        for subject_id in Subject.objects.filter(
+            department_id=department_id, semester=semester, subject_type="theory").values_list("id", flat=True)
+        for exam_type in exam_types
+        if (subject_id, exam_type) not in existing
+    ]
+    if student_ids is None:
+        student_ids = User.objects.filter(role="student", department_id=department_id, semester=semester) \
+            .values_list("id", flat=True)
+    student_ids = list(student_ids)
+
+    if dry_run:
+        have = ExamMark.objects.filter(session__in=sessions, student_id__in=student_ids).count()
+        return len(missing), (len(existing) + len(missing)) * len(student_ids) - have
+
+    if missing:
+        ExamSession.objects.bulk_create(missing, ignore_conflicts=True)
+    session_ids = list(sessions.values_list("id", flat=True)) if missing else list(existing.values())
+    have = set(ExamMark.objects.filter(session_id__in=session_ids, student_id__in=student_ids)
+               .values_list("session_id", "student_id"))
+    marks = [ExamMark(session_id=session_id, student_id=student_id)
+             for session_id in session_ids for student_id in student_ids
+             if (session_id, student_id) not in have]
+    if marks:
+        ExamMark.objects.bulk_create(marks, batch_size=BATCH_SIZE, ignore_conflicts=True)
+
+    # bulk_create skips the receivers in result.models; new sessions are
+    # open, so no result card holds them
+    if missing or marks:
+        invalidate_grade_analytics()
+    return len(missing), len(marks)
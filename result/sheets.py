@@ -0,0 +1,242 @@
+import csv
+import io
+import posixpath
+import re
+import zipfile
+import zlib
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from xml.etree.ElementTree import ParseError, iterparse
+
+from django.db import transaction
+
+from .analytics import invalidate_grade_analytics
+from .models import ExamMark, ExamSession
+
+# Uploads with more data rows than this are refused outright
+MAX_ROWS = 5000
+# Spreadsheet marks carry more precision than ExamMark.marks stores
+CENTS = Decimal("0.01")
+
+_MAIN = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+_REL = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+_PKG_REL = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+_COLUMN_RE = re.compile(r"[A-Z]+")
+MAX_COLUMNS = 16384  # XFD, Excel's last column
+# What a damaged or hand-made workbook raises while it is read; the
+# consistency checks below raise ValueError too
+_BROKEN_XLSX = (zipfile.BadZipFile, zlib.error, EOFError, KeyError, StopIteration, ParseError, IndexError, ValueError)
+
+
+class SheetError(Exception):
+    """The upload as a whole can't be read; nothing was written"""
+
+
+def export_header(session):
+    return ["#", "Student Name", "Registration", f"Marks (out of {session.full_marks})"]
+
+
+def export_rows(session, chunk_size=500):
+    """Rows for export_response(); the same columns import_marks() reads back"""
+    rows = (
+        ExamMark.objects.filter(session=session)
+        .order_by("student__first_name", "student__last_name")
+        .values_list("student__first_name", "student__last_name", "student__username",
+                     "student__student_profile__registration_number", "marks")
+        .iterator(chunk_size=chunk_size)
+    )
+    for i, (first, last, username, registration, marks) in enumerate(rows, start=1):
+        yield [i, f"{first} {last}".strip() or username, registration or "", "" if marks is None else float(marks)]
+
+
+# --- reading -------------------------------------------------------------
+
+def _xlsx_first_sheet(zf):
+    """Path of the workbook's first worksheet"""
+    with zf.open("xl/workbook.xml") as f:
+        sheet = next(el for _, el in iterparse(f) if el.tag == f"{_MAIN}sheet")
+    rel_id = sheet.get(f"{_REL}id")
+    with zf.open("xl/_rels/workbook.xml.rels") as f:
+        target = next(el.get("Target") for _, el in iterparse(f)
+                      if el.tag == f"{_PKG_REL}Relationship" and el.get("Id") == rel_id)
+    return target.lstrip("/") if target.startswith("/") else posixpath.normpath(posixpath.join("xl", target))
+
+
+def _xlsx_shared_strings(zf):
+    if "xl/sharedStrings.xml" not in zf.namelist():
+        return []
+    strings = []
+    with zf.open("xl/sharedStrings.xml") as f:
+        for _, el in iterparse(f):
+            if el.tag == f"{_MAIN}si":
+                # rich text is split over several <t> runs
+                strings.append("".join(t.text or "" for t in el.iter(f"{_MAIN}t")))
+                el.clear()
+    return strings
+
+
+def _column_index(ref):
+    match = _COLUMN_RE.match(ref)
+    if match is None:
+        raise ValueError(f"bad cell reference {ref!r}")
+    index = 0
+    for letter in match.group():
+        index = index * 26 + ord(letter) - 64
+    if index > MAX_COLUMNS:
+        raise ValueError(f"bad cell reference {ref!r}")
+    return index - 1
+
+
+def _sheet_rows(sheet, strings):
+    number = 0
+    for _, el in iterparse(sheet):
+        if el.tag != f"{_MAIN}row":
+            continue
+        # empty rows are left out too; keep row numbers true to the sheet
+        number += 1
+        for _ in range(int(el.get("r", number)) - number):
+            number += 1
+            yield []
+        row = []
+        for cell in el.iter(f"{_MAIN}c"):
+            kind = cell.get("t")
+            if kind == "inlineStr":
+                value = "".join(t.text or "" for t in cell.iter(f"{_MAIN}t"))
+            else:
+                value = cell.findtext(f"{_MAIN}v") or ""
+                if kind == "s" and value:
+                    value = strings[int(value)]
+            # empty cells are left out of the XML
+            ref = cell.get("r")
+            if ref:
+                row.extend([""] * (_column_index(ref) - len(row)))
+            row.append(value)
+        el.clear()
+        yield row
+
+
+def _xlsx_rows(upload):
+    """Yield each row of the first sheet as a list of strings.
+
+    The sheet is parsed incrementally and every row is dropped once read, so
+    memory is bounded by the shared-string table, not the sheet. A workbook
+    found damaged part way through raises SheetError like one that can't be
+    opened at all.
+    """
+    try:
+        zf = zipfile.ZipFile(upload)
+        sheet_path = _xlsx_first_sheet(zf)
+        strings = _xlsx_shared_strings(zf)
+        sheet = zf.open(sheet_path)
+    except _BROKEN_XLSX:
+        raise SheetError("The file is not a readable .xlsx workbook.")
+
+    with zf, sheet:
+        try:
+            yield from _sheet_rows(sheet, strings)
+        except _BROKEN_XLSX:
+            raise SheetError("The file is not a readable .xlsx workbook.")
+
+
+def _csv_rows(upload):
+    text = io.TextIOWrapper(upload, encoding="utf-8-sig", newline="")
+    try:
+        yield from csv.reader(text)
+    except UnicodeDecodeError:
+        raise SheetError("The file is not UTF-8 encoded CSV.")
+    except csv.Error:
+        raise SheetError("The file is not a readable CSV file.")
+    finally:
+        text.detach()
+
+
+def read_rows(upload):
+    """Rows of an uploaded .csv or .xlsx file, told apart by content"""
+    head = upload.read(4)
+    upload.seek(0)
+    return _xlsx_rows(upload) if head == b"PK\x03\x04" else _csv_rows(upload)
+
+
+# --- importing -----------------------------------------------------------
+
+def _columns(header):
+    """Positions of the registration and marks columns in a header row"""
+    names = [str(name).strip().lower() for name in header]
+    registration = next((i for i, name in enumerate(names) if name.startswith("reg")), None)
+    marks = next((i for i, name in enumerate(names) if name.startswith("mark")), None)
+    return registration, marks
+
+
+def _parse_mark(value, full_marks):
+    """(Decimal or None for a blank cell, error)"""
+    value = str(value).strip()
+    if value in ("", "-"):
+        return None, None
+    try:
+        mark = Decimal(value)
+    except InvalidOperation:
+        return None, f"'{value}' is not a number"
+    if not mark.is_finite() or not 0 <= mark <= full_marks:
+        return None, f"{value} is outside 0-{full_marks}"
+    return mark.quantize(CENTS, rounding=ROUND_HALF_UP), None
+
+
+def import_marks(session, rows):
+    """Validate a whole sheet against the session and save it in one bulk_update.
+
+    rows is an iterable of cell lists whose first row is the header; students
+    are matched on the registration column and blank marks leave the stored
+    value alone. Returns (changed, errors) where errors lists
+    {"row", "registration", "error"} by sheet row number; if there are any,
+    nothing is written.
+    """
+    rows = iter(rows)
+    header = next(rows, None)
+    if header is None:
+        raise SheetError("The file is empty.")
+    reg_col, marks_col = _columns(header)
+    if reg_col is None or marks_col is None:
+        raise SheetError("The first row must have a 'Registration' and a 'Marks' column.")
+
+    # registration number -> (mark id, stored marks), one query
+    marks = {
+        str(registration).strip(): (mark_id, stored)
+        for mark_id, registration, stored in ExamMark.objects.filter(session=session).values_list(
+            "id", "student__student_profile__registration_number", "marks")
+        if registration
+    }
+
+    width = max(reg_col, marks_col) + 1
+    errors, changes, seen = [], {}, {}
+    for number, row in enumerate(rows, start=2):
+        if number > MAX_ROWS + 1:
+            raise SheetError(f"The file has more than {MAX_ROWS} rows.")
+        row = list(row) + [""] * (width - len(row))
+        registration = str(row[reg_col]).strip()
+        mark, error = _parse_mark(row[marks_col], session.full_marks)
+        if not registration:
+            if mark is not None or error:
+                errors.append({"row": number, "registration": "", "error": "registration number is missing"})
+            continue
+        if registration in seen:
+            error = f"registration number repeats row {seen[registration]}"
+        elif registration not in marks:
+            error = "no student with this registration number in this class"
+        seen.setdefault(registration, number)
+        if error:
+            errors.append({"row": number, "registration": registration, "error": error})
+        elif mark is not None:
+            mark_id, stored = marks[registration]
+            if stored != mark:
+                changes[mark_id] = mark
+
+    if errors:
+        return 0, errors
+    with transaction.atomic():
+        # the session may have been locked since the page was loaded
+        if not ExamSession.objects.select_for_update().filter(pk=session.pk, locked=False).exists():
+            raise SheetError("This exam session is locked and cannot be modified.")
+        ExamMark.objects.bulk_update(
+            [ExamMark(id=mark_id, marks=mark) for mark_id, mark in changes.items()], ["marks"], batch_size=1000)
+    if changes:
+        invalidate_grade_analytics()
+    return len(changes), []
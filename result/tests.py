@@ -1,3 +1,337 @@
-from django.test import TestCase
+import io
+import zipfile
+from unittest import mock
 
-# Create your tests here.
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from account.models import Department, Semester, User
+from subject.models import Subject
+from teacher.models import TeacherProfile
+from attendance.exports import xlsx_stream
+from .models import ExamMark, ExamSession, ResultCard
+from .sheets import SheetError, read_rows
+
+
+class ResultTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.department = Department.objects.create(name="CSE")
+        cls.semester = Semester.objects.create(department=cls.department, semester=3)
+        cls.teacher = User.objects.create_user("teacher", password="pw", role="teacher", department=cls.department)
+        cls.subjects = [cls.make_subject(i) for i in range(2)]
+        for exam_type in ("CA1", "CA2", "CA3", "CA4"):
+            ExamSession.objects.create(department=cls.department, semester=cls.semester, subject=cls.subjects[0],
+                                       exam_type=exam_type)
+        # enrolling provisions a session per CA exam run and subject, and the students' mark rows
+        cls.students = [
+            User.objects.create_user(f"student{i}", password="pw", role="student", first_name=f"Student {i}",
+                                     department=cls.department, semester=cls.semester)
+            for i in range(4)
+        ]
+
+    @classmethod
+    def make_subject(cls, i):
+        subject = Subject.objects.create(name=f"Subject {i:02d}", code=f"CS3{i:02d}", subject_type="theory",
+                                         department=cls.department, semester=cls.semester)
+        subject.teachers.add(cls.teacher)
+        return subject
+
+    @staticmethod
+    def enter_marks(**filters):
+        for mark in ExamMark.objects.filter(**filters).select_related("session"):
+            mark.marks = (mark.student_id + mark.session_id) % mark.session.full_marks
+            mark.save()
+
+
+class StudentResultPageQueryTests(ResultTestCase):
+    def setUp(self):
+        self.client.force_login(self.students[0])
+        self.get()  # the first request after login also saves the session
+
+    def get(self):
+        response = self.client.get(reverse("student_results_page"))
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def count_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.get()
+        return len(queries)
+
+    def add_subjects(self, n):
+        from .provisioning import provision
+        for i in range(len(self.subjects), len(self.subjects) + n):
+            self.subjects.append(self.make_subject(i))
+        provision(self.semester)
+        self.enter_marks()
+
+    def test_query_count_does_not_grow_with_subjects(self):
+        self.enter_marks()
+        expected = self.count_queries()
+        self.add_subjects(10)
+        with self.assertNumQueries(expected):
+            response = self.get()
+        rows = response.context["subject_rows"]
+        self.assertEqual(len(rows), 12)
+        self.assertTrue(all(row["CA1"] != "-" for row in rows))
+
+    def test_query_count_does_not_grow_with_subjects_once_locked(self):
+        self.enter_marks()
+        ExamSession.objects.update(locked=True)
+        ResultCard.refresh(self.semester.id)
+        expected = self.count_queries()
+
+        ExamSession.objects.update(locked=False)
+        ResultCard.refresh(self.semester.id)
+        self.add_subjects(10)
+        ExamSession.objects.update(locked=True)
+        ResultCard.refresh(self.semester.id)
+        self.assertTrue(ResultCard.objects.filter(student=self.students[0]).exists())
+        with self.assertNumQueries(expected):
+            response = self.get()
+        self.assertEqual(len(response.context["subject_rows"]), 12)
+
+
+class ResultCardDeleteTests(ResultTestCase):
+    def setUp(self):
+        self.enter_marks()
+        for session in ExamSession.objects.all():
+            session.locked = True
+            session.save()
+        self.assertEqual(ResultCard.objects.filter(semester=self.semester).count(), len(self.students))
+
+    def test_deleting_a_student_with_locked_marks(self):
+        student = self.students[0]
+        student.delete()
+        self.assertFalse(ResultCard.objects.filter(student_id=student.id).exists())
+        self.assertEqual(ResultCard.objects.filter(semester=self.semester).count(), len(self.students) - 1)
+        call_command("rebuild_result_cards", "--verify", stdout=io.StringIO())
+
+    def test_deleting_one_locked_mark_updates_the_card(self):
+        mark = ExamMark.objects.filter(student=self.students[0], session__exam_type="CA1").first()
+        mark.delete()
+        row = next(r for r in ResultCard.objects.get(student=self.students[0]).rows
+                   if r["code"] == mark.session.subject.code)
+        self.assertIsNone(row["CA1"])
+        call_command("rebuild_result_cards", "--verify", stdout=io.StringIO())
+
+
+class PartialResultCardTests(ResultTestCase):
+    """Cards hold the locked exams of a semester whose other exams are still open"""
+
+    def setUp(self):
+        self.enter_marks()
+        self.lock("CA1")
+        self.client.force_login(self.students[0])
+
+    @staticmethod
+    def lock(exam_type, locked=True):
+        for session in ExamSession.objects.filter(exam_type=exam_type):
+            session.locked = locked
+            session.save()
+
+    def page_rows(self):
+        response = self.client.get(reverse("student_results_page"))
+        return {row["code"]: row for row in response.context["subject_rows"]}
+
+    def expected(self, student, subject, exam_type):
+        mark = ExamMark.objects.get(student=student, session__subject=subject, session__exam_type=exam_type)
+        return "-" if mark.marks is None else str(mark.marks)
+
+    def test_card_holds_locked_cells_and_page_reads_open_ones(self):
+        self.assertEqual(ResultCard.objects.filter(semester=self.semester).count(), len(self.students))
+        card = ResultCard.objects.get(student=self.students[0])
+        self.assertEqual({key for row in card.rows for key in row} - {"subject_id", "name", "code"}, {"CA1"})
+        call_command("rebuild_result_cards", "--verify", stdout=io.StringIO())
+
+        # an open exam's marks show as soon as they are saved, the card is untouched
+        mark = ExamMark.objects.get(student=self.students[0], session__subject=self.subjects[0],
+                                    session__exam_type="CA2")
+        ExamMark.objects.filter(pk=mark.pk).update(marks=24)  # bulk writes skip the receivers
+        rows = self.page_rows()
+        for subject in self.subjects:
+            for exam_type in ("CA1", "CA2", "CA3", "CA4"):
+                self.assertEqual(rows[subject.code][exam_type], self.expected(self.students[0], subject, exam_type))
+        self.assertEqual(rows[self.subjects[0].code]["CA2"], "24.00")
+
+    def test_locking_and_unlocking_updates_the_cards(self):
+        self.lock("CA2")
+        card = ResultCard.objects.get(student=self.students[0])
+        self.assertEqual({key for key in card.rows[0]} - {"subject_id", "name", "code"}, {"CA1", "CA2"})
+        self.lock("CA1", locked=False)
+        self.lock("CA2", locked=False)
+        self.assertFalse(ResultCard.objects.exists())
+        call_command("rebuild_result_cards", "--verify", stdout=io.StringIO())
+
+    def test_opening_a_new_exam_keeps_the_cards(self):
+        ExamSession.objects.filter(exam_type="CA4").delete()
+        built = set(ResultCard.objects.values_list("id", flat=True))
+        self.client.force_login(self.teacher)
+        url = reverse("teacher_grade_entry", args=[self.subjects[0].id, self.semester.id, "CA4"])
+        self.client.post(url, {"open_exam": "1"})
+        self.assertEqual(ExamSession.objects.filter(exam_type="CA4").count(), len(self.subjects))
+        self.assertEqual(set(ResultCard.objects.values_list("id", flat=True)), built)
+
+    def test_query_count_does_not_grow_with_subjects(self):
+        self.page_rows()  # the first request after login also saves the session
+        with CaptureQueriesContext(connection) as queries:
+            self.page_rows()
+        from .provisioning import provision
+        for i in range(2, 12):
+            self.subjects.append(self.make_subject(i))
+        provision(self.semester)
+        self.enter_marks()
+        self.lock("CA1")
+        with self.assertNumQueries(len(queries)):
+            rows = self.page_rows()
+        self.assertEqual(len(rows), 12)
+
+
+class ProvisioningTests(ResultTestCase):
+    def test_only_the_ca_exams_the_semester_runs_get_sessions(self):
+        from .provisioning import provision
+        ExamSession.objects.filter(exam_type__in=["CA3", "CA4"]).delete()
+        self.subjects.append(self.make_subject(2))
+        self.assertEqual(provision(self.semester), (2, 2 * len(self.students)))
+        self.assertEqual(set(ExamSession.objects.values_list("subject_id", "exam_type")),
+                         {(subject.id, exam_type) for subject in self.subjects for exam_type in ("CA1", "CA2")})
+
+        self.enter_marks()
+        for session in ExamSession.objects.all():
+            session.locked = True
+            session.save()
+        self.assertEqual(ResultCard.objects.filter(semester=self.semester).count(), len(self.students))
+
+    def test_opening_a_ca_exam_provisions_it_for_every_subject(self):
+        ExamSession.objects.filter(exam_type="CA4").delete()
+        self.client.force_login(self.teacher)
+        url = reverse("teacher_grade_entry", args=[self.subjects[1].id, self.semester.id, "CA4"])
+        self.assertRedirects(self.client.post(url, {"open_exam": "1"}), url, fetch_redirect_response=False)
+        self.assertEqual(set(ExamSession.objects.filter(exam_type="CA4").values_list("subject_id", flat=True)),
+                         {subject.id for subject in self.subjects})
+        self.assertEqual(ExamMark.objects.filter(session__exam_type="CA4").count(),
+                         len(self.subjects) * len(self.students))
+
+
+    def test_viewing_an_unopened_ca_exam_writes_nothing(self):
+        ExamSession.objects.filter(exam_type="CA4").delete()
+        self.enter_marks()
+        for session in ExamSession.objects.all():
+            session.locked = True
+            session.save()
+        cards = set(ResultCard.objects.values_list("id", "built_at"))
+        self.assertTrue(cards)
+        self.client.force_login(self.teacher)
+        # teacher_base shows the avatar unguarded
+        TeacherProfile.objects.filter(user=self.teacher).update(profile_image="teacher_profiles/avatar.png")
+        url = reverse("teacher_grade_entry", args=[self.subjects[0].id, self.semester.id, "CA4"])
+
+        response = self.client.get(url)
+        self.assertContains(response, 'name="open_exam"')
+        self.assertFalse(ExamSession.objects.filter(exam_type="CA4").exists())
+        self.assertEqual(set(ResultCard.objects.values_list("id", "built_at")), cards)
+
+        # marks posted to an exam nobody opened are refused
+        response = self.client.post(url, {f"mark_{self.students[0].id}": "10"})
+        self.assertRedirects(response, url, fetch_redirect_response=False)
+        self.assertFalse(ExamSession.objects.filter(exam_type="CA4").exists())
+
+    def test_student_saves_provision_only_on_enrollment(self):
+        from .provisioning import provision
+        student = self.students[0]
+        with mock.patch("result.provisioning.provision", wraps=provision) as provisioned:
+            student.first_name = "Renamed"
+            student.save()
+            User.objects.get(pk=student.pk).save()
+            provisioned.assert_not_called()
+
+            other = Semester.objects.create(department=self.department, semester=4)
+            student.semester = other
+            student.save()
+            provisioned.assert_called_once_with(other, student_ids=[student.pk])
+            student.save()
+            provisioned.assert_called_once()
+
+
+SHEET = ('<?xml version="1.0" encoding="UTF-8"?>'
+         '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>{}</sheetData></worksheet>')
+SHARED_STRINGS = ('<?xml version="1.0" encoding="UTF-8"?>'
+                  '<sst xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">{}</sst>')
+
+
+def workbook(rows_xml=None, sheet=None, shared=()):
+    """An .xlsx upload whose first sheet is `sheet` (or <sheetData> holding rows_xml)"""
+    source = zipfile.ZipFile(io.BytesIO(b"".join(xlsx_stream("Marks", ["Registration", "Marks"], []))))
+    out = io.BytesIO()
+    with zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED) as zf:
+        for name in source.namelist():
+            data = source.read(name)
+            if name == "xl/worksheets/sheet1.xml":
+                data = (sheet if sheet is not None else SHEET.format(rows_xml)).encode()
+            zf.writestr(name, data)
+        if shared:
+            zf.writestr("xl/sharedStrings.xml",
+                        SHARED_STRINGS.format("".join(f"<si><t>{text}</t></si>" for text in shared)))
+    out.seek(0)
+    return out
+
+
+class SheetReadTests(SimpleTestCase):
+    def test_reads_sparse_rows_and_shared_strings(self):
+        upload = workbook('<row r="1"><c r="A1" t="s"><v>0</v></c><c r="C1"><v>7</v></c></row>'
+                          '<row r="3"><c r="B3" t="inlineStr"><is><t>x</t></is></c></row>',
+                          shared=["Registration"])
+        self.assertEqual(list(read_rows(upload)), [["Registration", "", "7"], [], ["", "x"]])
+
+    def test_damaged_workbooks_raise_sheet_error(self):
+        valid = SHEET.format('<row r="1"><c r="A1"><v>1</v></c></row>' * 50)
+        cases = {
+            "truncated sheet": workbook(sheet=valid[:len(valid) // 2]),
+            "shared string out of range": workbook('<row r="1"><c r="A1" t="s"><v>5</v></c></row>', shared=["a"]),
+            "shared string not a number": workbook('<row r="1"><c r="A1" t="s"><v>x</v></c></row>', shared=["a"]),
+            "lowercase cell reference": workbook('<row r="1"><c r="a1"><v>1</v></c></row>'),
+            "column past XFD": workbook('<row r="1"><c r="ZZZZZZZZ1"><v>1</v></c></row>'),
+            "row number not a number": workbook('<row r="one"><c r="A1"><v>1</v></c></row>'),
+            "not a zip": io.BytesIO(b"PK\x03\x04 but not really a zip file"),
+        }
+        for name, upload in cases.items():
+            with self.subTest(name), self.assertRaises(SheetError):
+                list(read_rows(upload))
+
+    def test_unreadable_csv_raises_sheet_error(self):
+        with self.assertRaises(SheetError):
+            list(read_rows(io.BytesIO(b"Registration,Marks\nR1,\xff\xfe")))
+
+
+class MarksImportViewTests(ResultTestCase):
+    def test_damaged_workbook_is_reported_not_a_server_error(self):
+        self.client.force_login(self.teacher)
+        url = reverse("teacher_grade_entry", args=[self.subjects[0].id, self.semester.id, "CA1"])
+        header = '<row><c t="inlineStr"><is><t>Registration</t></is></c><c t="inlineStr"><is><t>Marks</t></is></c></row>'
+        valid = SHEET.format(header + '<row><c><v>1</v></c><c><v>1</v></c></row>' * 50)
+        upload = SimpleUploadedFile("marks.xlsx", workbook(sheet=valid[:len(valid) // 2]).getvalue())
+        response = self.client.post(url, {"sheet": upload})
+        self.assertRedirects(response, url, fetch_redirect_response=False)
+        self.assertEqual([str(m) for m in response.wsgi_request._messages],
+                         ["The file is not a readable .xlsx workbook."])
+
+
+class GradeAnalyticsParamsTests(ResultTestCase):
+    def test_department_parameter_is_validated(self):
+        self.enter_marks()
+        manager = User.objects.create_user("manager", password="pw", role="management")
+        self.client.force_login(manager)
+        url = reverse("grade_analytics_api")
+        for department, status in [("abc", 404), ("1.5", 404), ("99999", 404),
+                                   (str(self.department.id), 200), ("", 200)]:
+            with self.subTest(department=department):
+                self.assertEqual(self.client.get(url, {"department": department}).status_code, status)
+
+    def test_other_roles_are_refused(self):
+        self.client.force_login(self.teacher)
+        self.assertEqual(self.client.get(reverse("grade_analytics_api")).status_code, 403)
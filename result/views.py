@@ -1,12 +1,27 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
+from django.core.exceptions import PermissionDenied
+from django.http import JsonResponse
 from django.utils.timezone import now
+from django.db import transaction
 from django.db.models import Q
 
-from .models import ExamSession, ExamMark
-from account.models import Semester, Department, User
+from .models import ExamSession, ExamMark, ResultCard
+from .analytics import cached_semester_report, invalidate_grade_analytics
+from .provisioning import provision
+from .sheets import SheetError, export_header, export_rows, import_marks, read_rows
+from account.models import Semester, User
 from subject.models import Subject
+from college_portal.utils import analytics_department
+from attendance.exports import EXPORT_FORMATS, export_response
+
+
+def _can_grade(user, subject):
+    # Teachers assigned to the subject, or the HOD of its department
+    is_assigned_teacher = subject.teachers.filter(id=user.id).exists()
+    is_hod = user.role == 'hod' and user.department_id == subject.department_id
+    return is_assigned_teacher or is_hod
 
 
 @login_required
@@ -43,9 +58,7 @@ def teacher_grade_entry(request, subject_id, semester_id, exam_type):
     semester = get_object_or_404(Semester, id=semester_id)
 
     # Only allow teacher assigned to this subject or HOD of department
-    is_assigned_teacher = subject.teachers.filter(id=request.user.id).exists()
-    is_hod = request.user.role == 'hod' and request.user.department_id == subject.department_id
-    if not (is_assigned_teacher or is_hod):
+    if not _can_grade(request.user, subject):
         messages.error(request, 'You are not allowed to grade this subject.')
         return redirect('teacher_grades')
 
@@ -54,31 +67,50 @@ def teacher_grade_entry(request, subject_id, semester_id, exam_type):
         messages.error(request, 'CA exams apply to theory subjects only.')
         return redirect('teacher_grades')
 
-    # Ensure/create session
-    session, created = ExamSession.objects.get_or_create(
-        department=subject.department,
-        semester=semester,
-        subject=subject,
-        exam_type=exam_type,
-        defaults={
-            'created_by': request.user,
-            'full_marks': 25,
-        }
-    )
-
-    # Build/ensure mark rows for students in that semester+department
-    students = User.objects.filter(role='student', department=subject.department, semester=semester).order_by('first_name', 'last_name')
-    existing = {m.student_id: m for m in ExamMark.objects.filter(session=session)}
-    to_create = []
-    for stu in students:
-        if stu.id not in existing:
-            to_create.append(ExamMark(session=session, student=stu))
-    if to_create:
-        ExamMark.objects.bulk_create(to_create)
+    # Sessions and mark rows are provisioned ahead (provision_exam_marks, and on
+    # student enrollment) for the CA exams the semester runs. A GET only reads:
+    # the first session of a CA exam is opened with an explicit POST, and
+    # provisioning then adds it for the other subjects.
+    lookup = {'department': subject.department, 'semester': semester, 'subject': subject, 'exam_type': exam_type}
+    if request.method == 'POST' and 'open_exam' in request.POST:
+        ExamSession.objects.get_or_create(**lookup, defaults={'created_by': request.user, 'full_marks': 25})
+        provision(semester, created_by=request.user)
+        messages.success(request, f'{exam_type} is open for marks.')
+        return redirect('teacher_grade_entry', subject_id=subject_id, semester_id=semester_id, exam_type=exam_type)
 
-    marks_qs = ExamMark.objects.filter(session=session).select_related('student').order_by('student__first_name', 'student__last_name')
+    session = ExamSession.objects.filter(**lookup).first()
+    if session is None:
+        if request.method == 'POST':
+            messages.error(request, f'{exam_type} has not been opened yet.')
+            return redirect('teacher_grade_entry', subject_id=subject_id, semester_id=semester_id, exam_type=exam_type)
+        return render(request, 'result/teacher_grade_entry.html', {
+            'session': None,
+            'exam_type': exam_type,
+            'subject': subject,
+            'semester': semester,
+        })
+    students = User.objects.filter(role='student', department=subject.department, semester=semester)
+    unprovisioned = students.exclude(exammark__session=session).count()
+
+    marks_qs = ExamMark.objects.filter(session=session).select_related('student__student_profile').order_by('student__first_name', 'student__last_name')
+    import_errors = []
+
+    if request.method == 'POST' and 'sheet' in request.FILES:
+        # Whole-sheet import; any bad row rejects the file and is listed below the table
+        if session.locked:
+            messages.error(request, 'This exam session is locked and cannot be modified.')
+            return redirect('teacher_grade_entry', subject_id=subject_id, semester_id=semester_id, exam_type=exam_type)
+        try:
+            changed, import_errors = import_marks(session, read_rows(request.FILES['sheet']))
+        except SheetError as e:
+            messages.error(request, str(e))
+            return redirect('teacher_grade_entry', subject_id=subject_id, semester_id=semester_id, exam_type=exam_type)
+        if not import_errors:
+            messages.success(request, f'Marks imported: {changed} changed.')
+            return redirect('teacher_grade_entry', subject_id=subject_id, semester_id=semester_id, exam_type=exam_type)
+        messages.error(request, f"Nothing was imported: {len(import_errors)} row{'s' if len(import_errors) != 1 else ''} to fix.")
 
-    if request.method == 'POST':
+    elif request.method == 'POST':
         if session.locked:
             messages.error(request, 'This exam session is locked and cannot be modified.')
             return redirect('teacher_grade_entry', subject_id=subject_id, semester_id=semester_id, exam_type=exam_type)
@@ -97,25 +129,48 @@ def teacher_grade_entry(request, subject_id, semester_id, exam_type):
                     mark.marks = num
                     updates.append(mark)
         if updates:
-            ExamMark.objects.bulk_update(updates, ['marks'])
+            with transaction.atomic():
+                # the session may have been locked since it was read above
+                if not ExamSession.objects.select_for_update().filter(pk=session.pk, locked=False).exists():
+                    messages.error(request, 'This exam session is locked and cannot be modified.')
+                    return redirect('teacher_grade_entry', subject_id=subject_id, semester_id=semester_id, exam_type=exam_type)
+                ExamMark.objects.bulk_update(updates, ['marks'])
+            invalidate_grade_analytics()
             messages.success(request, 'Marks saved successfully.')
         return redirect('teacher_grade_entry', subject_id=subject_id, semester_id=semester_id, exam_type=exam_type)
 
     return render(request, 'result/teacher_grade_entry.html', {
         'session': session,
+        'exam_type': exam_type,
         'subject': subject,
         'semester': semester,
         'students': marks_qs,
+        'unprovisioned': unprovisioned,
+        'import_errors': import_errors,
     })
 
 
+@login_required
+def export_exam_marks(request, session_id):
+    session = get_object_or_404(ExamSession.objects.select_related('subject', 'semester'), id=session_id)
+    if not _can_grade(request.user, session.subject):
+        messages.error(request, 'You are not allowed to grade this subject.')
+        return redirect('teacher_grades')
+
+    fmt = request.GET.get('format', 'xlsx')
+    fmt = fmt if fmt in EXPORT_FORMATS else 'xlsx'
+    filename = f"marks_{session.exam_type}_{session.subject.name}_sem{session.semester.semester}".replace(' ', '_')
+    return export_response(
+        request, fmt, filename, f"{session.exam_type} {session.subject.name}",
+        export_header(session), export_rows(session),
+    )
+
+
 @login_required
 def lock_exam_session(request, session_id):
     session = get_object_or_404(ExamSession, id=session_id)
     # Teachers of the subject or HOD of department can lock
-    is_assigned_teacher = session.subject.teachers.filter(id=request.user.id).exists()
-    is_hod = request.user.role == 'hod' and request.user.department_id == session.department_id
-    if not (is_assigned_teacher or is_hod):
+    if not _can_grade(request.user, session.subject):
         messages.error(request, 'You are not allowed to lock this exam.')
         return redirect('teacher_grades')
 
@@ -127,6 +182,48 @@ def lock_exam_session(request, session_id):
     return redirect('teacher_grade_entry', subject_id=session.subject_id, semester_id=session.semester_id, exam_type=session.exam_type)
 
 
+#---------------HOD / management grade analytics----------------
+def _grade_analytics_params(request):
+    """(department, semester number) for semester_report, or None if not allowed.
+
+    The semester defaults to the one with the latest exam.
+    """
+    try:
+        department = analytics_department(request)
+    except PermissionDenied:
+        return None
+
+    try:
+        semester_num = int(request.GET.get('sem', ''))
+    except ValueError:
+        sessions = ExamSession.objects.filter(department=department) if department else ExamSession.objects.all()
+        semester_num = sessions.order_by('-created_at').values_list('semester__semester', flat=True).first() or 1
+    return department, semester_num
+
+
+@login_required
+def hod_grade_analytics(request):
+    if getattr(request.user, 'role', None) != 'hod':
+        return redirect('index')
+    params = _grade_analytics_params(request)
+    if params is None:
+        return redirect('index')
+
+    return render(request, 'hod/grade_analytics.html', {
+        'report': cached_semester_report(*params),
+        'sem_range': list(range(1, 9)),
+        'query': request.GET.urlencode(),
+    })
+
+
+@login_required
+def grade_analytics_api(request):
+    params = _grade_analytics_params(request)
+    if params is None:
+        return JsonResponse({'error': 'Not authorized'}, status=403)
+    return JsonResponse(cached_semester_report(*params))
+
+
 @login_required
 def student_result_page(request):
     if request.user.role != 'student':
@@ -142,29 +239,18 @@ def student_result_page(request):
     except (TypeError, ValueError):
         sel_sem_num = current_sem_num
 
-    # Subject list for selected semester
-    subjects = Subject.objects.filter(department=user.department, semester__semester=sel_sem_num).order_by('name') if sel_sem_num else []
-
-    # sessions of selected sem
-    sessions = ExamSession.objects.filter(
-        department=user.department,
-        semester__semester=sel_sem_num
-    ).select_related('subject').order_by('subject__name', 'exam_type') if sel_sem_num else []
-
-    # Build CA table rows per subject
+    # CA table rows per subject: locked exams from the precomputed card, open
+    # ones read from the marks (see ResultCard)
     subject_rows = []
-    for subj in subjects:
+    for card_row in (ResultCard.rows_for(user, sel_sem_num) if sel_sem_num else []):
         row = {
-            'name': subj.name,
-            'code': subj.code,
+            'name': card_row['name'],
+            'code': card_row['code'],
             'full_marks': 25,
-            'CA1': '-', 'CA2': '-', 'CA3': '-', 'CA4': '-',
         }
         for et in ['CA1', 'CA2', 'CA3', 'CA4']:
-            s = next((x for x in sessions if x.subject_id == subj.id and x.exam_type == et), None)
-            if s:
-                m = ExamMark.objects.filter(session=s, student=user).first()
-                row[et] = m.marks if m and m.marks is not None else '-'
+            value = card_row.get(et)
+            row[et] = value if value is not None else '-'
         subject_rows.append(row)
 
     # SGPA entries and average
@@ -4,7 +4,9 @@ from django.contrib import messages
 from .models import TeacherProfile
 from .forms import TeacherProfileForm
 from account.models import User, Semester
-from attendance.models import AttendanceEntry
+from attendance.models import AttendanceEntry, AttendanceSummary
+
+RECENT_ENTRIES = 50
 
 
 @login_required
@@ -59,12 +61,14 @@ def teacher_student_detail(request, user_id):
 
     student = get_object_or_404(User, id=user_id, role='student', department=request.user.department)
 
-    # Attendance records for this student
+    # Per-subject totals come from the summary table; only the latest
+    # records are listed
+    subject_stats = AttendanceSummary.subject_stats(student)
     entries = (
         AttendanceEntry.objects
         .filter(student=student)
         .select_related('attendance__subject', 'attendance__semester')
-        .order_by('-attendance__date')
+        .order_by('-attendance__date')[:RECENT_ENTRIES]
     )
 
     # Dummy results for now
@@ -77,5 +81,7 @@ def teacher_student_detail(request, user_id):
     return render(request, 'teacher/student_detail.html', {
         'student': student,
         'entries': entries,
+        'subject_stats': subject_stats,
+        'attendance_total': sum(rec['total'] for rec in subject_stats),
         'results': results,
     })